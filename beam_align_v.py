@@ -34,6 +34,13 @@ file_extension = '.TTX'
 display_before_removing = False
 # Put here the number of the image(s) to remove
 image_to_remove = []
+# Automatic screening of the acquisitions (empty, saturated, peak out of the detector, outlier fit) : True or False
+screening = True
+# Count at which the detector saturates (None : plateau at the maximum of an image)
+saturation = None
+# Global fit : the peaks of all the images are refined together with the misalignment (h, l0), their positions
+# given by the model (more precise than the fit of the positions of the images) : True or False
+global_fit = False
 # Display before removing : True or False
 display_after_removing = False
 
@@ -46,12 +53,35 @@ filename_clean = filename + '_clean'
 file_extension_clean = file_extension
 
 # Windows position [pix] for peak fit : you have to see all the pic and around 30 pixel of background on each side
-xmin = 820
-xmax = 880
+# (None : automatic, window of the most intense peak followed along the scan)
+xmin = None
+xmax = None
 
-# Size of the background window for each side of the peak
-size_window_background_left = 10
-size_window_background_right = 10
+# Size of the background window for each side of the peak (None : automatic, from the width of the peak)
+size_window_background_left = None
+size_window_background_right = None
+
+# Streaming analysis, one acquisition read and fitted at a time (for very large scans, no display) : True or False
+stream = False
+
+# Live analysis, following the .TTX file while the scan is running : True or False
+follow = False
+# Time without new acquisition after which the live analysis stops [s]
+follow_timeout = 60
+
+# Number of processes fitting the peaks (1 : no parallel fit)
+number_of_worker = 1
+
+# Directory of the fit cache, the fits are reused by the next runs (None : no cache)
+fit_cache_directory = None
+
+# Directory of the results of the stages of the analysis, only the stages whose inputs changed are
+# computed again by the next runs (None : every stage is computed)
+pipeline_directory = None
+
+# Headless mode, for unattended runs : the figures are not shown but rendered in plot_directory (None : not rendered)
+headless = False
+plot_directory = None
 
 # Saving Parameters on .PARAM file
 save_PARAMfile_beam_align_v = True
@@ -75,6 +105,9 @@ parameters_beam_align_v["filename_beam_align_v"] = filename
 parameters_beam_align_v["file_extension_beam_align_v"] = file_extension
 parameters_beam_align_v["display_before_removing_beam_align_v"] = display_before_removing
 parameters_beam_align_v["image_to_remove_beam_align_v"] = image_to_remove
+parameters_beam_align_v["screening_beam_align_v"] = screening
+parameters_beam_align_v["saturation_beam_align_v"] = saturation
+parameters_beam_align_v["global_fit_beam_align_v"] = global_fit
 parameters_beam_align_v["display_after_removing_beam_align_v"] = display_after_removing
 parameters_beam_align_v["directory_clean_beam_align_v"] = directory_clean
 parameters_beam_align_v["filename_clean_beam_align_v"] = filename_clean
@@ -84,6 +117,14 @@ parameters_beam_align_v["window_xmin_beam_align_v"] = xmin
 parameters_beam_align_v["window_xmax_beam_align_v"] = xmax
 parameters_beam_align_v["size_window_background_left_beam_align_v"] = size_window_background_left
 parameters_beam_align_v["size_window_background_right_beam_align_v"] = size_window_background_right
+parameters_beam_align_v["stream_beam_align_v"] = stream
+parameters_beam_align_v["follow_beam_align_v"] = follow
+parameters_beam_align_v["follow_timeout_beam_align_v"] = follow_timeout
+parameters_beam_align_v["number_of_worker_beam_align_v"] = number_of_worker
+parameters_beam_align_v["fit_cache_directory_beam_align_v"] = fit_cache_directory
+parameters_beam_align_v["headless_beam_align_v"] = headless
+parameters_beam_align_v["plot_directory_beam_align_v"] = plot_directory
+parameters_beam_align_v["pipeline_directory_beam_align_v"] = pipeline_directory
 
 if __name__ == '__main__':
 
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the start-up time of the entry-point scripts:
+    each script is imported in a new interpreter with python -X importtime (the analysis is not launched),
+    the total import time and the slowest imported packages are printed.
+    Run from the root of the project : python benchmarks/import_time.py
+"""
+
+
+import os
+import subprocess
+import sys
+
+
+# Entry-point scripts of the project
+SCRIPTS = ['beam_align_h', 'beam_align_v', 'detector_calibration', 'gonio_center', 'read_image', 'sin2psi_stress']
+# Number of interpreter launched for each script (the best time is kept)
+NUMBER_OF_RUN = 5
+# Number of slowest packages displayed for each script
+NUMBER_OF_PACKAGE = 5
+
+
+def import_profile(script):
+    """
+    Import a script in a new interpreter and return {module : (self time, cumulative time)} in [us]
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {script}'],
+                            cwd=root, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True)
+
+    profile = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, module = line[len('import time:'):].split('|')
+        profile[module.strip()] = (int(self_time), int(cumulative_time))
+    return profile
+
+
+def top_level_packages(profile):
+    """
+    Cumulative import time of the top-level packages (numpy, scipy, matplotlib...) [us]
+    """
+    packages = dict()
+    for module, (self_time, cumulative_time) in profile.items():
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_time
+    return packages
+
+
+if __name__ == '__main__':
+
+    print(f'{"script":22s} {"import [ms]":>12s}   slowest packages [ms]')
+    for script in SCRIPTS:
+        profiles = [import_profile(script) for run in range(NUMBER_OF_RUN)]
+        best = min(profiles, key=lambda profile: profile[script][1])
+
+        packages = top_level_packages(best)
+        slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:NUMBER_OF_PACKAGE]
+        slowest = ', '.join(f'{package} {time / 1000:.0f}' for package, time in slowest)
+        print(f'{script:22s} {best[script][1] / 1000:12.0f}   {slowest}')
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+X-Ray Diffraction for Solid Mechanics
+
+Author: Olivier Castelnau (olivier.castelnau@ensam.eu), lab PIMM (CNRS UMR8006) at ENSAM Paris, France.
+        Vincent MICHEL (vincent.michel@ensam.eu)
+        Damien LANASPEZE (damien.lanaspeze@mines-paristech.fr)
+
+Program for the analysis of a whole campaign:
+    every .TTX / .FDT scan found under the root directory is analysed with the analysis of its folder,
+    the scans are analysed in parallel and the results are gathered in one table.
+"""
+
+
+import time
+
+from modules import c_r
+from utils import parameters_files
+
+
+# Common parameters
+pixsize = 0.14  # mm
+R = 295  # mm
+
+# Root directory of the scans
+root = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\experiments'
+
+# Job of each folder : analysis and template .PARAM file of its parameters
+# (the file, the removed acquisitions, the display and the figures are set by the campaign for each scan)
+directory_templates = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\parameters'
+jobs = dict()
+jobs["omega_scan"] = ('beam_align_h', '24_April_2020_beam_align_h')
+jobs["psi_scan"] = ('beam_align_v', '24_April_2020_beam_align_v')
+jobs["normal_incidence"] = ('detector_calibration', '24_April_2020_detector_calibration')
+jobs["LaB6"] = ('read_image', '24_April_2020_read_image')
+jobs["multi_hkl_pic"] = ('read_image', '24_April_2020_read_image')
+
+# Results : table of the results, figures, .CALI files and log of each scan
+directory_results = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\results'
+filename_results = time.strftime("%d_%B_%Y") + '_campaign'
+file_extension_results = '.CSV'
+
+# Number of scans analysed at the same time
+number_of_worker = 4
+
+# Saving Parameters on .PARAM file
+save_PARAMfile_campaign = False
+directory_PARAM_campaign = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\parameters'
+filename_PARAM_campaign = time.strftime("%d_%B_%Y") + '_campaign'
+file_extension_PARAM_campaign = '.PARAM'
+
+# Uploading parameters from a .PARAM file (!! the parameters use by the pragram will not be the previous parameters !!)
+upload_PARAM_file = False
+directory_upload_PARAM_campaign = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\parameters'
+filename_upload_PARAM_campaign = '24_April_2020' + '_campaign'
+file_extension_upload_PARAM = '.PARAM'
+
+# Parameters dictionnary
+parameters_campaign = dict()
+parameters_campaign["pixsize"] = pixsize
+parameters_campaign["goniometric_ray"] = R
+parameters_campaign["root_campaign"] = root
+parameters_campaign["directory_templates_campaign"] = directory_templates
+parameters_campaign["jobs_campaign"] = jobs
+parameters_campaign["directory_results_campaign"] = directory_results
+parameters_campaign["filename_results_campaign"] = filename_results
+parameters_campaign["file_extension_results_campaign"] = file_extension_results
+parameters_campaign["number_of_worker_campaign"] = number_of_worker
+
+if __name__ == '__main__':
+
+    if save_PARAMfile_campaign:
+        parameters_files.save_param_file(parameters_campaign,
+                                         directory_PARAM_campaign,
+                                         filename_PARAM_campaign,
+                                         file_extension_PARAM_campaign)
+
+    if upload_PARAM_file:
+        parameters_campaign = parameters_files.upload_param_file(directory_upload_PARAM_campaign,
+                                                                 filename_upload_PARAM_campaign,
+                                                                 file_extension_upload_PARAM)
+
+    # Lauch analysis
+    c_r.campaign_analysis(parameters_campaign)
@@ -36,6 +36,11 @@ l1 = [i for i in range(1, 24)]
 l2 = [42, 110, 251]
 l3 = [j for j in range(275, 302)]
 image_to_remove = l1 + l2 + l3
+# Automatic screening of the acquisitions (empty, saturated, peak out of the detector, outlier fit) : True or False
+# (added to image_to_remove, check its rejections with display_before_removing before enabling it)
+screening = False
+# Count at which the detector saturates (None : plateau at the maximum of an image)
+saturation = None
 # Display before removing : True or False
 display_after_removing = False
 
@@ -51,7 +56,24 @@ save_CALI = True
 # .CALI file information (saving .CALI file)
 directory_CALI = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\calibration'
 filename_CALI = filename_clean
-file_extension_CALI = '.CALI'
+file_extension_CALI = '.CALI'  # .CALI (text) or .CALB (binary)
+
+# Size of the background windows at the edges of the images [pix] (None : automatic, from the width of the peaks)
+size_window_background = None
+
+# Number of processes fitting the peaks (1 : no parallel fit)
+number_of_worker = 1
+
+# Directory of the fit cache, the fits are reused by the next runs (None : no cache)
+fit_cache_directory = None
+
+# Directory of the results of the stages of the analysis, only the stages whose inputs changed are
+# computed again by the next runs (None : every stage is computed)
+pipeline_directory = None
+
+# Headless mode, for unattended runs : the figures are not shown but rendered in plot_directory (None : not rendered)
+headless = False
+plot_directory = None
 
 # Saving Parameters on .PARAM file
 save_PARAMfile_detector_calibration = True
@@ -75,6 +97,8 @@ parameters_detector_calibration["filename_detector_calibration"] = filename
 parameters_detector_calibration["file_extension_detector_calibration"] = file_extension
 parameters_detector_calibration["display_before_removing_detector_calibration"] = display_before_removing
 parameters_detector_calibration["image_to_remove_detector_calibration"] = image_to_remove
+parameters_detector_calibration["screening_detector_calibration"] = screening
+parameters_detector_calibration["saturation_detector_calibration"] = saturation
 parameters_detector_calibration["display_after_removing_detector_calibration"] = display_after_removing
 parameters_detector_calibration["directory_clean_detector_calibration"] = directory_clean
 parameters_detector_calibration["filename_clean_detector_calibration"] = filename_clean
@@ -84,6 +108,12 @@ parameters_detector_calibration["directory_CALI_detector_calibration"] = directo
 parameters_detector_calibration["filename_CALI_detector_calibration"] = filename_CALI
 parameters_detector_calibration["file_extension_CALI_detector_calibration"] = file_extension_CALI
 parameters_detector_calibration["save_CALI_detector_calibration"] = save_CALI
+parameters_detector_calibration["size_window_background_detector_calibration"] = size_window_background
+parameters_detector_calibration["number_of_worker_detector_calibration"] = number_of_worker
+parameters_detector_calibration["fit_cache_directory_detector_calibration"] = fit_cache_directory
+parameters_detector_calibration["headless_detector_calibration"] = headless
+parameters_detector_calibration["plot_directory_detector_calibration"] = plot_directory
+parameters_detector_calibration["pipeline_directory_detector_calibration"] = pipeline_directory
 parameters_detector_calibration["pixsize"] = pixsize
 parameters_detector_calibration["goniometric_ray"] = R
 
@@ -38,6 +38,10 @@ z0 = 0
 e_max = 10
 z0_max = 20
 
+# Headless mode, for unattended runs : the figures are not shown but rendered in plot_directory (None : not rendered)
+headless = False
+plot_directory = None
+
 # Saving Parameters on .PARAM file
 save_PARAMfile_gonio_center = True
 directory_PARAM_gonio_center = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\parameters'
@@ -61,6 +65,8 @@ parameters_gonio_center["e_gonio_center"] = e
 parameters_gonio_center["z0_gonio_center"] = z0
 parameters_gonio_center["e_max_gonio_center"] = e_max
 parameters_gonio_center["z0_max_gonio_center"] = z0_max
+parameters_gonio_center["headless_gonio_center"] = headless
+parameters_gonio_center["plot_directory_gonio_center"] = plot_directory
 
 if __name__ == '__main__':
 
@@ -8,11 +8,19 @@ Program for the alignment of diffractometers with 1d detector:
 
 
 import numpy as np
-from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
 
 from utils import display
+from utils import fit_cache
+from utils import fit_one_peak
+from utils import global_fit
+from utils import linear_fit
 from utils import maths_functions
+from utils import models
+from utils import pipeline
+from utils import plots
+from utils import scan_data
+from utils import scan_files
+from utils import screening
 from utils import seifert_data_TTX
 
 
@@ -31,6 +39,53 @@ def beam_pos_h(data, *param):
     return ll
 
 
+def beam_pos_h_design(data):
+    """
+    Columns of the design matrix of beam_pos_h, which is linear in its parameters :
+    ll = e * column_e + l0 * 1
+    """
+    tth, ome = data
+    deg2rad = np.pi / 180.
+    column_e = -np.sin((tth - ome) * deg2rad) / np.sin(ome * deg2rad)
+    return np.stack([column_e, np.ones(np.shape(column_e))], axis=-1)
+
+
+def beam_pos_h_jac(data, *param):
+    """
+    Jacobian of beam_pos_h : as the model is linear, it is its design matrix
+    """
+    return beam_pos_h_design(data)
+
+
+models.register('beam_pos_h', beam_pos_h, beam_pos_h_jac, ('e', 'l0'), design=beam_pos_h_design)
+
+
+def fit_beam_pos_h(scan, guess, fit, fit_flags=None):
+    """
+    Fit beam_pos_h on the peak positions of the images (stage of the analysis), without the fits not converged
+    nor the ones rejected by the screening (fit_flags, None : all the fits)
+    return optimal parameters (e, l0) and covariance
+    """
+    keep = np.ones(len(scan), dtype=bool) if fit_flags is None else screening.kept_images(fit_flags)
+    keep &= fit[2]
+    peakpos = fit[0][keep, 0]
+    p0 = [0, guess[0]]  # initail guess for beam misalignment = 0 ; USING INITIAL GUESS FOR PEAK POSITION
+    return models.fit('beam_pos_h', (scan.tth[keep], scan.omega[keep]), peakpos, p0=p0)
+
+
+def fit_beam_pos_h_global(scan, fit, model, xmin, xmax, keep):
+    """
+    Global fit of the peaks of the kept images (keep : boolean array) with their positions given by beam_pos_h
+    (stage of the analysis), starting from the fits of the images and of the model
+    return optimal parameters (e, l0), covariance, optimal [x0, IM, H, A, B] of the peaks used and convergence
+    """
+    keep = keep & np.all(np.isfinite(fit[0]), axis=1)
+    x = np.arange(0, scan.number_of_pixel, 1)
+    design = beam_pos_h_design((scan.tth[keep], scan.omega[keep]))
+    return global_fit.fit_global_gauss_backg(x[xmin:xmax], scan.cts[keep, xmin:xmax], design, fit[0][keep, 1:],
+                                             model[0])
+
+
 def beam_align_h_analysis(dic):
     """
     Beam align h analysis using parameters stored in the dic
@@ -51,60 +106,87 @@ def beam_align_h_analysis(dic):
     xmax = dic["window_xmax_beam_align_h"]
     size_window_background_left = dic["size_window_background_left_beam_align_h"]
     size_window_background_right = dic["size_window_background_right_beam_align_h"]
+    automatic_screening = dic.get("screening_beam_align_h", False)
+    saturation = dic.get("saturation_beam_align_h", None)
+    number_of_worker = dic.get("number_of_worker_beam_align_h", 1)
+    fit_cache_directory = dic.get("fit_cache_directory_beam_align_h", None)
+    cache = None if fit_cache_directory is None else fit_cache.FitCache(fit_cache_directory)
+    headless = dic.get("headless_beam_align_h", False)
+    plot_directory = dic.get("plot_directory_beam_align_h", None)
+    plot_prefix = dic.get("plot_prefix_beam_align_h", '')
+    pipeline_directory = dic.get("pipeline_directory_beam_align_h", None)
+    global_fit_model = dic.get("global_fit_beam_align_h", False)
+
+    # Streaming analysis : one acquisition at a time
+    if dic.get("stream_beam_align_h", False):
+        return beam_align_h_stream_analysis(dic)
+
+    # Live analysis : following the file while the scan is running
+    if dic.get("follow_beam_align_h", False):
+        return beam_align_h_follow_analysis(dic)
+
+    # Destination of the figures : shown, or rendered in the background in headless mode
+    plotter = plots.Plotter(headless, plot_directory, prefix=plot_prefix)
+
+    # Stages of the analysis : the stages whose inputs did not change are loaded from pipeline_directory
+    stages = pipeline.Pipeline(pipeline_directory)
 
     # Display the acquisisiton
     if display_before_removing:
-        display.display_image(directory, filename, file_extension)
-
-    # Read data of the scan
-    tth, omega, chi, phi, cts = seifert_data_TTX.read_seifert_data_TTX(directory, filename, file_extension)
-
-    # Remove acquisition (use display to check all the image)    
-    tth_clean = []
-    omega_clean = []
-    chi_clean = []
-    phi_clean = []
-    cts_clean = []
-
-    # Create new list without removed acquisition
-    for ii in range(len(tth)):
-        if not (ii + 1 in image_to_remove):
-            tth_clean.append(tth[ii])
-            omega_clean.append(omega[ii])
-            chi_clean.append(chi[ii])
-            phi_clean.append(phi[ii])
-            cts_clean.append(cts[ii])
+        display.display_image(directory, filename, file_extension, plotter)
+
+    # Read data of the scan (not stored : the scan file has its own cache)
+    scan = stages.run('read', scan_files.read_scan, inputs=(directory, filename, file_extension),
+                      files=[directory + '\\' + filename + file_extension], stored=False)
+    if scan is None:
+        return None
+
+    # Remove acquisition (use display to check all the image), and the ones rejected by the automatic screening
+    if automatic_screening:
+        flags = stages.run('screen', screening.screen_scan, ['read'], (saturation, False))
+        screening.report(flags, np.arange(1, len(scan) + 1, 1))
+        scan_clean = stages.run('clean', screening.clean_scan, ['read', 'screen'], (image_to_remove,), stored=False)
+        numbers = np.flatnonzero(scan.image_mask(image_to_remove) & screening.kept_images(flags)) + 1
+    else:
+        scan_clean = stages.run('clean', scan_data.Scan.remove_images, ['read'], (image_to_remove,), stored=False)
 
     # Save the clean file    
     if save_clean_file:
-        seifert_data_TTX.write_seifert_data_TTX(tth_clean, omega_clean, chi_clean, phi_clean, cts_clean,
-                                                directory_clean, filename_clean)
+        seifert_data_TTX.write_seifert_data_TTX(scan_clean.tth, scan_clean.omega, scan_clean.chi, scan_clean.phi,
+                                                scan_clean.cts, directory_clean, filename_clean)
         print("Clean file saved.")
 
     # Display the acquisisiton after removing    
     if display_after_removing:
-        display.display_image(directory_clean, filename_clean, file_extension_clean)
+        display.display_image(directory_clean, filename_clean, file_extension_clean, plotter)
 
     # Read data from clean file
-    tth, omega, chi, phi, cts = tth_clean, omega_clean, chi_clean, phi_clean, cts_clean
+    tth, omega, chi, phi, cts = scan_clean.tth, scan_clean.omega, scan_clean.chi, scan_clean.phi, scan_clean.cts
 
     # Acquisition parameters
-    number_of_pixel = len(cts[0])
-    number_of_image = len(tth)
+    number_of_image, number_of_pixel = cts.shape
+
+    # Automatic window of the peak : the None of the window and of the background sizes are found on the scan
+    if None in (xmin, xmax, size_window_background_left, size_window_background_right):
+        window = stages.run('window', fit_one_peak.scan_window, ['clean'],
+                            (xmin, xmax, size_window_background_left, size_window_background_right))
+        if window is None:
+            return None
+        xmin, xmax, size_window_background_left, size_window_background_right = window
+        print(f'Automatic window : xmin = {xmin}, xmax = {xmax}, '
+              f'background = {size_window_background_left}, {size_window_background_right}')
 
     # Obtaining the median position, median intensity, median FWHM (H) and median A,B of the peak
-    x0, IM, H, A, B = maths_functions.initial_guess(cts, xmin, xmax,
-                                                    size_window_background_left, size_window_background_right)
+    x0, IM, H, A, B = stages.run('guess', fit_one_peak.window_guess, ['clean'],
+                                 (xmin, xmax, size_window_background_left, size_window_background_right))
 
     # Display the window of work
-    x = np.arange(0, len(cts[0]), 1)
-    fig, ax = plt.subplots(figsize=(12, 12))
-    ax.set_title(f'Work Window')
-    ax.set_xlabel('Detector pixel [pix]')
-    ax.set_ylabel('Intensity [cts]')
-    for i in range(len(cts)):
-        ax.plot(x[xmin:xmax], cts[i][xmin:xmax], label=f'image n°{i}')
-    plt.show()
+    x = np.arange(0, number_of_pixel, 1)
+    plot = plots.Plot(f'{filename}_work_window', f'Work Window', 'Detector pixel [pix]', 'Intensity [cts]',
+                      legend=False)
+    for i in range(number_of_image):
+        plot.plot(x[xmin:xmax], cts[i][xmin:xmax], label=f'image n°{i}')
+    plotter.add(plot)
 
     # Display initial guess 
     print(f'Initial guess :\nx0 = {x0:4.3f}\nIM = {IM:4.3f}\nH = {H:4.3f}\nA = {A:4.3f}\nB = {B:4.3f}')
@@ -113,15 +195,22 @@ def beam_align_h_analysis(dic):
 
     # Fit the peak positions
     print('PEAK FIT')
-    guess = [x0, IM, H, A, B]
     x = np.arange(0, number_of_pixel, 1)
-    peakfit = []  # to store the peak fit results
 
-    # fiting peaks for each image USING INITIAL GUESS FOR PEAK POSITION
-    for ii in range(number_of_image):
-        # popt : optimals parameters ; pcov : cova<riance matrice
-        popt, pcov = curve_fit(maths_functions.gauss_backg, x[xmin:xmax], cts[ii][xmin:xmax], p0=guess)
-        peakfit.append(popt)
+    # fiting peaks of all the images at once (split between number_of_worker processes) USING INITIAL GUESS FOR PEAK POSITION
+    # peakfit : optimals parameters of each image ; converged : False if the fit of the image did not converge
+    peakfit, peakcov, converged = stages.run('fit', fit_one_peak.fit_window, ['clean', 'guess'], (xmin, xmax),
+                                             options=dict(number_of_worker=number_of_worker, cache=cache))
+    for ii in np.flatnonzero(~converged):
+        print(f'Fit du pic non convergé : image n°{ii + 1}')
+
+    # Fits not converged or rejected by the automatic screening : not used by the estimate of the misalignment
+    keep = np.ones(number_of_image, dtype=bool)
+    if automatic_screening:
+        fit_flags = stages.run('screen_fit', fit_one_peak.screen_window, ['clean', 'fit'], (xmin, xmax))
+        screening.report(fit_flags, numbers)
+        keep = screening.kept_images(fit_flags)
+    keep &= converged
 
     # central position of each peak
     peakpos = np.array([peakfit[ii][0] for ii in range(number_of_image)])
@@ -134,23 +223,28 @@ def beam_align_h_analysis(dic):
     # Plot peak data and peak fit
     print()
     print('PEAK FIT => PLOT')
-    fig, ax = plt.subplots(figsize=(15, 15))
-    ax.set_title(f'Omega scan for horizontal beam alignment')
-    ax.set_xlabel('Detector pixel [pix]')
-    ax.set_ylabel('Intensity [cts]')
-
-    ax.set_xlim([xmin, xmax])
+    plot = plots.Plot(f'{filename}_peak_fit', f'Omega scan for horizontal beam alignment',
+                      'Detector pixel [pix]', 'Intensity [cts]', figsize=(15, 15), xlim=[xmin, xmax])
 
     for ii in range(number_of_image):
-        ax.plot(x, cts[ii], '.', label=f'data {omega[ii]:5.2f}', markersize=6)
-        ax.plot(x, maths_functions.gauss_backg(x, *peakfit[ii]), '-', label=f'fit  {omega[ii]:5.2f}')
-    plt.legend()
-    plt.show()
+        plot.plot(x, cts[ii], '.', label=f'data {omega[ii]:5.2f}', markersize=6)
+        plot.plot(x, maths_functions.gauss_backg(x, *peakfit[ii]), '-', label=f'fit  {omega[ii]:5.2f}')
+    plotter.add(plot)
 
     # Estimate for the beam misalignment
     print('\nESTIMATE BEAM MISALIGNMENT')
-    guess = [0, x0]  # initail guess for beam misalignment = 0 ; USING INITIAL GUESS FOR PEAK POSITION
-    popt, pcov = curve_fit(beam_pos_h, (tth, omega), peakpos, p0=guess)
+    popt, pcov = stages.run('model', fit_beam_pos_h,
+                             ['clean', 'guess', 'fit'] + (['screen_fit'] if automatic_screening else []))
+
+    # Global fit : the peaks of all the images refined together with the misalignment, their positions
+    # constrained by beam_pos_h. Reported alongside the two-stage estimate, not in its place : the two
+    # estimates may differ by several standard deviations (e.g. omega_scan 21-11)
+    if global_fit_model:
+        global_popt, global_pcov, globalfit, global_converged = stages.run('global', fit_beam_pos_h_global,
+                                                                           ['clean', 'fit', 'model'],
+                                                                           (xmin, xmax, keep))
+        if not global_converged:
+            print('Fit global non convergé')
 
     # optimal paramaters
     e = popt[0]
@@ -164,19 +258,188 @@ def beam_align_h_analysis(dic):
         f'Horizontal beam misalignment : e  = {e:.2f} +- {de:.2f} pix / {e * pixsize:.3f} +- {de * pixsize:.2f} mm ({abs(de * 100 / e):3.1f} %)')
     print(f'Obtained peak position     : l0 = {ch0:.2f} +- {dch0:.2f} pix')
 
+    # Global estimate, and its distance to the two-stage estimate [standard deviation]
+    if global_fit_model:
+        e_global, ch0_global = global_popt[0], global_popt[1]
+        de_global, dch0_global = np.sqrt(global_pcov[0][0]), np.sqrt(global_pcov[1][1])
+        distance = abs(e_global - e) / np.hypot(de, de_global)
+        print(f'Global fit                 : e  = {e_global:.2f} +- {de_global:.2f} pix / '
+              f'{e_global * pixsize:.3f} +- {de_global * pixsize:.2f} mm, '
+              f'l0 = {ch0_global:.2f} +- {dch0_global:.2f} pix')
+        print(f'Global and two-stage estimates of e : {distance:.1f} standard deviations apart')
+
     # Plot beam_pos_h fit
     print('\nBEAM MISALIGNMENT => PLOT')
 
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.set_title(f'2th = {tth[0]}, e = {e * pixsize:.3f} mm, peak_pos = {ch0:.2f} pix')
-    ax.set_xlabel('Omega [deg]')
-    ax.set_ylabel('Peak position [pix]')
+    plot = plots.Plot(f'{filename}_beam_misalignment', f'2th = {tth[0]}, e = {e * pixsize:.3f} mm, peak_pos = {ch0:.2f} pix',
+                      'Omega [deg]', 'Peak position [pix]', figsize=(10, 6))
     # data
-    ax.plot(omega, peakpos, 'b.', label='data', markersize=6)
+    plot.plot(omega[keep], peakpos[keep], 'b.', label='data', markersize=6)
     # fit
     x = np.arange(np.min(omega) * 0.9, np.max(omega) * 1.1, 1.)
     tth = np.ones(len(x)) * tth[0]
-    ax.plot(x, beam_pos_h((tth, x), *popt), '-r', label='fit', linewidth=0.5)
+    plot.plot(x, beam_pos_h((tth, x), *popt), '-r', label='fit', linewidth=0.5)
+    plotter.add(plot)
+
+    # Fit cache and pipeline statistics
+    if cache is not None:
+        cache.report()
+    stages.report()
+
+    # Results of the analysis and figures (headless mode : waiting for the end of the rendering)
+    results = dict()
+    results["number_of_image"] = int(np.sum(keep))
+    results["e"] = e
+    results["de"] = de
+    results["l0"] = ch0
+    results["dl0"] = dch0
+    if global_fit_model:
+        results["e_global"] = e_global
+        results["de_global"] = de_global
+        results["l0_global"] = ch0_global
+        results["dl0_global"] = dch0_global
+    results["plots"] = plotter.close()
+    return results
+
+
+def beam_align_h_stream_analysis(dic):
+    """
+    Beam align h analysis using parameters stored in the dic, reading and fitting one acquisition at a time :
+    the memory used does not depend on the number of acquisition (no display of the images)
+    """
+    # Get the parameters from the dictionnary
+    directory = dic["directory_beam_align_h"]
+    filename = dic["filename_beam_align_h"]
+    file_extension = dic["file_extension_beam_align_h"]
+    image_to_remove = dic["image_to_remove_beam_align_h"]
+    pixsize = dic["pixsize"]
+    xmin = dic["window_xmin_beam_align_h"]
+    xmax = dic["window_xmax_beam_align_h"]
+    size_window_background_left = dic["size_window_background_left_beam_align_h"]
+    size_window_background_right = dic["size_window_background_right_beam_align_h"]
+    plotter = plots.Plotter(dic.get("headless_beam_align_h", False), dic.get("plot_directory_beam_align_h", None),
+                            prefix=dic.get("plot_prefix_beam_align_h", ''))
+
+    # Pipeline : reading => removing acquisition => fitting the peak
+    acquisitions = scan_files.iter_scan(directory, filename, file_extension)
+    acquisitions = scan_data.remove_acquisitions(acquisitions, image_to_remove)
+    peakfits = fit_one_peak.fit_acquisitions(acquisitions, xmin, xmax,
+                                             size_window_background_left, size_window_background_right)
+
+    # Only the angles and the peak position of each acquisition are kept
+    print('PEAK FIT')
+    print(f'(xx)    omega  pos[pix]')
+    tth = []
+    omega = []
+    peakpos = []
+    for acquisition, popt, pcov in peakfits:
+        tth.append(acquisition.tth)
+        omega.append(acquisition.omega)
+        peakpos.append(popt[0])
+        print(f'{acquisition.number:3.0f}  {acquisition.omega:8.3f} {popt[0]:8.2f}')
+
+    tth = np.array(tth)
+    omega = np.array(omega)
+    peakpos = np.array(peakpos)
+    if len(peakpos) == 0:
+        return None
+
+    # Estimate for the beam misalignment
+    print('\nESTIMATE BEAM MISALIGNMENT')
+    guess = [0, np.mean(peakpos)]
+    popt, pcov = models.fit('beam_pos_h', (tth, omega), peakpos, p0=guess)
+
+    # optimal paramaters and standard deviation
+    e = popt[0]
+    ch0 = popt[1]
+    de = np.sqrt(pcov[0][0])
+    dch0 = np.sqrt(pcov[1][1])
+
+    # result display
+    print(
+        f'Horizontal beam misalignment : e  = {e:.2f} +- {de:.2f} pix / {e * pixsize:.3f} +- {de * pixsize:.2f} mm ({abs(de * 100 / e):3.1f} %)')
+    print(f'Obtained peak position     : l0 = {ch0:.2f} +- {dch0:.2f} pix')
+
+    # Plot beam_pos_h fit
+    print('\nBEAM MISALIGNMENT => PLOT')
+
+    plot = plots.Plot(f'{filename}_beam_misalignment', f'2th = {tth[0]}, e = {e * pixsize:.3f} mm, peak_pos = {ch0:.2f} pix',
+                      'Omega [deg]', 'Peak position [pix]', figsize=(10, 6))
+    plot.plot(omega, peakpos, 'b.', label='data', markersize=6)
+    plot.plot(omega, beam_pos_h((tth, omega), *popt), '-r', label='fit', linewidth=0.5)
+    plotter.add(plot)
+
+    # Results of the analysis and figures (headless mode : waiting for the end of the rendering)
+    results = dict()
+    results["number_of_image"] = len(peakpos)
+    results["e"] = e
+    results["de"] = de
+    results["l0"] = ch0
+    results["dl0"] = dch0
+    results["plots"] = plotter.close()
+    return results
+
+
+def beam_align_h_follow_analysis(dic):
+    """
+    Beam align h analysis following the .TTX file while the omega scan is running : each new acquisition
+    is fitted as soon as it is written and the estimate of e is updated (same work for each acquisition)
+    """
+    # Get the parameters from the dictionnary
+    directory = dic["directory_beam_align_h"]
+    filename = dic["filename_beam_align_h"]
+    file_extension = dic["file_extension_beam_align_h"]
+    image_to_remove = dic["image_to_remove_beam_align_h"]
+    pixsize = dic["pixsize"]
+    xmin = dic["window_xmin_beam_align_h"]
+    xmax = dic["window_xmax_beam_align_h"]
+    size_window_background_left = dic["size_window_background_left_beam_align_h"]
+    size_window_background_right = dic["size_window_background_right_beam_align_h"]
+    timeout = dic.get("follow_timeout_beam_align_h", 60.)
+
+    # Pipeline : following the file => removing acquisition => fitting the peak
+    acquisitions = seifert_data_TTX.follow_seifert_data_TTX(directory, filename, file_extension, timeout)
+    acquisitions = scan_data.remove_acquisitions(acquisitions, image_to_remove)
+    peakfits = fit_one_peak.fit_acquisitions(acquisitions, xmin, xmax,
+                                             size_window_background_left, size_window_background_right)
+
+    # beam_pos_h is linear in (e, l0) : the estimate is updated with the normal equations
+    estimate = linear_fit.IncrementalLinearFit(2)
+
+    print('FOLLOW PEAK FIT AND BEAM MISALIGNMENT')
+    print(f'(xx)    omega  pos[pix]   e[pix]  de[pix]  l0[pix]')
+    for acquisition, popt, pcov in peakfits:
+        estimate.add(beam_pos_h_design((acquisition.tth, acquisition.omega)), popt[0])
+        line = f'{acquisition.number:3.0f}  {acquisition.omega:8.3f} {popt[0]:8.2f}'
+
+        # Estimate of the beam misalignment as soon as there are more points than parameters
+        if estimate.number_of_point > 2:
+            popt_beam, pcov_beam = estimate.solve()
+            line += f' {popt_beam[0]:8.2f} {np.sqrt(pcov_beam[0][0]):8.2f} {popt_beam[1]:8.2f}'
+        print(line)
+
+    if estimate.number_of_point < 3:
+        print('Not enough acquisition for estimating the beam misalignment')
+        return
+
+    # Final estimate
+    popt, pcov = estimate.solve()
+    e = popt[0]
+    ch0 = popt[1]
+    de = np.sqrt(pcov[0][0])
+    dch0 = np.sqrt(pcov[1][1])
+
+    # result display
+    print('\nESTIMATE BEAM MISALIGNMENT')
+    print(
+        f'Horizontal beam misalignment : e  = {e:.2f} +- {de:.2f} pix / {e * pixsize:.3f} +- {de * pixsize:.2f} mm ({abs(de * 100 / e):3.1f} %)')
+    print(f'Obtained peak position     : l0 = {ch0:.2f} +- {dch0:.2f} pix')
 
-    plt.legend()
-    plt.show()
+    # Results of the analysis
+    results = dict()
+    results["number_of_image"] = estimate.number_of_point
+    results["e"] = e
+    results["de"] = de
+    results["l0"] = ch0
+    results["dl0"] = dch0
+    return results
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Campaign run : analyse every scan (.TTX or .FDT file) found under a root directory.
+    The analysis of a scan is chosen from the name of its folder (job of the folder : analysis and template
+    .PARAM file), its parameters are the parameters of the template updated for the scan.
+    The scans are analysed by a pool of processes (headless mode, the figures are rendered in the results
+    directory with the log of each scan, their names begin with the folder of the scan relative to the root)
+    and the results are gathered in one .CSV table.
+"""
+
+
+import contextlib
+import csv
+import numbers
+import os
+
+from modules import b_a_h
+from modules import b_a_v
+from modules import d_c
+from modules import r_i
+from utils import parameters_files
+
+
+# Analysis of each job
+ANALYSES = dict()
+ANALYSES["beam_align_h"] = b_a_h.beam_align_h_analysis
+ANALYSES["beam_align_v"] = b_a_v.beam_align_v_analysis
+ANALYSES["detector_calibration"] = d_c.detector_calibration_analysis
+ANALYSES["read_image"] = r_i.read_image_analysis
+
+# Extensions of the scan files, by order of preference when a scan exists in both formats
+# (the pixel windows of the templates are given for the .TTX export)
+SCAN_EXTENSIONS = ('.TTX', '.FDT')
+
+# Columns of the results table before the results of the analyses
+COLUMNS = ['folder', 'filename', 'file_extension', 'analysis', 'status']
+
+
+def find_scans(root, jobs):
+    """
+    Yield (folder, directory, filename, extension) of every scan under root whose folder has a job
+    """
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        folder = os.path.basename(directory)
+        if folder not in jobs:
+            continue
+
+        # Extensions found for each scan name
+        scans = dict()
+        for name in sorted(files):
+            filename, extension = os.path.splitext(name)
+            if extension.upper() in SCAN_EXTENSIONS:
+                scans.setdefault(filename, []).append(extension)
+
+        for filename, extensions in scans.items():
+            extension = min(extensions, key=lambda ext: SCAN_EXTENSIONS.index(ext.upper()))
+            yield folder, directory, filename, extension
+
+
+def result_prefix(root, directory):
+    """
+    Prefix of the names of the results of the scans of directory (log, figures, calibration) : its path relative
+    to root, the scans of the same name in different folders do not overwrite each other
+    """
+    relative = os.path.relpath(directory, root)
+    if relative == os.curdir:
+        return ''
+    return relative.replace('\\', '_').replace('/', '_') + '_'
+
+
+def job_parameters(analysis, template, directory, filename, extension, directory_results, prefix=''):
+    """
+    Parameters dictionnary of the analysis of one scan : the template updated for the scan,
+    without display nor removed acquisition (automatic screening instead), in headless mode,
+    the results written in directory_results are named prefix + their usual name
+    """
+    dic = dict(template)
+    dic[f"directory_{analysis}"] = directory
+    dic[f"filename_{analysis}"] = filename
+    dic[f"file_extension_{analysis}"] = extension
+    dic[f"image_to_remove_{analysis}"] = []
+    dic[f"screening_{analysis}"] = True
+    dic[f"display_before_removing_{analysis}"] = False
+    dic[f"display_after_removing_{analysis}"] = False
+    dic[f"save_clean_file_{analysis}"] = False
+    dic[f"follow_{analysis}"] = False
+    dic[f"headless_{analysis}"] = True
+    dic[f"plot_directory_{analysis}"] = directory_results
+    dic[f"plot_prefix_{analysis}"] = prefix
+
+    # The calibration of each scan is written in the results directory
+    if analysis == "detector_calibration":
+        dic["directory_CALI_detector_calibration"] = directory_results
+        dic["filename_CALI_detector_calibration"] = prefix + filename
+    return dic
+
+
+def run_job(analysis, dic, log_name):
+    """
+    Run the analysis of one scan, its printed output goes to the log file
+    return the status ('ok' or the error) and the numerical results of the analysis
+    """
+    try:
+        with open(log_name, 'w') as log, contextlib.redirect_stdout(log):
+            results = ANALYSES[analysis](dic)
+        status = 'ok'
+    except Exception as error:
+        results = None
+        status = f'{type(error).__name__} : {error}'
+
+    # Only the numbers and texts go in the table (no figures nor arrays)
+    results = dict() if results is None else results
+    results = {key: value for key, value in results.items() if isinstance(value, (numbers.Number, str))}
+    return status, results
+
+
+def write_results(rows, name):
+    """
+    Write the results table : one line per scan
+    """
+    columns = list(COLUMNS)
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+
+    try:
+        with open(name, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    except OSError:
+        print('Ecriture résultats campagne : Fichier impossible à créer')
+
+    else:
+        print('Campaign results saved')
+
+
+def campaign_analysis(dic):
+    """
+    Campaign analysis using parameters stored in the dic
+    """
+    root = dic["root_campaign"]
+    jobs = dic["jobs_campaign"]
+    directory_templates = dic["directory_templates_campaign"]
+    directory_results = dic["directory_results_campaign"]
+    filename_results = dic["filename_results_campaign"]
+    file_extension_results = dic["file_extension_results_campaign"]
+    number_of_worker = dic.get("number_of_worker_campaign", 1)
+
+    # Discovering the scans
+    scans = list(find_scans(root, jobs))
+    print(f'{len(scans)} scan(s) found under {root}')
+
+    # Template parameters of each job
+    templates = dict()
+    for analysis, filename_template in jobs.values():
+        if filename_template not in templates:
+            templates[filename_template] = parameters_files.upload_param_file(directory_templates, filename_template)
+
+    tasks = []
+    for folder, directory, filename, extension in scans:
+        analysis, filename_template = jobs[folder]
+        prefix = result_prefix(root, directory)
+        parameters = job_parameters(analysis, templates[filename_template], directory, filename, extension,
+                                    directory_results, prefix)
+        log_name = directory_results + '\\' + prefix + filename + '.log'
+        tasks.append((analysis, parameters, log_name))
+
+    # Running the analyses (results in the order of the scans)
+    if number_of_worker <= 1:
+        outputs = [run_job(*task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=number_of_worker) as pool:
+            futures = [pool.submit(run_job, *task) for task in tasks]
+            outputs = [future.result() for future in futures]
+
+    # Results table
+    rows = []
+    for ii in range(len(scans)):
+        folder, directory, filename, extension = scans[ii]
+        analysis = tasks[ii][0]
+        status, results = outputs[ii]
+        print(f'{folder:20s} {filename + extension:45s} {analysis:22s} {status}')
+
+        row = dict(folder=folder, filename=filename, file_extension=extension, analysis=analysis, status=status)
+        row.update(results)
+        rows.append(row)
+
+    write_results(rows, directory_results + '\\' + filename_results + file_extension_results)
+    return rows
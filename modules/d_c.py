@@ -7,13 +7,54 @@ Program for the calibration for 1D-detector:
 
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import interpolate
 
 from utils import display
+from utils import fit_cache
+from utils import scan_files
 from utils import seifert_data_TTX
 from utils import CALI_data
 from utils import fit_one_peak
+from utils import pipeline
+from utils import plots
+from utils import scan_data
+from utils import screening
+
+
+def fit_peaks(scan, size_window_background=fit_one_peak.SIZE_WINDOW_BACKGROUND, number_of_worker=1, cache=None):
+    """
+    Fit the direct beam peak of each image of the scan (stage of the analysis)
+    """
+    return fit_one_peak.fit_all_peaks(scan.cts, number_of_worker, cache, size_window_background)
+
+
+def screen_fits(scan, fit):
+    """
+    Tests of the fits of the direct beam peaks (stage of the analysis)
+    """
+    x = np.arange(1, scan.number_of_pixel + 1, 1)  # pixels beginning at 1
+    return screening.screen_fits(x, scan.cts, fit[0], fit[2])
+
+
+def direct_correction(scan, fit, fit_flags=None):
+    """
+    Interpolate the 2theta motor angle for each pixel from the peak positions (stage of the analysis),
+    without the fits not converged nor the ones rejected by the screening (fit_flags, None : all the fits)
+    return the 2theta angle of each pixel
+    """
+    keep = np.ones(len(scan), dtype=bool) if fit_flags is None else screening.kept_images(fit_flags)
+    keep &= fit[2]
+    peakpos = fit[0][keep, 0]
+    pix = np.arange(1, scan.number_of_pixel + 1, 1)
+
+    # Fit (scipy.interpolate imported here : it is long to import and only used by this stage)
+    from scipy import interpolate
+    fit_tth_peak_pos = interpolate.interp1d(peakpos, scan.tth[keep], fill_value="extrapolate", kind="linear")
+
+    # tth angle for each pixel
+    fit_tth_peak_pos_pix = []
+    for pixel in pix:
+        fit_tth_peak_pos_pix.append(fit_tth_peak_pos(pixel))
+    return fit_tth_peak_pos_pix
 
 
 def detector_calibration_analysis(dic):
@@ -34,80 +75,107 @@ def detector_calibration_analysis(dic):
     filename_CALI = dic["filename_CALI_detector_calibration"]
     file_extension_CALI = dic["file_extension_CALI_detector_calibration"]
     save_CALI = dic["save_CALI_detector_calibration"]
-
+    automatic_screening = dic.get("screening_detector_calibration", False)
+    saturation = dic.get("saturation_detector_calibration", None)
+    size_window_background = dic.get("size_window_background_detector_calibration",
+                                     fit_one_peak.SIZE_WINDOW_BACKGROUND)
+    number_of_worker = dic.get("number_of_worker_detector_calibration", 1)
+    fit_cache_directory = dic.get("fit_cache_directory_detector_calibration", None)
+    cache = None if fit_cache_directory is None else fit_cache.FitCache(fit_cache_directory)
+    headless = dic.get("headless_detector_calibration", False)
+    plot_directory = dic.get("plot_directory_detector_calibration", None)
+    plot_prefix = dic.get("plot_prefix_detector_calibration", '')
+    pipeline_directory = dic.get("pipeline_directory_detector_calibration", None)
+
+    # Destination of the figures : shown, or rendered in the background in headless mode
+    plotter = plots.Plotter(headless, plot_directory, prefix=plot_prefix)
+
+    # Stages of the analysis : the stages whose inputs did not change are loaded from pipeline_directory
+    stages = pipeline.Pipeline(pipeline_directory)
 
     # Display the acquisisiton
     if display_before_removing:
-        display.display_image(directory, filename, file_extension)
-
-    # Read data of the scan
-    tth, omega, chi, phi, cts = seifert_data_TTX.read_seifert_data_TTX(directory, filename, file_extension)
-
-    # Remove acquisition (use display to check all the image)
-    tth_clean = []
-    omega_clean = []
-    chi_clean = []
-    phi_clean = []
-    cts_clean = []
-
-    # create new liste without removed acquisition
-    for ii in range(len(tth)):
-        if not (ii + 1 in image_to_remove):
-            tth_clean.append(tth[ii])
-            omega_clean.append(omega[ii])
-            chi_clean.append(chi[ii])
-            phi_clean.append(phi[ii])
-            cts_clean.append(cts[ii])
+        display.display_image(directory, filename, file_extension, plotter)
+
+    # Read data of the scan (not stored : the scan file has its own cache)
+    scan = stages.run('read', scan_files.read_scan, inputs=(directory, filename, file_extension),
+                      files=[directory + '\\' + filename + file_extension], stored=False)
+    if scan is None:
+        return None
+
+    # Remove acquisition (use display to check all the image), and the ones rejected by the automatic screening
+    if automatic_screening:
+        flags = stages.run('screen', screening.screen_scan, ['read'], (saturation,))
+        screening.report(flags, np.arange(1, len(scan) + 1, 1))
+        scan_clean = stages.run('clean', screening.clean_scan, ['read', 'screen'], (image_to_remove,), stored=False)
+        numbers = np.flatnonzero(scan.image_mask(image_to_remove) & screening.kept_images(flags)) + 1
+    else:
+        scan_clean = stages.run('clean', scan_data.Scan.remove_images, ['read'], (image_to_remove,), stored=False)
 
     # Save the clean file
     if save_clean_file:
-        seifert_data_TTX.write_seifert_data_TTX(tth_clean, omega_clean, chi_clean, phi_clean, cts_clean, directory_clean, filename_clean)
+        seifert_data_TTX.write_seifert_data_TTX(scan_clean.tth, scan_clean.omega, scan_clean.chi, scan_clean.phi, scan_clean.cts, directory_clean, filename_clean)
         print("Clean file saved.")
 
     # Display the acquisisiton after removing
     if display_after_removing:
-        display.display_image(directory_clean, filename_clean, file_extension_clean)
+        display.display_image(directory_clean, filename_clean, file_extension_clean, plotter)
 
     # Read data from clean data
-    tth, omega, chi, phi, cts = tth_clean, omega_clean, chi_clean, phi_clean, cts_clean
+    tth, omega, chi, phi, cts = scan_clean.tth, scan_clean.omega, scan_clean.chi, scan_clean.phi, scan_clean.cts
+
+    # Fitting all the peak at once
+    peakfit, peakcov, converged = stages.run('fit', fit_peaks, ['clean'], (size_window_background,),
+                                             options=dict(number_of_worker=number_of_worker, cache=cache))
+    for ii in np.flatnonzero(~converged):
+        print(f'Fit du pic non convergé : image n°{ii + 1}')
 
-    # Fitting all the peak
-    # list with all the central position
-    peakpos = []
+    # Fits not converged or rejected by the automatic screening : not used by the correction
+    keep = np.ones(len(peakfit), dtype=bool)
+    if automatic_screening:
+        fit_flags = stages.run('screen_fit', screen_fits, ['clean', 'fit'])
+        screening.report(fit_flags, numbers)
+        keep = screening.kept_images(fit_flags)
+    keep &= converged
 
-    for image in cts:
-        peakpos.append(fit_one_peak.fit_one_peak(image)[0][0])
+    # central position of each peak
+    peakpos = peakfit[keep, 0]
 
     # fitting peakpos in function of tth : for each pixel you obtain the direct correction to add
-    number_of_pixel = len(cts[0])
+    number_of_pixel = cts.shape[1]
     pix = np.arange(1, number_of_pixel + 1, 1)
 
-    # Fit
-    fit_tth_peak_pos = interpolate.interp1d(peakpos, tth, fill_value="extrapolate", kind="linear")
-
-    # tth angle for each pixel
-    fit_tth_peak_pos_pix = []
-    for pixel in pix:
-        fit_tth_peak_pos_pix.append(fit_tth_peak_pos(pixel))
+    fit_tth_peak_pos_pix = stages.run('correction', direct_correction,
+                                      ['clean', 'fit'] + (['screen_fit'] if automatic_screening else []))
 
     # Correction for each pixel
     correction_pix = [-elem for elem in fit_tth_peak_pos_pix]
 
     # Plot
-    fig, ax = plt.subplots(figsize=(12, 12))
-    ax.set_title(f'Direct angle correction')
-    ax.set_xlabel('pixel')
-    ax.set_ylabel('2theta motor')
-    # ax.set_xlim(100,200)
-    ax.plot(peakpos, tth, '.', label='data')
-    ax.plot(pix, correction_pix, label='correction')
-    ax.plot(pix, fit_tth_peak_pos_pix, '--', label='fit')
-    plt.legend()
-    plt.show()
+    plot = plots.Plot(f'{filename}_direct_angle_correction', f'Direct angle correction', 'pixel', '2theta motor')
+    # plot.xlim = [100, 200]
+    plot.plot(peakpos, tth[keep], '.', label='data')
+    plot.plot(pix, correction_pix, label='correction')
+    plot.plot(pix, fit_tth_peak_pos_pix, '--', label='fit')
+    plotter.add(plot)
 
     # Save .CALI file : direct angle correction    
     # Write .CALI file
 
     if save_CALI:
-        CALI_data.write_data_CALI(correction_pix, directory_CALI, filename_CALI, file_extension_CALI)
+        CALI_data.write_calibration(correction_pix, directory_CALI, filename_CALI, file_extension_CALI)
         print('.CALI file saved')
+
+    # Fit cache and pipeline statistics
+    if cache is not None:
+        cache.report()
+    stages.report()
+
+    # Results of the analysis and figures (headless mode : waiting for the end of the rendering)
+    results = dict()
+    results["number_of_image"] = len(peakpos)
+    results["number_of_pixel"] = number_of_pixel
+    results["correction_min"] = min(correction_pix)
+    results["correction_max"] = max(correction_pix)
+    results["plots"] = plotter.close()
+    return results
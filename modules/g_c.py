@@ -5,8 +5,10 @@ Fit data for finding the position of the center of rotation of a goniometer.
 
 
 import numpy as np
-from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
+
+from utils import linear_fit
+from utils import models
+from utils import plots
 
 
 # Goniometer function
@@ -16,6 +18,54 @@ def gonio_center(alpha, *param):
     return z
 
 
+def gonio_center_jac(alpha, *param):
+    """
+    Jacobian of gonio_center with respect to e, rtip and z0
+    """
+    inverse_cos = 1 / np.cos(np.asarray(alpha) * np.pi / 180)
+    return np.stack([inverse_cos, inverse_cos, np.ones(np.shape(inverse_cos))], axis=-1)
+
+
+def gonio_center_design(alpha):
+    """
+    Columns of the design matrix of gonio_center for a known rtip, which is linear in (e + rtip) and z0 :
+    z = (e + rtip) * column_e + z0 * 1
+    """
+    inverse_cos = 1 / np.cos(np.asarray(alpha) * np.pi / 180)
+    return np.stack([inverse_cos, np.ones(np.shape(inverse_cos))], axis=-1)
+
+
+models.register('gonio_center', gonio_center, gonio_center_jac, ('e', 'rtip', 'z0'))
+
+
+def fit_gonio_center(alpha, z, rtip, e, z0, e_max, z0_max):
+    """
+    Fit gonio_center for a known rtip, within |e| <= e_max and |z0| <= z0_max : closed-form least squares,
+    the curve_fit with bounds (initial guess e, z0) is only used for the series whose solution is out of the bounds.
+    alpha and z may be stacked series (..., number of point), fitted at once
+    return optimal parameters (..., 3) of (e, rtip, z0) and their covariance (..., 3, 3), same meaning as the pcov
+    of the bounded curve_fit : the columns of e and rtip are the same, their variance is split between them
+    """
+    alpha = np.asarray(alpha, dtype=float)
+    z = np.asarray(z, dtype=float)
+    solution = linear_fit.least_squares(gonio_center_design(alpha), z)[0]
+
+    popt = np.stack([solution[..., 0] - rtip, np.full(solution.shape[:-1], float(rtip)), solution[..., 1]], axis=-1)
+    # Covariance on the 3 columns of the jacobian (same residuals as the fit of e + rtip and z0)
+    pcov = linear_fit.least_squares(gonio_center_jac(alpha), z)[1]
+
+    # Series with an active bound : nonlinear fit with the bounds
+    shape = linear_fit.broadcast_shape(alpha.shape[:-1], z.shape[:-1])
+    alpha = np.broadcast_to(alpha, shape + alpha.shape[-1:])
+    z = np.broadcast_to(z, shape + z.shape[-1:])
+    bounded = (np.abs(popt[..., 0]) > e_max) | (np.abs(popt[..., 2]) > z0_max)
+    for index in np.ndindex(shape):
+        if bounded[index]:
+            popt[index], pcov[index] = models.fit('gonio_center', alpha[index], z[index], p0=[e, rtip, z0],
+                                                  bounds=([-e_max, rtip, -z0_max], [e_max, rtip + 1.e-6, z0_max]))
+    return popt, pcov
+
+
 def gonio_center_analysis(dic):
     """
     Gonio center analysis using parameters stored in the dic
@@ -27,9 +77,10 @@ def gonio_center_analysis(dic):
     z0 = dic["z0_gonio_center"]
     e_max = dic["e_max_gonio_center"]
     z0_max = dic["z0_max_gonio_center"]
+    headless = dic.get("headless_gonio_center", False)
+    plot_directory = dic.get("plot_directory_gonio_center", None)
 
-    popt, pcov = curve_fit(gonio_center, alpha, z, p0=[e, rtip, z0],
-                           bounds=([-e_max, rtip, -z0_max], [e_max, rtip + 1.e-6, z0_max]))
+    popt, pcov = fit_gonio_center(alpha, z, rtip, e, z0, e_max, z0_max)
 
     print()
     print(f'Rayon de la pointe du comparateur : {rtip:.3f} mm')
@@ -38,15 +89,19 @@ def gonio_center_analysis(dic):
     print(f'Le centre de rotation du gonio devrait se situer à z = {popt[2] + rtip:.3f} mm.')
 
     # plot
-    fig, ax = plt.subplots(figsize=(7, 4))
+    plotter = plots.Plotter(headless, plot_directory)
+    plot = plots.Plot('gonio_center', f'Goniometric center, e = {popt[0]:.3f} mm, z0 = {popt[2]:.3f} mm',
+                      'Angle [deg]', 'Position [mm]', figsize=(7, 4))
     # plot data
-    ax.plot(alpha, z, 'b.', label='data', markersize=3)
-    ax.set_title(f'Goniometric center, e = {popt[0]:.3f} mm, z0 = {popt[2]:.3f} mm')
-    ax.set_xlabel('Angle [deg]')
-    ax.set_ylabel('Position [mm]')
+    plot.plot(alpha, z, 'b.', label='data', markersize=3)
     # plot fit
     x = np.arange(np.min(alpha) * 1.1, np.max(alpha) * 1.1, 1.)
-    ax.plot(x, gonio_center(x, *popt), '-r', label='fit', linewidth=0.5)
-    plt.legend()
-    # fig.savefig('_gonio_center'+'.png', dpi=300)
-    plt.show()
+    plot.plot(x, gonio_center(x, *popt), '-r', label='fit', linewidth=0.5)
+    plotter.add(plot)
+
+    # Results of the analysis and figures (headless mode : waiting for the end of the rendering)
+    results = dict()
+    results["e"] = popt[0]
+    results["z0"] = popt[2]
+    results["plots"] = plotter.close()
+    return results
@@ -5,11 +5,15 @@ Using a .CALI file and a .TTX file, get the image of one or some acquisition
 
 
 import numpy as np
-import matplotlib.pyplot as plt
 
+from utils import angle_correction
 from utils import display
+from utils import file_loader
+from utils import multi_peak_fit
+from utils import plots
+from utils import screening
 from utils import seifert_data_TTX
-from utils import CALI_data
+from utils import stitching
 
 
 def read_image_analysis(dic):
@@ -29,73 +33,66 @@ def read_image_analysis(dic):
     directory_CALI = dic["directory_CALI_read_image"]
     filename_CALI = dic["filename_CALI_read_image"]
     file_extension_CALI = dic["file_extension_CALI_read_image"]
+    headless = dic.get("headless_read_image", False)
+    plot_directory = dic.get("plot_directory_read_image", None)
+    plot_prefix = dic.get("plot_prefix_read_image", '')
+    stitch_step = dic.get("stitch_step_read_image", None)
+    stitch_weight = dic.get("stitch_weight_read_image", 'counts')
+    diffractogram_directory = dic.get("diffractogram_directory_read_image", None)
+    peak_positions = dic.get("peak_positions_read_image", None)
+    peak_fwhm = dic.get("peak_fwhm_read_image", 6.)
+    automatic_screening = dic.get("screening_read_image", False)
+    saturation = dic.get("saturation_read_image", None)
+
+    # Destination of the figures : shown, or rendered in the background in headless mode
+    plotter = plots.Plotter(headless, plot_directory, prefix=plot_prefix)
 
     # Display the acquisisitons
     if display_before_removing:
-        display.display_image(directory, filename, file_extension)
-
-    # Read data of the scan
-    tth, omega, chi, phi, cts = seifert_data_TTX.read_seifert_data_TTX(directory, filename, file_extension)
-
-    # Remove acquisition (use display to check all the image) 
-    tth_clean = []
-    omega_clean = []
-    chi_clean = []
-    phi_clean = []
-    cts_clean = []
-
-    # create new liste without removed acquisition
-    for ii in range(len(tth)):
-        if not (ii + 1 in image_to_remove):
-            tth_clean.append(tth[ii])
-            omega_clean.append(omega[ii])
-            chi_clean.append(chi[ii])
-            phi_clean.append(phi[ii])
-            cts_clean.append(cts[ii])
+        display.display_image(directory, filename, file_extension, plotter)
+
+    # Read data of the scan and the calibration file at the same time
+    scan, correction_pix = file_loader.load_files([
+        file_loader.scan_request(directory, filename, file_extension),
+        file_loader.calibration_request(directory_CALI, filename_CALI, file_extension_CALI)])
+    if scan is None or correction_pix is None:
+        return None
+    if not angle_correction.check_calibration(scan.cts, correction_pix):
+        return None
+
+    # Remove acquisition (use display to check all the image), and the ones rejected by the automatic screening
+    # (empty and saturated images : the images have several peaks)
+    keep = None
+    if automatic_screening:
+        flags = screening.screen_scan(scan, saturation, peak=False)
+        screening.report(flags, np.arange(1, len(scan) + 1, 1))
+        keep = screening.kept_images(flags)
+    scan_clean = scan.remove_images(image_to_remove, keep)
 
     # Save the file without removed acquisition
     if save_clean_file:
-        seifert_data_TTX.write_seifert_data_TTX(tth_clean,
-                                                omega_clean,
-                                                chi_clean,
-                                                phi_clean,
-                                                cts_clean,
+        seifert_data_TTX.write_seifert_data_TTX(scan_clean.tth,
+                                                scan_clean.omega,
+                                                scan_clean.chi,
+                                                scan_clean.phi,
+                                                scan_clean.cts,
                                                 directory_clean, filename_clean)
         print("Clean file saved.")
 
     # Getting all the data
-    tth, omega, chi, phi, cts = tth_clean, omega_clean, chi_clean, phi_clean, cts_clean
-    correction_pix = CALI_data.read_data_CALI(directory_CALI, filename_CALI, file_extension_CALI)
+    tth, omega, chi, phi, cts = scan_clean.tth, scan_clean.omega, scan_clean.chi, scan_clean.phi, scan_clean.cts
 
     # Display the acquisisiton after removing    
     if display_after_removing:
-        display.display_image(directory_clean, filename_clean, file_extension_clean)
+        display.display_image(directory_clean, filename_clean, file_extension_clean, plotter)
 
-    # Using .CALI file and direct angle correction
-
-    # Obtaining number of point (if .CALI file and .TTX file have not same dimension)
-    number_of_point = min(len(cts[0]), len(correction_pix))
-    number_of_image = len(tth)
-
-    # Creation of cts real list : corrected intensity
-    cts_real = []
-    for ii in range(number_of_image):
-        cts_real_acquisition = []
-        for jj in range(number_of_point):
-            cts_real_acquisition.append(cts[ii][jj] / np.cos(correction_pix[jj] * np.pi / 180))
-        cts_real.append(cts_real_acquisition)
-
-    # Creation of tth real list : corrected position
-    tth_real = []
-    for elem in tth:
-        tth_real_acquisition = []
-        for correction in correction_pix:
-            tth_real_acquisition.append(elem + correction)
-        tth_real.append(tth_real_acquisition)
+    # Using .CALI file and direct angle correction : all the images at once
+    tth_real, cts_real = angle_correction.correct_scan(tth, cts, correction_pix)
+    number_of_image, number_of_point = cts_real.shape
 
     # getting parameters acquisition
-    tth_min = min([min(elem) for elem in tth_real])
-    tth_max = max([max(elem) for elem in tth_real])
+    tth_min = np.min(tth_real)
+    tth_max = np.max(tth_real)
 
     # Print acquisition parameters
     print('\nACQUISITION PARAMETERS :\n')
@@ -105,14 +102,87 @@ def read_image_analysis(dic):
     print(f'2theta max = {tth_max:5.2f}')
 
     # all the image with correction on the same diagram
-    fig, ax = plt.subplots(figsize=(15, 15))
-    ax.set_title(f'{filename} : Complete diagram : {tth_min:5.2f}° - {tth_max:5.2f}° ')
-    ax.set_xlabel('2theta [°]')
-    ax.set_ylabel('Intensity [cts]')
-    # ax.set_xlim(135,145)
+    plot = plots.Plot(f'{filename}_complete_diagram', f'{filename} : Complete diagram : {tth_min:5.2f}° - {tth_max:5.2f}° ',
+                      '2theta [°]', 'Intensity [cts]', figsize=(15, 15))
+    # plot.xlim = [135, 145]
     for ii in range(number_of_image):
-        ax.plot(tth_real[ii], cts_real[ii][:number_of_point],
-                label=f'Acquisiton n°{ii + 1} : {min(tth_real[ii]):5.2f}° - {max(tth_real[ii]):5.2f}°')
-
-    plt.legend()
-    plt.show()
+        plot.plot(tth_real[ii], cts_real[ii],
+                  label=f'Acquisiton n°{ii + 1} : {np.min(tth_real[ii]):5.2f}° - {np.max(tth_real[ii]):5.2f}°')
+
+    plotter.add(plot)
+
+    # Merged diffractogram : all the acquisitions stitched on one 2theta grid
+    diffractogram = None
+    if stitch_step is not None:
+        variance = cts_real * angle_correction.inverse_cosine(correction_pix)[:number_of_point]
+        diffractogram = stitching.stitch(tth_real, cts_real, stitch_step, weight=stitch_weight,
+                                         acq_time=scan_clean.acq_time, variance=variance)
+
+    if diffractogram is not None:
+        tth_grid, cts_grid, error_grid, number_grid = diffractogram
+        print(f'\nMERGED DIFFRACTOGRAM : {len(tth_grid)} bins of {stitch_step}°, '
+              f'{np.count_nonzero(number_grid == 0)} empty')
+
+        plot = plots.Plot(f'{filename}_merged_diagram', f'{filename} : Merged diagram ({stitch_weight} weighting)',
+                          '2theta [°]', 'Intensity [cts]' if stitch_weight == 'counts' else 'Intensity [cts/s]',
+                          figsize=(15, 15), legend=False)
+        plot.plot(tth_grid, cts_grid, '-', linewidth=0.5)
+        plot.plot(tth_grid, cts_grid - error_grid, '-', color='grey', linewidth=0.3)
+        plot.plot(tth_grid, cts_grid + error_grid, '-', color='grey', linewidth=0.3)
+        plotter.add(plot)
+
+        if diffractogram_directory is not None:
+            stitching.write_diffractogram(tth_grid, cts_grid, error_grid, diffractogram_directory,
+                                          filename + '_merged')
+
+    # Fit of several peaks (hkl) on a common background, all the images at once
+    peaks = None
+    if peak_positions is not None and len(peak_positions) > 0:
+        pixel = np.arange(0, number_of_point, 1)
+        guess_peaks, guess_background = multi_peak_fit.multi_peak_guess(pixel, cts_real, peak_positions, peak_fwhm)
+        peaks, background, pcov, converged = multi_peak_fit.fit_multi_gauss_backg(pixel, cts_real, guess_peaks,
+                                                                                  guess_background)
+        for ii in np.flatnonzero(~converged):
+            print(f'Fit des pics non convergé : image n°{ii + 1}')
+
+        # 2theta of the peaks : corrected angle at the (fractional) pixel of each peak
+        tth_peaks = tth[:, np.newaxis] + np.interp(peaks[:, :, 0], pixel, correction_pix[:number_of_point])
+        dx0 = np.sqrt(np.abs(pcov[:, 0:3 * len(peak_positions):3, 0:3 * len(peak_positions):3].diagonal(0, 1, 2)))
+
+        # The peaks of the images whose fit did not converge are not valid
+        peaks[~converged] = np.nan
+        tth_peaks[~converged] = np.nan
+
+        print('\nPEAKS FIT')
+        print(f'(xx) peak  pos[pix] dpos[pix]  2th[deg]  IM[cts]  FWHM[pix]')
+        for ii in range(number_of_image):
+            if not converged[ii]:
+                print(f'{ii + 1:3.0f}       non convergé')
+                continue
+
+            for kk in range(len(peak_positions)):
+                x0, IM, H = peaks[ii, kk]
+                print(f'{ii + 1:3.0f} {kk + 1:4.0f}  {x0:8.2f} {dx0[ii, kk]:9.3f} {tth_peaks[ii, kk]:9.3f} '
+                      f'{IM:8.1f} {abs(H):9.2f}')
+
+            plot = plots.Plot(f'{filename}_peaks_fit_{ii + 1:03d}', f'{filename} : Peaks fit, acquisition n°{ii + 1}',
+                              'Detector pixel [pix]', 'Intensity [cts]', figsize=(15, 10))
+            plot.plot(pixel, cts_real[ii], '.', label='data', markersize=3)
+            plot.plot(pixel, multi_peak_fit.multi_gauss_backg(pixel, peaks[ii], background[ii]), '-r', label='fit',
+                      linewidth=0.5)
+            plotter.add(plot)
+
+    # Results of the analysis and figures (headless mode : waiting for the end of the rendering)
+    results = dict()
+    results["number_of_image"] = number_of_image
+    results["number_of_pixel"] = number_of_point
+    results["tth_min"] = tth_min
+    results["tth_max"] = tth_max
+    if diffractogram is not None:
+        results["diffractogram"] = diffractogram[:3]
+    if peaks is not None:
+        results["peaks"] = peaks
+        results["tth_peaks"] = tth_peaks
+        results["converged"] = converged
+    results["plots"] = plotter.close()
+    return results
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Program for the residual stress analysis with the sin²psi method:
+    each file is a psi (chi) scan of one Bragg peak at a fixed detector position. The peak of every psi is fitted,
+    its position is converted to 2theta (calibration of the detector), d-spacing and strain, and the strain
+    is regressed against sin²psi : the slope gives the stress. The files of a measurement are read
+    concurrently by a pool of threads, and analysed concurrently by a pool of processes.
+"""
+
+
+import numpy as np
+
+from utils import angle_correction
+from utils import file_loader
+from utils import fit_one_peak
+from utils import linear_fit
+from utils import plots
+from utils import scan_files
+
+
+# Wavelength of the Cu K-alpha1 radiation [angstrom]
+WAVELENGTH_CU = 1.5406
+
+
+def sin2psi_stress(directory, filename, file_extension, xmin, xmax, size_window_background_left,
+                   size_window_background_right, correction_pix, wavelength, young_modulus, poisson_ratio, d0=None,
+                   scan=None):
+    """
+    Stress of one psi scan file
+        xmin, xmax : window of the peak [pix] (None : automatic, as the background sizes), correction_pix : direct angle correction of each pixel [deg]
+        wavelength [angstrom], young_modulus [GPa], poisson_ratio : radiation and elastic constants
+        d0 : stress-free d-spacing [angstrom] (None : d-spacing at psi = 0 given by the regression)
+        scan : Scan of the file already read (None : read here)
+    return a dictionnary of the results of the file (None if the file can not be read or if the calibration
+    does not have its number of pixel)
+    """
+    if scan is None:
+        scan = scan_files.read_scan(directory, filename, file_extension)
+    if scan is None:
+        return None
+    if not angle_correction.check_calibration(scan.cts, correction_pix):
+        return None
+
+    # Automatic window of the peak
+    if None in (xmin, xmax, size_window_background_left, size_window_background_right):
+        window = fit_one_peak.scan_window(scan, xmin, xmax, size_window_background_left, size_window_background_right)
+        if window is None:
+            return None
+        xmin, xmax, size_window_background_left, size_window_background_right = window
+
+    # Fitting the peak of all the psi at once
+    guess = fit_one_peak.window_guess(scan, xmin, xmax, size_window_background_left, size_window_background_right)
+    peakfit, peakcov, converged = fit_one_peak.fit_window(scan, guess, xmin, xmax)
+    peakpos = peakfit[:, 0]
+    dpeakpos = np.sqrt(np.abs(peakcov[:, 0, 0]))
+
+    # 2theta of the peak : motor angle + correction of the (fractional) pixel of the peak
+    pixel = np.arange(0, len(correction_pix), 1)
+    tth = scan.tth + np.interp(peakpos, pixel, correction_pix)
+    dtth = np.abs(np.interp(peakpos, pixel, np.gradient(correction_pix))) * dpeakpos
+
+    # d-spacing (Bragg's law) and its standard deviation
+    theta = tth / 2 * np.pi / 180
+    d = wavelength / (2 * np.sin(theta))
+    dd = d / np.tan(theta) * dtth / 2 * np.pi / 180
+
+    sin2psi = np.sin(scan.chi * np.pi / 180) ** 2
+    use = converged & (dd > 0) & np.isfinite(d)
+
+    # Stress-free d-spacing : d-spacing extrapolated at psi = 0
+    if d0 is None:
+        d0 = _weighted_line(sin2psi[use], d[use], dd[use])[0][1]
+
+    # Strain and regression against sin²psi : strain = slope * sin²psi + intercept
+    strain = (d - d0) / d0
+    dstrain = dd / d0
+    popt, pcov = _weighted_line(sin2psi[use], strain[use], dstrain[use])
+
+    # Biaxial stress : slope * E / (1 + nu) [MPa]
+    factor = young_modulus * 1e3 / (1 + poisson_ratio)
+
+    results = dict()
+    results["filename"] = filename
+    results["tth_motor"] = scan.tth[0]
+    results["chi"] = scan.chi
+    results["sin2psi"] = sin2psi
+    results["converged"] = converged
+    results["tth"] = tth
+    results["d"] = d
+    results["dd"] = dd
+    results["strain"] = strain
+    results["dstrain"] = dstrain
+    results["d0"] = d0
+    results["slope"] = popt[0]
+    results["intercept"] = popt[1]
+    results["stress"] = popt[0] * factor
+    results["dstress"] = np.sqrt(pcov[0][0]) * factor
+    return results
+
+
+def _weighted_line(x, y, sigma):
+    """
+    Weighted least squares line y = slope * x + intercept (weights 1 / sigma²)
+    return (slope, intercept) and their covariance
+    """
+    fit = linear_fit.IncrementalLinearFit(2)
+    for xi, yi, si in zip(x, y, sigma):
+        fit.add([xi / si, 1 / si], yi / si)
+    return fit.solve()
+
+
+def sin2psi_stress_analysis(dic):
+    """
+    Sin²psi stress analysis using parameters stored in the dic
+    """
+    directory = dic["directory_sin2psi_stress"]
+    filenames = dic["filenames_sin2psi_stress"]
+    file_extension = dic["file_extension_sin2psi_stress"]
+    windows = dic.get("windows_sin2psi_stress", None)
+    size_window_background_left = dic.get("size_window_background_left_sin2psi_stress", None)
+    size_window_background_right = dic.get("size_window_background_right_sin2psi_stress", None)
+
+    directory_CALI = dic["directory_CALI_sin2psi_stress"]
+    filename_CALI = dic["filename_CALI_sin2psi_stress"]
+    file_extension_CALI = dic["file_extension_CALI_sin2psi_stress"]
+
+    wavelength = dic.get("wavelength_sin2psi_stress", WAVELENGTH_CU)
+    young_modulus = dic["young_modulus_sin2psi_stress"]
+    poisson_ratio = dic["poisson_ratio_sin2psi_stress"]
+    d0 = dic.get("d0_sin2psi_stress", None)
+    number_of_worker = dic.get("number_of_worker_sin2psi_stress", 1)
+    headless = dic.get("headless_sin2psi_stress", False)
+    plot_directory = dic.get("plot_directory_sin2psi_stress", None)
+
+    # Direct angle correction of the detector, and the files of the scans read at the same time when they
+    # are analysed in this process (the processes of the pool read their own file)
+    serial = number_of_worker <= 1 or len(filenames) <= 1
+    requests = [file_loader.calibration_request(directory_CALI, filename_CALI, file_extension_CALI)]
+    if serial:
+        requests += [file_loader.scan_request(directory, filename, file_extension) for filename in filenames]
+    files = file_loader.load_files(requests)
+    correction_pix = files[0]
+    if correction_pix is None:
+        return None
+
+    # Analysis of each file (the stress-free d-spacing may be given for each file, the files without
+    # a window are found automatically)
+    tasks = []
+    for filename in filenames:
+        xmin, xmax = (None, None) if windows is None else windows.get(filename, (None, None))
+        d0_file = d0.get(filename) if isinstance(d0, dict) else d0
+        tasks.append((directory, filename, file_extension, xmin, xmax, size_window_background_left,
+                      size_window_background_right, correction_pix, wavelength, young_modulus, poisson_ratio,
+                      d0_file))
+
+    if serial:
+        stresses = [sin2psi_stress(*task, scan=scan) for task, scan in zip(tasks, files[1:])]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(number_of_worker, len(tasks))) as pool:
+            futures = [pool.submit(sin2psi_stress, *task) for task in tasks]
+            stresses = [future.result() for future in futures]
+
+    # Destination of the figures : shown, or rendered in the background in headless mode
+    plotter = plots.Plotter(headless, plot_directory)
+
+    print('SIN²PSI STRESS')
+    print(f'{"file":20s} {"2th[deg]":>9s} {"d0[A]":>9s} {"slope":>11s} {"stress[MPa]":>12s}')
+    for ii in range(len(tasks)):
+        result = stresses[ii]
+        if result is None:
+            print(f'{filenames[ii]:20s} Analyse impossible')
+            continue
+
+        for jj in np.flatnonzero(~result["converged"]):
+            print(f'Fit du pic non convergé : {filenames[ii]} image n°{jj + 1}')
+
+        print(f'{filenames[ii]:20s} {result["tth_motor"]:9.2f} {result["d0"]:9.5f} {result["slope"]:11.3e} '
+              f'{result["stress"]:8.1f} +- {result["dstress"]:.1f}')
+
+        # Strain against sin²psi
+        plot = plots.Plot(f'{filenames[ii]}_sin2psi',
+                          f'{filenames[ii]} : stress = {result["stress"]:.1f} +- {result["dstress"]:.1f} MPa',
+                          'sin²psi', 'Strain', figsize=(10, 6))
+        use = result["converged"]
+        plot.plot(result["sin2psi"][use], result["strain"][use], 'b.', label='data', markersize=6)
+        x = np.linspace(0, np.max(result["sin2psi"]), 2)
+        plot.plot(x, result["slope"] * x + result["intercept"], '-r', label='fit', linewidth=0.5)
+        plotter.add(plot)
+
+    # Results of the analysis and figures (headless mode : waiting for the end of the rendering)
+    results = dict()
+    results["stresses"] = stresses
+    results["plots"] = plotter.close()
+    return results
@@ -31,6 +31,10 @@ file_extension = '.TTX'
 display_before_removing = False
 # Put here the number of the image(s) to remove
 image_to_remove = []
+# Automatic screening of the acquisitions (empty, saturated) : True or False
+screening = True
+# Count at which the detector saturates (None : plateau at the maximum of an image)
+saturation = None
 # Display before removing : True or False
 display_after_removing = False
 
@@ -44,7 +48,22 @@ file_extension_clean = file_extension
 # .CALI file information (reading .CALI file)
 directory_CALI = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\calibration'
 filename_CALI = '2019-11-20 Scan FD_clean'
-file_extension_CALI = '.CALI'
+file_extension_CALI = '.CALI'  # .CALI (text), .CALB (binary) or .CAL (Inel binary)
+
+# Merged diffractogram : all the acquisitions stitched on one 2theta grid of step stitch_step [deg] (None : not merged)
+# overlapping acquisitions weighted by 'counts' (mean intensity) or by acquisition 'time' (count rate)
+stitch_step = None
+stitch_weight = 'counts'
+# Directory of the merged diffractogram .XY file (None : not saved)
+diffractogram_directory = None
+
+# Fit of several peaks on a common background : initial positions [pix] of the peaks (None : no fit) and FWHM [pix]
+peak_positions = None
+peak_fwhm = 6.
+
+# Headless mode, for unattended runs : the figures are not shown but rendered in plot_directory (None : not rendered)
+headless = False
+plot_directory = None
 
 # Saving Parameters on .PARAM file
 save_PARAMfile_read_image = False
@@ -68,6 +87,8 @@ parameters_read_image["filename_read_image"] = filename
 parameters_read_image["file_extension_read_image"] = file_extension
 parameters_read_image["display_before_removing_read_image"] = display_before_removing
 parameters_read_image["image_to_remove_read_image"] = image_to_remove
+parameters_read_image["screening_read_image"] = screening
+parameters_read_image["saturation_read_image"] = saturation
 parameters_read_image["display_after_removing_read_image"] = display_after_removing
 parameters_read_image["directory_clean_read_image"] = directory_clean
 parameters_read_image["filename_clean_read_image"] = filename_clean
@@ -76,6 +97,13 @@ parameters_read_image["save_clean_file_read_image"] = save_clean_file
 parameters_read_image["directory_CALI_read_image"] = directory_CALI
 parameters_read_image["filename_CALI_read_image"] = filename_CALI
 parameters_read_image["file_extension_CALI_read_image"] = file_extension_CALI
+parameters_read_image["headless_read_image"] = headless
+parameters_read_image["plot_directory_read_image"] = plot_directory
+parameters_read_image["stitch_step_read_image"] = stitch_step
+parameters_read_image["stitch_weight_read_image"] = stitch_weight
+parameters_read_image["diffractogram_directory_read_image"] = diffractogram_directory
+parameters_read_image["peak_positions_read_image"] = peak_positions
+parameters_read_image["peak_fwhm_read_image"] = peak_fwhm
 parameters_read_image["pixsize"] = pixsize
 parameters_read_image["goniometric_ray"] = R
 
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+X-Ray Diffraction for Solid Mechanics
+
+Author: Olivier Castelnau (olivier.castelnau@ensam.eu), lab PIMM (CNRS UMR8006) at ENSAM Paris, France.
+        Vincent MICHEL (vincent.michel@ensam.eu)
+        Damien LANASPEZE (damien.lanaspeze@mines-paristech.fr)
+
+Program for the residual stress analysis with the sin²psi method:
+    perform a PSI (chi) scan of a Bragg peak for each hkl, fit the peak position at each psi,
+    convert it to d-spacing and strain, and regress the strain against sin²psi to get the stress.
+"""
+
+
+import time
+
+from modules import s_s
+from utils import parameters_files
+
+
+# Common parameters
+pixsize = 0.14  # mm
+R = 295  # mm
+
+# Analysis parameters
+
+# .TTX files of the measurement : one psi scan per Bragg peak
+directory = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\experiments\psi_scan'
+filenames = ['sin2psi_20', 'sin2psi_49', 'sin2psi_76', 'sin2psi_120', 'sin2psi_142']
+file_extension = '.TTX'
+
+# Windows position [pix] for peak fit of each file : you have to see all the pic and background on each side
+# (the files without a window : automatic window of the most intense peak followed along the scan)
+windows = dict()
+windows['sin2psi_20'] = (824, 884)
+windows['sin2psi_49'] = (439, 499)
+windows['sin2psi_76'] = (128, 188)
+windows['sin2psi_120'] = (306, 366)
+windows['sin2psi_142'] = (444, 504)
+
+# Size of the background window for each side of the peak (None : automatic, from the width of the peak)
+size_window_background_left = 10
+size_window_background_right = 10
+
+# .CALI file information (reading .CALI file)
+directory_CALI = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\calibration'
+filename_CALI = '2019-11-20 Scan FD_clean'
+file_extension_CALI = '.CALI'  # .CALI (text), .CALB (binary) or .CAL (Inel binary)
+
+# Radiation and material
+wavelength = s_s.WAVELENGTH_CU  # angstrom
+young_modulus = 210  # GPa
+poisson_ratio = 0.3
+# Stress-free d-spacing [angstrom] : None (d-spacing at psi = 0), one value, or a dictionnary {filename : d0}
+d0 = None
+
+# Number of files analysed at the same time
+number_of_worker = 1
+
+# Headless mode, for unattended runs : the figures are not shown but rendered in plot_directory (None : not rendered)
+headless = False
+plot_directory = None
+
+# Saving Parameters on .PARAM file
+save_PARAMfile_sin2psi_stress = False
+directory_PARAM_sin2psi_stress = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\parameters'
+filename_PARAM_sin2psi_stress = time.strftime("%d_%B_%Y") + '_sin2psi_stress'
+file_extension_PARAM_sin2psi_stress = '.PARAM'
+
+# Uploading parameters from a .PARAM file (!! the parameters use by the pragram will not be the previous parameters !!)
+upload_PARAM_file = False
+directory_upload_PARAM_sin2psi_stress = r'D:\Damien\Scolaire\3.Mines\2A\S3R\XRDSM\data\parameters'
+filename_upload_PARAM_sin2psi_stress = '24_April_2020' + '_sin2psi_stress'
+file_extension_upload_PARAM = '.PARAM'
+
+# Parameters dictionnary
+parameters_sin2psi_stress = dict()
+parameters_sin2psi_stress["pixsize"] = pixsize
+parameters_sin2psi_stress["goniometric_ray"] = R
+parameters_sin2psi_stress["directory_sin2psi_stress"] = directory
+parameters_sin2psi_stress["filenames_sin2psi_stress"] = filenames
+parameters_sin2psi_stress["file_extension_sin2psi_stress"] = file_extension
+parameters_sin2psi_stress["windows_sin2psi_stress"] = windows
+parameters_sin2psi_stress["size_window_background_left_sin2psi_stress"] = size_window_background_left
+parameters_sin2psi_stress["size_window_background_right_sin2psi_stress"] = size_window_background_right
+parameters_sin2psi_stress["directory_CALI_sin2psi_stress"] = directory_CALI
+parameters_sin2psi_stress["filename_CALI_sin2psi_stress"] = filename_CALI
+parameters_sin2psi_stress["file_extension_CALI_sin2psi_stress"] = file_extension_CALI
+parameters_sin2psi_stress["wavelength_sin2psi_stress"] = wavelength
+parameters_sin2psi_stress["young_modulus_sin2psi_stress"] = young_modulus
+parameters_sin2psi_stress["poisson_ratio_sin2psi_stress"] = poisson_ratio
+parameters_sin2psi_stress["d0_sin2psi_stress"] = d0
+parameters_sin2psi_stress["number_of_worker_sin2psi_stress"] = number_of_worker
+parameters_sin2psi_stress["headless_sin2psi_stress"] = headless
+parameters_sin2psi_stress["plot_directory_sin2psi_stress"] = plot_directory
+
+if __name__ == '__main__':
+
+    if save_PARAMfile_sin2psi_stress:
+        parameters_files.save_param_file(parameters_sin2psi_stress,
+                                         directory_PARAM_sin2psi_stress,
+                                         filename_PARAM_sin2psi_stress,
+                                         file_extension_PARAM_sin2psi_stress)
+
+    if upload_PARAM_file:
+        parameters_sin2psi_stress = parameters_files.upload_param_file(directory_upload_PARAM_sin2psi_stress,
+                                                                       filename_upload_PARAM_sin2psi_stress,
+                                                                       file_extension_upload_PARAM)
+
+    # Lauch analysis
+    s_s.sin2psi_stress_analysis(parameters_sin2psi_stress)
@@ -1,9 +1,43 @@
 # -*- coding: utf-8 -*-
 """
-Define function for read and write .CALI file
+Define functions for read and write the calibration files of the detector:
+    .CALI : text file, angle correction of each pixel (written by the detector calibration)
+    .CALI2 : text file, point of normal incidence and size of each pixel (read by read_data_CALI2 only : it is
+             not an angle correction)
+    .CALB : binary file, versioned header followed by the angle correction of each pixel (float64)
+    .CAL : Inel binary file, calibration knots of the detector (the ones stored in the header of the .FDT files)
+The calibrations read by read_calibration (.CALI, .CALB, .CAL) are kept in a cache of the process (key : name, size and
+modification time of the file), so a batch of scans using the same calibration reads it once.
 """
 
 
+import functools
+import os
+
+import numpy as np
+
+from utils import inel_data_FDT
+
+
+# Header of the binary calibration file
+MAGIC = b'XRDSMCAL'
+VERSION = 1
+HEADER = np.dtype([('magic', 'S8'),
+                   ('version', '<u4'),
+                   ('number_of_pixel', '<u4')])
+
+# Layout of the .CAL files : records of CAL_RECORD_SIZE bytes separated by a marker, the first record begins at
+# CAL_FIRST_RECORD with the number of knot (u2, after 2 bytes) followed by the knots (f8)
+CAL_FIRST_RECORD = 0x68
+CAL_RECORD_SIZE = 128
+CAL_MARKER = b'\x81\x81'
+CAL_OFFSET_NUMBER_OF_KNOT = 2
+CAL_OFFSET_KNOT = 4
+
+# Number of calibrations kept in the cache of the process
+CACHE_SIZE = 8
+
+
 def read_data_CALI(directory_cali, filename_cali, extension_cali='.CALI'):
     """
     Read .CALI file
@@ -19,15 +53,91 @@ def read_data_CALI(directory_cali, filename_cali, extension_cali='.CALI'):
         print('Lecture fichier CALI : Fichier introuvable')
 
     else:
-        # getting poni, alpha_med and alpha_pix
-        line = [ln.split() for ln in data]
-        correction_pix = []
-        for ii in range(5, len(line)):
-            correction_pix.append(float(line[ii][1]))
-
+        # the correction of each pixel is the second column after the 5 lines of heading
+        correction_pix = np.array([float(ln.split()[1]) for ln in data[5:]])
         return correction_pix
 
 
+def read_data_CALI2(directory_cali, filename_cali, extension_cali='.CALI2'):
+    """
+    Read .CALI2 file
+    return the point of normal incidence [pix] and the size of each pixel
+    """
+    name_cali = directory_cali + '\\' + filename_cali + extension_cali
+
+    try:
+        with open(name_cali, 'r') as file:
+            data = file.readlines()
+
+    except FileNotFoundError:
+        print('Lecture fichier CALI2 : Fichier introuvable')
+
+    else:
+        # getting poni, then dp of each pixel after the 8 lines of heading
+        poni = float(data[4].split('=')[1].split()[0])
+        dp_pix = np.array([float(ln.split()[1]) for ln in data[8:] if len(ln.split()) == 2])
+        return poni, dp_pix
+
+
+def read_data_CALB(directory_cali, filename_cali, extension_cali='.CALB'):
+    """
+    Read binary calibration file
+    """
+    name_cali = directory_cali + '\\' + filename_cali + extension_cali
+
+    try:
+        header = np.fromfile(name_cali, dtype=HEADER, count=1)
+
+    except FileNotFoundError:
+        print('Lecture fichier CALB : Fichier introuvable')
+        return None
+
+    if len(header) == 0 or header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+        print('Lecture fichier CALB : Format inconnu')
+        return None
+
+    correction_pix = np.fromfile(name_cali, dtype='<f8', count=int(header['number_of_pixel'][0]),
+                                 offset=HEADER.itemsize)
+    return correction_pix.astype(float)
+
+
+def read_data_CAL(directory_cali, filename_cali, extension_cali='.CAL'):
+    """
+    Read Inel .CAL file
+    return the angle correction of each channel, from the calibration knots (as for the .FDT files)
+    """
+    name_cali = directory_cali + '\\' + filename_cali + extension_cali
+
+    try:
+        with open(name_cali, 'rb') as file:
+            raw = file.read()
+
+    except FileNotFoundError:
+        print('Lecture fichier CAL : Fichier introuvable')
+        return None
+
+    # Records joined without their markers
+    records = []
+    start = CAL_FIRST_RECORD
+    while start < len(raw):
+        records.append(raw[start:start + CAL_RECORD_SIZE])
+        start += CAL_RECORD_SIZE
+        if raw[start:start + len(CAL_MARKER)] != CAL_MARKER:
+            records.append(raw[start:])
+            break
+        start += len(CAL_MARKER)
+    data = b''.join(records)
+
+    try:
+        number_of_knot = int(np.frombuffer(data, dtype='<u2', count=1, offset=CAL_OFFSET_NUMBER_OF_KNOT)[0])
+        knot = np.frombuffer(data, dtype='<f8', count=number_of_knot, offset=CAL_OFFSET_KNOT)
+    except (ValueError, IndexError):
+        print('Lecture fichier CAL : Fichier incomplet')
+        return None
+
+    return inel_data_FDT.channel_angle(knot)
+
+
 def write_data_CALI(correction_pix, directory, filename, extension='.CALI'):
     """
     Write a .CALI file giving the correction angle for each pixel
@@ -50,8 +160,75 @@ def write_data_CALI(correction_pix, directory, filename, extension='.CALI'):
 
         # write data
         file.write('\nangle correction in function of the pixel\n')
-        for ii in range(len(correction_pix)):
-            file.write(f'  {ii + 1}     {correction_pix[ii]:5.4e}\n')
+        file.write(''.join([f'  {ii + 1}     {correction_pix[ii]:5.4e}\n' for ii in range(len(correction_pix))]))
 
         file.close()
 
+
+def write_data_CALB(correction_pix, directory, filename, extension='.CALB'):
+    """
+    Write a binary calibration file giving the correction angle for each pixel
+    """
+    name = directory + '\\' + filename + extension
+    correction_pix = np.asarray(correction_pix, dtype='<f8')
+
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['number_of_pixel'] = len(correction_pix)
+
+    try:
+        with open(name, 'wb') as file:
+            file.write(header.tobytes())
+            file.write(correction_pix.tobytes())
+
+    except FileNotFoundError:
+        print('Ecriture fichier CALB : Dossier introuvable')
+
+
+# Readers and writers of each format
+READERS = {'.CALI': read_data_CALI, '.CALB': read_data_CALB, '.CAL': read_data_CAL}
+WRITERS = {'.CALI': write_data_CALI, '.CALB': write_data_CALB}
+
+
+def read_calibration(directory, filename, extension='.CALI'):
+    """
+    Read the angle correction of each pixel of a calibration file whatever its format (.CALI, .CALB or .CAL),
+    the file is only read again if it changed since its last reading in the process. The arrays returned are
+    shared : read only.
+    """
+    name = directory + '\\' + filename + extension
+    reader = READERS.get(extension.upper())
+    if reader is None:
+        print(f'Lecture fichier calibration : Format {extension} non supporté')
+        return None
+
+    try:
+        stat = os.stat(name)
+    except OSError:
+        # the reader displays the error
+        return reader(directory, filename, extension)
+
+    return _read_calibration(directory, filename, extension, stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _read_calibration(directory, filename, extension, size, mtime):
+    """
+    Read a calibration file, cached with its size and modification time
+    """
+    correction_pix = READERS[extension.upper()](directory, filename, extension)
+    if isinstance(correction_pix, np.ndarray):
+        correction_pix.flags.writeable = False
+    return correction_pix
+
+
+def write_calibration(correction_pix, directory, filename, extension='.CALI'):
+    """
+    Write a calibration file, the format is chosen with the extension (.CALI or .CALB)
+    """
+    writer = WRITERS.get(extension.upper())
+    if writer is None:
+        print(f'Ecriture fichier calibration : Format {extension} non supporté')
+        return
+    writer(correction_pix, directory, filename, extension)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Define the direct angle correction of the detector (from a calibration file) applied to a whole scan:
+    the 2theta angle of each pixel is the 2theta angle of the acquisition plus the correction of the pixel,
+    the intensity of each pixel is divided by the cosine of its correction.
+The functions work on the arrays of all the images at once (broadcasting), the result is written in a new
+array, in a preallocated array (out) or in place (out is the input array).
+"""
+
+
+import numpy as np
+
+
+def inverse_cosine(correction_pix):
+    """
+    Per-pixel factor 1 / cos(correction) of the intensity (correction in [deg]), computed once per calibration
+    """
+    return 1. / np.cos(np.asarray(correction_pix, dtype=float) * np.pi / 180)
+
+
+def check_calibration(cts, correction_pix):
+    """
+    True if the calibration has one correction per pixel of the scan, else the error is printed
+    (e.g. a .CALI of the .TTX export applied to the channels of a .FDT)
+    """
+    if np.shape(cts)[-1] != len(correction_pix):
+        print(f'Correction angulaire : {len(correction_pix)} pixels dans la calibration, '
+              f'{np.shape(cts)[-1]} dans le scan')
+        return False
+    return True
+
+
+def number_of_point(cts, correction_pix):
+    """
+    Number of pixel corrected : the calibration and the scan may not have the same number of pixel
+    """
+    return min(np.shape(cts)[-1], len(correction_pix))
+
+
+def correct_intensity(cts, inverse_cos, out=None):
+    """
+    Corrected intensity of every image : array (number of image, number of point) of cts / cos(correction)
+    inverse_cos : factor of each pixel (inverse_cosine), out : preallocated float array or cts itself
+    """
+    number = number_of_point(cts, inverse_cos)
+    cts = np.asarray(cts)[..., :number]
+    if out is None:
+        out = np.empty(cts.shape, dtype=float)
+    return np.multiply(cts, inverse_cos[:number], out=out)
+
+
+def correct_angle(tth, correction_pix, number=None, out=None):
+    """
+    Corrected 2theta of every pixel of every image : array (number of image, number of point) of tth + correction
+    tth : 2theta angle of each acquisition, number : number of point (None : all the pixels of the calibration)
+    """
+    correction_pix = np.asarray(correction_pix, dtype=float)[:number]
+    tth = np.asarray(tth, dtype=float)
+    if out is None:
+        out = np.empty(tth.shape + correction_pix.shape, dtype=float)
+    return np.add(tth[..., np.newaxis], correction_pix, out=out)
+
+
+def correct_scan(tth, cts, correction_pix):
+    """
+    Apply the direct angle correction to all the images of a scan
+    return the corrected 2theta and intensity, arrays (number of image, number of point)
+    """
+    cts_real = correct_intensity(cts, inverse_cosine(correction_pix))
+    tth_real = correct_angle(tth, correction_pix, cts_real.shape[-1])
+    return tth_real, cts_real
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Define a vectorized Levenberg-Marquardt fit of the gauss_backg function on all the images of a scan at once
+"""
+
+
+import numpy as np
+
+from utils import maths_functions  # registers gauss_backg
+from utils import models
+
+
+# Number of parameter of gauss_backg (x0, IM, H, A, B)
+NUMBER_OF_PARAMETER = 5
+
+# Stopping criteria (same tolerances as curve_fit)
+MAX_ITERATION = 200 * (NUMBER_OF_PARAMETER + 1)
+FTOL = 1.49012e-08
+XTOL = 1.49012e-08
+
+# Damping of the Levenberg-Marquardt steps
+INITIAL_DAMPING = 1e-3
+DAMPING_FACTOR = 10.
+MAX_DAMPING = 1e16
+
+
+def fit_gauss_backg(x, cts, guess, max_iteration=MAX_ITERATION):
+    """
+    Fit the gauss_backg function on every image at once
+        x : array (number of pixel) of abscissa, common to all the images
+        cts : array (number of image, number of pixel) of intensity
+        guess : initial guess [x0, IM, H, A, B] common to all the images, or array (number of image, 5)
+    Returns:
+        popt : array (number of image, 5) of optimal parameters
+        pcov : array (number of image, 5, 5) of covariance matrices (same meaning as the pcov of curve_fit)
+        converged : array (number of image) of boolean, False for the images which reached max_iteration or whose
+                    damping blew up (no step reducing the cost, e.g. singular system)
+    """
+    x = np.asarray(x, dtype=float)
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+    number_of_image, number_of_pixel = cts.shape
+
+    popt = np.array(np.broadcast_to(np.asarray(guess, dtype=float), (number_of_image, NUMBER_OF_PARAMETER)))
+    damping = np.full(number_of_image, INITIAL_DAMPING)
+    converged = np.zeros(number_of_image, dtype=bool)
+    finished = np.zeros(number_of_image, dtype=bool)
+    cost = _cost(x, cts, popt)
+
+    for iteration in range(max_iteration):
+        # Only the images not finished yet (converged or failed) are iterated
+        active = np.flatnonzero(~finished)
+        if len(active) == 0:
+            break
+
+        p = popt[active]
+        jacobian = _jacobian(x, p)
+        residual = cts[active] - _model(x, p)
+
+        # Damped normal equations : (JtJ + damping * diag(JtJ)) step = Jt r
+        normal_matrix = np.einsum('nmi,nmj->nij', jacobian, jacobian)
+        normal_vector = np.einsum('nmi,nm->ni', jacobian, residual)
+        diagonal = np.einsum('nii->ni', normal_matrix)
+        damped_matrix = normal_matrix.copy()
+        np.einsum('nii->ni', damped_matrix)[...] += damping[active, None] * np.maximum(diagonal, 1e-300)
+        step, regular = _solve(damped_matrix, normal_vector)
+
+        trial = p + step
+        trial_cost = _cost(x, cts[active], trial)
+
+        accepted, damping[active], converged[active], failed = update_damping(cost[active], trial_cost, p, step,
+                                                                              regular, damping[active])
+        popt[active[accepted]] = trial[accepted]
+        cost[active[accepted]] = trial_cost[accepted]
+        finished[active] = converged[active] | failed
+
+    pcov = _covariance(x, cts, popt, cost)
+    return popt, pcov, converged
+
+
+def update_damping(cost, trial_cost, p, step, regular, damping):
+    """
+    Levenberg-Marquardt update of several problems at once (one line per problem) : the steps which reduce the cost
+    are accepted and the damping decreases, the damping of the other problems increases
+        cost, trial_cost : costs before and after the step, p : parameters before the step
+        regular : False for the problems whose system was singular (null step, which is not a small step)
+    return accepted, new damping, converged (small decrease of the cost or small step) and failed (damping blown
+    up without converging)
+    """
+    accepted = np.isfinite(trial_cost) & (trial_cost < cost)
+    small_cost = accepted & (cost - trial_cost <= FTOL * cost)
+    small_step = regular & np.all(np.abs(step) <= XTOL * (XTOL + np.abs(p)), axis=1)
+
+    damping = np.where(accepted, damping / DAMPING_FACTOR, damping * DAMPING_FACTOR)
+    converged = small_cost | small_step
+    failed = ~converged & (damping > MAX_DAMPING)
+    return accepted, damping, converged, failed
+
+
+def _model(x, p):
+    """
+    gauss_backg evaluated for each line of parameters p (number of image, 5)
+    """
+    return models.get('gauss_backg').function(x, *(p.T[:, :, None]))
+
+
+def _jacobian(x, p):
+    """
+    Jacobian (number of image, number of pixel, 5) of gauss_backg for each line of parameters p
+    """
+    return models.get('gauss_backg').jac(x, *(p.T[:, :, None]))
+
+
+def _cost(x, cts, p):
+    """
+    Sum of the squared residuals of each image
+    """
+    residual = cts - _model(x, p)
+    return np.einsum('nm,nm->n', residual, residual)
+
+
+def _solve(matrix, vector):
+    """
+    Solve a stack of linear systems, singular systems give a null step
+    return the steps and a boolean array, False for the singular systems
+    """
+    step = np.zeros(vector.shape)
+    regular = np.isfinite(matrix).all(axis=(1, 2)) & np.isfinite(vector).all(axis=1)
+    regular[regular] = np.linalg.cond(matrix[regular]) < 1 / np.finfo(float).eps
+    if np.any(regular):
+        step[regular] = np.linalg.solve(matrix[regular], vector[regular][..., None])[..., 0]
+    return step, regular
+
+
+def _covariance(x, cts, p, cost):
+    """
+    Covariance of the optimal parameters : pinv(JtJ) * residual variance, inf if there are not enough points
+    """
+    number_of_image, number_of_pixel = cts.shape
+    degrees_of_freedom = number_of_pixel - NUMBER_OF_PARAMETER
+    if degrees_of_freedom <= 0:
+        return np.full((number_of_image, NUMBER_OF_PARAMETER, NUMBER_OF_PARAMETER), np.inf)
+
+    jacobian = _jacobian(x, p)
+    normal_matrix = np.einsum('nmi,nmj->nij', jacobian, jacobian)
+
+    # Images whose parameters are not finite (e.g. empty image) : nan covariance
+    pcov = np.full(normal_matrix.shape, np.nan)
+    finite = np.isfinite(normal_matrix).all(axis=(1, 2))
+    pcov[finite] = np.linalg.pinv(normal_matrix[finite]) * (cost[finite] / degrees_of_freedom)[:, None, None]
+    return pcov
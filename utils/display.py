@@ -5,25 +5,28 @@ Define function which display all the image of an acquisisition
 
 
 import numpy as np
-import matplotlib.pyplot as plt
 
-from utils import seifert_data_TTX
+from utils import plots
+from utils import scan_files
 
 
-def display_image(directory, filename, extension='TTX'):
+def display_image(directory, filename, extension='TTX', plotter=None):
     """
-    Display all the image of the acquisition
+    Display all the image of the acquisition (plotter : destination of the figures, interactive by default)
     """
-    tth, omega, chi, phi, cts = seifert_data_TTX.read_seifert_data_TTX(directory, filename, extension)
-
-    x = np.arange(0, len(cts[0]), 1)
-
-    for i in range(len(cts)):
-        fig, ax = plt.subplots(figsize=(12, 12))
-        ax.set_title(
-            f'{filename}, image n°{i + 1} (tth_motor={tth[i]:4.1f}, omega={omega[i]:4.1f}, chi={chi[i]:4.1f}, phi={phi[i]:4.1f})')
-        ax.set_xlabel('Detector pixel [pix]')
-        ax.set_ylabel('Intensity [cts]')
-        ax.plot(x, cts[i], label='data')
-        plt.legend()
-        plt.show()
+    if plotter is None:
+        plotter = plots.Plotter()
+
+    scan = scan_files.read_scan(directory, filename, extension)
+    if scan is None:
+        return
+    tth, omega, chi, phi, cts = scan.tth, scan.omega, scan.chi, scan.phi, scan.cts
+
+    x = np.arange(0, scan.number_of_pixel, 1)
+
+    for i in range(scan.number_of_image):
+        plot = plots.Plot(f'{filename}_image_{i + 1:03d}',
+                          f'{filename}, image n°{i + 1} (tth_motor={tth[i]:4.1f}, omega={omega[i]:4.1f}, chi={chi[i]:4.1f}, phi={phi[i]:4.1f})',
+                          'Detector pixel [pix]', 'Intensity [cts]')
+        plot.plot(x, cts[i], label='data')
+        plotter.add(plot)
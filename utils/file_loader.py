@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Define a loader of several scan and calibration files at once:
+    each file is read and parsed by a pool of threads, so the waiting for the disk (or the network share)
+    of all the files overlaps and a series of files takes about as long as its slowest file.
+    The readers are the usual ones (scan_files.read_scan, CALI_data.read_calibration) with their caches.
+A request is a tuple (kind, directory, filename, extension), kind is 'scan' or 'calibration'.
+"""
+
+from utils import CALI_data
+from utils import scan_files
+
+
+# Maximum number of files read at the same time
+NUMBER_OF_THREAD = 8
+
+# Reader of each kind of file
+READERS = {'scan': scan_files.read_scan, 'calibration': CALI_data.read_calibration}
+
+
+def scan_request(directory, filename, extension='.TTX'):
+    """
+    Request of a scan file (.TTX or .FDT)
+    """
+    return ('scan', directory, filename, extension)
+
+
+def calibration_request(directory, filename, extension='.CALI'):
+    """
+    Request of a calibration file (.CALI, .CALB or .CAL)
+    """
+    return ('calibration', directory, filename, extension)
+
+
+def iter_files(requests, ordered=True, number_of_thread=NUMBER_OF_THREAD):
+    """
+    Read the requested files concurrently
+    yield (index of the request, result of the reader : Scan, calibration, None if the file can not be read)
+    in the order of the requests (ordered=True) or as soon as each file is ready (ordered=False)
+    A file requested several times is read once.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    requests = [tuple(request) for request in requests]
+    unique = list(dict.fromkeys(requests))
+    if len(unique) == 0:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(number_of_thread, len(unique)))) as pool:
+        futures = {request: pool.submit(READERS[request[0]], *request[1:]) for request in unique}
+
+        if ordered:
+            for index, request in enumerate(requests):
+                yield index, futures[request].result()
+            return
+
+        indices = dict()
+        for index, request in enumerate(requests):
+            indices.setdefault(futures[request], []).append(index)
+        for future in as_completed(indices):
+            for index in indices[future]:
+                yield index, future.result()
+
+
+def load_files(requests, number_of_thread=NUMBER_OF_THREAD):
+    """
+    Read the requested files concurrently
+    return the list of the results, in the order of the requests
+    """
+    return [result for index, result in iter_files(requests, True, number_of_thread)]
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Define a persistent cache of the peak fits:
+    each fitted image is stored in a small file named after a hash of its inputs
+    (model, abscissa, counts of the window, initial guess, bounds), so a rerun of an analysis only
+    fits the images whose inputs changed. A guess shared by all the images (median of the scan) can be left out
+    of the key : removing images then keeps the cached fits of the other ones.
+    The least recently used files are removed above a size limit.
+"""
+
+
+import hashlib
+import os
+
+import numpy as np
+
+from utils import batch_fit
+from utils import parallel_fit
+
+
+# Extension of the cache files
+CACHE_EXTENSION = '.FIT'
+# Changed when the fitting algorithm changes, the previous entries are then ignored
+VERSION = b'batch_fit 2'
+# Maximal size of the cache directory [bytes]
+MAX_SIZE = 64 << 20
+
+
+class FitCache:
+    """
+    Cache of the fits stored in a directory, with the number of hit and miss of the session
+    """
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, model, x, cts, guess, bounds=None):
+        """
+        Hash of the inputs of one fit (guess None : guess shared by the images, not part of the key)
+        """
+        sha1 = hashlib.sha1(VERSION)
+        sha1.update(model.encode())
+        for array in (x, cts):
+            sha1.update(np.ascontiguousarray(array, dtype='<f8').tobytes())
+        if guess is None:
+            sha1.update(b'shared guess')
+        else:
+            sha1.update(np.ascontiguousarray(guess, dtype='<f8').tobytes())
+        sha1.update(repr(bounds).encode())
+        return sha1.hexdigest()
+
+    def name(self, key):
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def get(self, key):
+        """
+        Return (popt, pcov, converged) of a cached fit, None if the fit is not in the cache
+        """
+        try:
+            result = np.fromfile(self.name(key), dtype='<f8')
+            # Last use of the entry, for the eviction
+            os.utime(self.name(key))
+        except OSError:
+            result = None
+
+        if result is None or len(result) != _entry_size():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        number_of_parameter = batch_fit.NUMBER_OF_PARAMETER
+        popt = result[:number_of_parameter]
+        pcov = result[number_of_parameter:-1].reshape(number_of_parameter, number_of_parameter)
+        return popt, pcov, bool(result[-1])
+
+    def put(self, key, popt, pcov, converged):
+        """
+        Store the result of one fit
+        """
+        result = np.concatenate([popt, np.ravel(pcov), [float(converged)]]).astype('<f8')
+        temporary = self.name(key) + '.tmp'
+        try:
+            result.tofile(temporary)
+            os.replace(temporary, self.name(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is smaller than max_size
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(CACHE_EXTENSION):
+                try:
+                    stat = os.stat(os.path.join(self.directory, filename))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, filename))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, filename in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            size -= entry_size
+
+    def report(self):
+        print(f'Fit cache : {self.hits} hit(s), {self.misses} miss(es)')
+
+
+def fit_gauss_backg(cache, x, cts, guess, number_of_worker=1, shared_guess=False):
+    """
+    Fit the gauss_backg function on every image (same arguments and results as parallel_fit.fit_gauss_backg),
+    the images found in the cache are not fitted again. Without cache (None) all the images are fitted.
+    shared_guess True : the guess is common to the images and computed on the scan, it is left out of the keys
+    """
+    if cache is None:
+        return parallel_fit.fit_gauss_backg(x, cts, guess, number_of_worker)
+
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+    number_of_image = cts.shape[0]
+    number_of_parameter = batch_fit.NUMBER_OF_PARAMETER
+    guess = np.array(np.broadcast_to(np.asarray(guess, dtype=float), (number_of_image, number_of_parameter)))
+
+    popt = np.zeros((number_of_image, number_of_parameter))
+    pcov = np.zeros((number_of_image, number_of_parameter, number_of_parameter))
+    converged = np.zeros(number_of_image, dtype=bool)
+
+    # Looking for each image in the cache
+    keys = [cache.key('gauss_backg', x, cts[ii], None if shared_guess else guess[ii]) for ii in range(number_of_image)]
+    missing = []
+    for ii in range(number_of_image):
+        result = cache.get(keys[ii])
+        if result is None:
+            missing.append(ii)
+        else:
+            popt[ii], pcov[ii], converged[ii] = result
+
+    # Fitting the other images
+    if len(missing) > 0:
+        popt[missing], pcov[missing], converged[missing] = parallel_fit.fit_gauss_backg(x, cts[missing],
+                                                                                        guess[missing],
+                                                                                        number_of_worker)
+        for ii in missing:
+            cache.put(keys[ii], popt[ii], pcov[ii], converged[ii])
+        cache.evict()
+
+    return popt, pcov, converged
+
+
+def _entry_size():
+    """
+    Number of float in a cache file : popt, pcov and converged
+    """
+    return batch_fit.NUMBER_OF_PARAMETER * (batch_fit.NUMBER_OF_PARAMETER + 1) + 1
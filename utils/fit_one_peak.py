@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 """
-Define fit one peak function use by detector calibration module
+Define fit one peak functions use by detector calibration and beam alignment modules
 """
 
 
 import numpy as np
-from scipy.optimize import curve_fit
 
-from utils import list_manipulation
+from utils import fit_cache
 from utils import maths_functions
+from utils import models
+from utils import peak_search
+from utils import screening
+
+
+# Size of the windows on wich the background is calculated (None : automatic, from the width of the peaks)
+SIZE_WINDOW_BACKGROUND = 20
 
 
 def fit_one_peak(image):
@@ -16,42 +22,101 @@ def fit_one_peak(image):
     Take in argument a list corresponding at an image with only one peak
     return optimal parameters for a gaussian_background function of this peak
     """
+    guess = one_peak_guesses([image])[0]
 
-    # Obtaining initial guess
+    # Fiting and getting optimals parameters
+    x = np.arange(1, len(image) + 1, 1)  # pixels beginning at 1
+    popt, pcov = models.fit('gauss_backg', x, image, p0=guess)
 
-    # choose the size of the window on wich the background is calculated
-    size_window_background = 20
+    # return optimal parameters
+    return popt, pcov
 
-    x = np.arange(0, len(image), 1)
-    step = x[1] - x[0]
 
-    # central position
-    x0 = list_manipulation.index(image, max(image)) + 1  # pixel beginning at zero
-    # maximale intensity
-    IM = max(image)
-    # FWHM ~= Area/IM
-    H = maths_functions.trapeze_method(image, step) / IM
+def fit_all_peaks(cts, number_of_worker=1, cache=None, size_window_background=SIZE_WINDOW_BACKGROUND):
+    """
+    Take in argument an array (number of image, number of pixel) of images with only one peak
+    return optimal parameters, covariances and convergence of a gaussian_background function for each image,
+    all the images are fitted at once (split between number_of_worker processes),
+    the images already in the fit cache (fit_cache.FitCache) are not fitted again
+    """
+    guess = one_peak_guesses(cts, size_window_background)
 
-    # getting a and B coefficient for the background
-    background_left = image[0:size_window_background]
-    background_right = image[len(image) - size_window_background:len(image)]
+    x = np.arange(1, cts.shape[1] + 1, 1)  # pixels beginning at 1
+    return fit_cache.fit_gauss_backg(cache, x, cts, guess, number_of_worker)
 
-    left_point_value = np.mean(background_left)
-    right_point_value = np.mean(background_right)
 
-    left_point_absc = size_window_background / 2
-    right_point_absc = len(image) - size_window_background / 2
+def scan_window(scan, xmin, xmax, size_window_background_left, size_window_background_right):
+    """
+    Take in argument a Scan and a window [xmin, xmax] with its background sizes, the None being found automatically
+    return xmin, xmax, size_window_background_left, size_window_background_right (None if no peak is found)
+    """
+    return peak_search.scan_window(scan.cts, xmin, xmax, size_window_background_left, size_window_background_right)
 
-    B = (left_point_value - right_point_value) / (left_point_absc - right_point_absc)
-    A = left_point_value - B * left_point_absc
 
-    # initial guess
-    guess = [x0, IM, H, A, B]
+def window_guess(scan, xmin, xmax, size_window_background_left, size_window_background_right):
+    """
+    Take in argument a Scan with one peak in the window [xmin, xmax]
+    return the initial guess [x0, IM, H, A, B] common to all the images (median of the images)
+    """
+    return maths_functions.initial_guess(scan.cts, xmin, xmax,
+                                         size_window_background_left, size_window_background_right)
 
-    # Fiting and getting optimals parameters
-    x = np.arange(1, len(image) + 1, 1)  # pixels beginning at 1
-    popt, pcov = curve_fit(maths_functions.gauss_backg, x, image, p0=guess)
 
-    # return optimal parameters
-    return popt, pcov
+def fit_window(scan, guess, xmin, xmax, number_of_worker=1, cache=None):
+    """
+    Take in argument a Scan with one peak in the window [xmin, xmax] and the initial guess [x0, IM, H, A, B]
+    return optimal parameters, covariances and convergence of a gaussian_background function for each image,
+    fitted on the window (pixels beginning at 0). The guess, median of the scan, is not part of the keys of the
+    cached fits : removing images keeps the fits of the other ones
+    """
+    x = np.arange(0, scan.number_of_pixel, 1)
+    return fit_cache.fit_gauss_backg(cache, x[xmin:xmax], scan.cts[:, xmin:xmax], list(guess), number_of_worker,
+                                     shared_guess=True)
+
+
+def screen_window(scan, fit, xmin, xmax):
+    """
+    Take in argument a Scan and the fits of fit_window on the window [xmin, xmax]
+    return the tests of the fits of the automatic screening (screening.screen_fits)
+    """
+    x = np.arange(0, scan.number_of_pixel, 1)
+    return screening.screen_fits(x[xmin:xmax], scan.cts[:, xmin:xmax], fit[0], fit[2])
 
+
+def one_peak_guesses(cts, size_window_background=SIZE_WINDOW_BACKGROUND):
+    """
+    Take in argument an array (number of image, number of pixel) of images with only one peak
+    return the initial guess [x0, IM, H, A, B] of a gaussian_background function for each image
+    (background on size_window_background pixels at each edge, None : automatic)
+    """
+    number_of_pixel = np.shape(cts)[-1]
+    if size_window_background is None:
+        size_window_background = peak_search.edge_background(cts)
+    guess = maths_functions.peak_statistics(cts, 0, number_of_pixel,
+                                            size_window_background, size_window_background)[0]
+    guess[:, 0] += 1  # pixel beginning at 1
+    return guess
+
+
+def fit_acquisitions(acquisitions, xmin, xmax, size_window_background_left, size_window_background_right):
+    """
+    Take in argument an iterable of Acquisition (for example a streaming reader)
+    yield each acquisition with the optimal parameters and covariance of a gaussian_background function
+    fitted on the window [xmin, xmax] : the initial guess is obtained on the acquisition itself
+    (the None of the window are found on the first acquisition and kept for the next ones)
+    """
+    window = (xmin, xmax, size_window_background_left, size_window_background_right)
+
+    for acquisition in acquisitions:
+        if None in window:
+            window = peak_search.scan_window([acquisition.cts], *window)
+            if window is None:
+                return
+            print(f'Automatic window : xmin = {window[0]}, xmax = {window[1]}, background = {window[2]}, {window[3]}')
+        xmin, xmax, size_window_background_left, size_window_background_right = window
+        x = np.arange(xmin, xmax, 1)
+
+        guess = maths_functions.initial_guess([acquisition.cts], xmin, xmax,
+                                              size_window_background_left, size_window_background_right)
+        popt, pcov = models.fit('gauss_backg', x, acquisition.cts[xmin:xmax], p0=guess)
+        yield acquisition, popt, pcov
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Define the global fit of the peaks of all the images of a scan with a model of their positions:
+    image i : y = gauss_backg(x, x0_i, IM_i, H_i, A_i, B_i) with x0_i = design_i . shared
+The intensity, width and background of each image (4 local parameters) and the shared parameters of the
+positions (e.g. the beam misalignment e, l0) are refined together. The normal equations are an arrowhead :
+one 4 x 4 block per image coupled only to the shared parameters, so each Levenberg-Marquardt step eliminates
+the local blocks (Schur complement) and solves a system of the size of the shared parameters. The work grows
+linearly with the number of image.
+"""
+
+
+import numpy as np
+
+from utils import batch_fit
+from utils import maths_functions  # registers gauss_backg
+from utils import models
+
+
+# Number of local parameter of each image (IM, H, A, B)
+NUMBER_OF_LOCAL = 4
+
+
+def fit_global_gauss_backg(x, cts, design, local, shared, max_iteration=batch_fit.MAX_ITERATION):
+    """
+    Fit the peaks of all the images with positions given by a model linear in the shared parameters
+        x : array (number of pixel) of abscissa, common to all the images
+        cts : array (number of image, number of pixel) of intensity
+        design : array (number of image, number of shared) : position of the peak of image i = design[i] . shared
+        local : initial guess (number of image, 4) of IM, H, A, B, shared : initial guess (number of shared)
+    Returns:
+        shared : array (number of shared) of optimal shared parameters
+        pcov : array (number of shared, number of shared) of their covariance (same meaning as the pcov of curve_fit)
+        popt : array (number of image, 5) of optimal [x0, IM, H, A, B] of each image
+        converged : False if the fit reached max_iteration or if its damping blew up (same stopping criteria
+                    and damping as batch_fit)
+    """
+    x = np.asarray(x, dtype=float)
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+    design = np.asarray(design, dtype=float)
+    local = np.array(local, dtype=float)
+    shared = np.array(shared, dtype=float)
+
+    damping = np.array([batch_fit.INITIAL_DAMPING])
+    converged = False
+    cost = _cost(x, cts, design, local, shared)
+
+    for iteration in range(max_iteration):
+        residual = cts - _model(x, design, local, shared)
+        normal_local, coupling, normal_shared, vector_local, vector_shared = _normal_equations(
+            x, design, local, shared, residual)
+
+        # Damped normal equations : (JtJ + damping * diag(JtJ)) step = Jt r, the diagonal of a parameter
+        # without effect (e.g. width of an empty image) keeps a small damping : regular blocks
+        diagonal_local = np.einsum('nii->ni', normal_local)
+        diagonal_local = np.maximum(diagonal_local, 1e-12 * np.max(diagonal_local, axis=1, keepdims=True) + 1e-300)
+        damped_local = normal_local.copy()
+        np.einsum('nii->ni', damped_local)[...] += damping[0] * diagonal_local
+        damped_shared = normal_shared + damping[0] * np.diag(np.maximum(np.diag(normal_shared), 1e-300))
+
+        step_local, step_shared = _solve(damped_local, coupling, damped_shared, vector_local, vector_shared)
+        regular = np.all(np.isfinite(step_local)) and np.all(np.isfinite(step_shared))
+        if not regular:
+            step_local, step_shared = np.zeros(local.shape), np.zeros(shared.shape)
+        trial_local = local + step_local
+        trial_shared = shared + step_shared
+        trial_cost = _cost(x, cts, design, trial_local, trial_shared)
+
+        # Same acceptance and stopping as batch_fit, all the parameters as the row of a single fit
+        accepted, damping, small, failed = batch_fit.update_damping(
+            np.array([cost]), np.array([trial_cost]), np.concatenate([local.ravel(), shared])[None, :],
+            np.concatenate([step_local.ravel(), step_shared])[None, :], np.array([regular]), damping)
+        if accepted[0]:
+            local, shared, cost = trial_local, trial_shared, trial_cost
+        if small[0] or failed[0]:
+            converged = bool(small[0])
+            break
+
+    pcov = _covariance(x, cts, design, local, shared, cost)
+    popt = np.column_stack([design @ shared, local])
+    return shared, pcov, popt, converged
+
+
+def _model(x, design, local, shared):
+    """
+    gauss_backg of every image, the positions given by the shared parameters
+    """
+    p = np.column_stack([design @ shared, local])
+    return models.get('gauss_backg').function(x, *(p.T[:, :, None]))
+
+
+def _cost(x, cts, design, local, shared):
+    """
+    Sum of the squared residuals of all the images
+    """
+    residual = cts - _model(x, design, local, shared)
+    return np.einsum('nm,nm->', residual, residual)
+
+
+def _normal_equations(x, design, local, shared, residual):
+    """
+    Blocks of the normal equations JtJ and of Jt r :
+    local blocks (number of image, 4, 4), coupling (number of image, 4, number of shared),
+    shared block (number of shared, number of shared), local vectors (number of image, 4), shared vector
+    """
+    p = np.column_stack([design @ shared, local])
+    jacobian = models.get('gauss_backg').jac(x, *(p.T[:, :, None]))
+    d_x0, jacobian_local = jacobian[..., 0], jacobian[..., 1:]
+
+    # The shared columns of image i are d_x0 * design[i]
+    normal_local = np.einsum('nmi,nmj->nij', jacobian_local, jacobian_local)
+    coupling = np.einsum('nmi,nm->ni', jacobian_local, d_x0)[:, :, None] * design[:, None, :]
+    normal_shared = np.einsum('n,ni,nj->ij', np.einsum('nm,nm->n', d_x0, d_x0), design, design)
+    vector_local = np.einsum('nmi,nm->ni', jacobian_local, residual)
+    vector_shared = np.einsum('nm,nm->n', d_x0, residual) @ design
+    return normal_local, coupling, normal_shared, vector_local, vector_shared
+
+
+def _solve(normal_local, coupling, normal_shared, vector_local, vector_shared):
+    """
+    Solve the arrowhead normal equations : elimination of the local blocks (Schur complement), then
+    back substitution of the shared step in each block (not finite if the system is singular)
+    """
+    try:
+        inverse_coupling = np.linalg.solve(normal_local, coupling)
+        inverse_vector = np.linalg.solve(normal_local, vector_local[..., None])[..., 0]
+        schur = normal_shared - np.einsum('nki,nkj->ij', coupling, inverse_coupling)
+        step_shared = np.linalg.solve(schur, vector_shared - np.einsum('nki,nk->i', coupling, inverse_vector))
+    except np.linalg.LinAlgError:
+        return np.full(vector_local.shape, np.nan), np.full(vector_shared.shape, np.nan)
+    step_local = inverse_vector - np.einsum('nkj,j->nk', inverse_coupling, step_shared)
+    return step_local, step_shared
+
+
+def _covariance(x, cts, design, local, shared, cost):
+    """
+    Covariance of the shared parameters : block of pinv(JtJ) (inverse of the Schur complement) * residual variance,
+    inf if there are not enough points
+    """
+    number_of_image, number_of_pixel = cts.shape
+    number_of_shared = len(shared)
+    degrees_of_freedom = number_of_image * (number_of_pixel - NUMBER_OF_LOCAL) - number_of_shared
+    if degrees_of_freedom <= 0 or not np.isfinite(cost):
+        return np.full((number_of_shared, number_of_shared), np.inf)
+
+    residual = cts - _model(x, design, local, shared)
+    normal_local, coupling, normal_shared = _normal_equations(x, design, local, shared, residual)[:3]
+    schur = normal_shared - np.einsum('nki,nkj->ij', coupling, np.linalg.pinv(normal_local) @ coupling)
+    return np.linalg.pinv(schur) * cost / degrees_of_freedom
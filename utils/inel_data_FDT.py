@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Define function for read Inel binary datafile .FDT (acquisition file of the instrument PC)
+    header : 16448 bytes (sample, dates, wavelength, calibration of the detector)
+    then one block of 4160 bytes per acquisition (date, acquisition time, counts of each channel, angles)
+The pixels of the scan are the 1023 raw channels of the detector, not the pixels of the .TTX export (counts
+resampled on a regular angle grid) : the pixel windows, peak positions and .CALI corrections of a .TTX do not
+apply to a .FDT (use the .CAL calibration of the detector).
+"""
+
+
+import mmap
+
+import numpy as np
+
+from utils import scan_data
+
+
+# Size of the header and of one acquisition block [bytes]
+HEADER_SIZE = 16448
+BLOCK_SIZE = 4160
+# Number of channel of the detector stored in one block
+NUMBER_OF_CHANNEL = 1023
+
+# Position of the fields in the header [bytes]
+OFFSET_NUMBER_OF_IMAGE = 2
+OFFSET_SAMPLE_NAME = 181
+OFFSET_DATE_BEGIN = 210
+OFFSET_DATE_END = 230
+OFFSET_WAVELENGTH = 257
+OFFSET_CALIBRATION_FILE = 312
+OFFSET_NUMBER_OF_KNOT = 806
+OFFSET_KNOT = 808
+
+# Conversion of the calibration knots (fraction of the detector) into channel,
+# the knots are 1 deg apart and centered on 0 deg (matched against the .TTX export of the same files)
+KNOT_CHANNEL_SCALE = 1000.
+KNOT_CHANNEL_OFFSET = 2.
+
+# One acquisition block
+BLOCK = np.dtype({'names': ['date', 'acq_time', 'cts', 'omega', 'tth', 'chi', 'x', 'y', 'z', 'phi'],
+                  'formats': [('<u2', 7), '<f4', ('<i4', NUMBER_OF_CHANNEL),
+                              '<f4', '<f4', '<f4', '<f4', '<f4', '<f4', '<f4'],
+                  'offsets': [0, 14, 22, 4114, 4122, 4126, 4130, 4134, 4138, 4142],
+                  'itemsize': BLOCK_SIZE})
+
+
+def read_inel_data_FDT(directory, filename, extension='.FDT'):
+    """
+    Read .FDT files, the file is mapped while it is parsed and closed after (the counts are copied).
+    Returns a Scan (None if the file can not be read) with:
+        tth, omega, chi, phi : array of angle
+        acq_time : array of acquisition time
+        angle : array of the detector angle of each channel (from the calibration stored in the file)
+        cts : array (number of image, number of channel) of intensity, raw counts of the detector
+              (channels of the detector, not the pixels of the .TTX export of the file)
+    """
+    # Obtaining file name
+    name = directory + '\\' + filename + extension
+
+    try:
+        with open(name, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    except FileNotFoundError:
+        print('Lecture inel data FDT : Fichier introuvable')
+
+    except ValueError:
+        # empty file : it can not be mapped
+        print('Lecture inel data FDT : Fichier incomplet')
+
+    else:
+        try:
+            if len(buffer) < HEADER_SIZE:
+                print('Lecture inel data FDT : Fichier incomplet')
+                return None
+
+            scan = parse_inel_data_FDT(buffer)
+            scan.cts = np.array(scan.cts)
+            return scan
+        finally:
+            buffer.close()
+
+
+def read_inel_header_FDT(directory, filename, extension='.FDT'):
+    """
+    Read the header of .FDT files
+    """
+    # Obtaining file name
+    name = directory + '\\' + filename + extension
+
+    try:
+        with open(name, 'rb') as file:
+            buffer = file.read(HEADER_SIZE)
+
+    except FileNotFoundError:
+        print('Lecture inel data FDT : Fichier introuvable')
+
+    else:
+        if len(buffer) < HEADER_SIZE:
+            print('Lecture inel data FDT : Fichier incomplet')
+            return None
+
+        return parse_inel_header_FDT(buffer)
+
+
+def parse_inel_header_FDT(buffer):
+    """
+    Decode the header of a .FDT file : sample name, dates, wavelength and calibration of the detector
+    """
+    number_of_knot = int(np.frombuffer(buffer, dtype='<u2', count=1, offset=OFFSET_NUMBER_OF_KNOT)[0])
+
+    header = dict()
+    header["number_of_image"] = int(np.frombuffer(buffer, dtype='<u2', count=1, offset=OFFSET_NUMBER_OF_IMAGE)[0])
+    header["sample_name"] = _pascal_string(buffer, OFFSET_SAMPLE_NAME)
+    header["date_begin"] = _pascal_string(buffer, OFFSET_DATE_BEGIN)
+    header["date_end"] = _pascal_string(buffer, OFFSET_DATE_END)
+    header["wavelength"] = float(np.frombuffer(buffer, dtype='<f8', count=1, offset=OFFSET_WAVELENGTH)[0])
+    header["calibration_file"] = _pascal_string(buffer, OFFSET_CALIBRATION_FILE)
+    header["calibration_knot"] = np.frombuffer(buffer, dtype='<f8', count=number_of_knot, offset=OFFSET_KNOT)
+    return header
+
+
+def parse_inel_data_FDT(buffer):
+    """
+    Decode a .FDT file held in a buffer (bytes or mmap)
+    """
+    header = parse_inel_header_FDT(buffer)
+
+    # Acquisition actually written in the file
+    number_of_image = min(header["number_of_image"], max(len(buffer) - HEADER_SIZE, 0) // BLOCK_SIZE)
+    block = np.frombuffer(buffer, dtype=BLOCK, count=number_of_image, offset=HEADER_SIZE)
+
+    # Angles rounded as in the .TTX export (motor positions are stored in simple precision)
+    return scan_data.Scan(_motor(block['tth']), _motor(block['omega']), _motor(block['chi']), _motor(block['phi']),
+                          block['cts'], block['acq_time'], channel_angle(header["calibration_knot"]))
+
+
+def channel_angle(knot):
+    """
+    Detector angle of each channel [deg], interpolated between the calibration knots and extrapolated
+    linearly from the first and last segments beyond the end knots
+    """
+    knot_angle = np.arange(len(knot)) - (len(knot) - 1) / 2
+    knot_channel = np.asarray(knot, dtype=float) * KNOT_CHANNEL_SCALE
+    channel = np.arange(0, NUMBER_OF_CHANNEL, 1) + KNOT_CHANNEL_OFFSET
+    angle = np.interp(channel, knot_channel, knot_angle)
+    if len(knot) < 2:
+        return angle
+
+    low = channel < knot_channel[0]
+    high = channel > knot_channel[-1]
+    angle[low] = knot_angle[0] + (channel[low] - knot_channel[0]) * (
+        (knot_angle[1] - knot_angle[0]) / (knot_channel[1] - knot_channel[0]))
+    angle[high] = knot_angle[-1] + (channel[high] - knot_channel[-1]) * (
+        (knot_angle[-1] - knot_angle[-2]) / (knot_channel[-1] - knot_channel[-2]))
+    return angle
+
+
+def _motor(position):
+    """
+    Motor position rounded to 0.001 deg as in the .TTX export
+    """
+    return np.round(position.astype(float), 3)
+
+
+def _pascal_string(buffer, offset):
+    """
+    Read a string stored as its length (1 byte) followed by its characters
+    """
+    length = buffer[offset]
+    return bytes(buffer[offset + 1:offset + 1 + length]).decode('latin-1')
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Define least squares tools for the models which are linear in their parameters
+"""
+
+
+import numpy as np
+
+
+class IncrementalLinearFit:
+    """
+    Least squares fit of y = design . p updated one point at a time : only the normal equations are stored,
+    so adding a point and solving cost the same whatever the number of point already added
+    """
+
+    def __init__(self, number_of_parameter):
+        self.number_of_point = 0
+        self.normal_matrix = np.zeros((number_of_parameter, number_of_parameter))
+        self.normal_vector = np.zeros(number_of_parameter)
+        self.sum_square = 0.
+
+    def add(self, design_row, y):
+        """
+        Add one point : design_row is the line of the design matrix of this point, y its value
+        """
+        design_row = np.asarray(design_row, dtype=float)
+        self.number_of_point += 1
+        self.normal_matrix += np.outer(design_row, design_row)
+        self.normal_vector += design_row * y
+        self.sum_square += y * y
+
+    def solve(self):
+        """
+        Return the optimal parameters and their covariance matrix (same meaning as the pcov of curve_fit)
+        """
+        number_of_parameter = len(self.normal_vector)
+        popt = np.linalg.lstsq(self.normal_matrix, self.normal_vector, rcond=None)[0]
+
+        # Residual sum of squares obtained from the normal equations
+        degrees_of_freedom = self.number_of_point - number_of_parameter
+        if degrees_of_freedom <= 0:
+            return popt, np.full((number_of_parameter, number_of_parameter), np.inf)
+
+        residual = self.sum_square - 2 * popt @ self.normal_vector + popt @ self.normal_matrix @ popt
+        pcov = np.linalg.pinv(self.normal_matrix) * max(residual, 0.) / degrees_of_freedom
+        return popt, pcov
+
+
+def broadcast_shape(*shapes):
+    """
+    Shape of the broadcasting of arrays of the given shapes (numpy.broadcast_shapes, which needs numpy 1.20),
+    computed on empty arrays
+    """
+    return np.broadcast(*[np.empty(shape + (0,)) for shape in shapes]).shape[:-1]
+
+
+def least_squares(design, y):
+    """
+    Closed-form least squares fit of y = design . p, on one series or on stacked series at once
+        design : array (..., number of point, number of parameter), common to the series or one per series
+        y : array (..., number of point)
+    return optimal parameters (..., number of parameter) and their covariance matrices
+    (..., number of parameter, number of parameter), same meaning as the pcov of curve_fit
+    """
+    design = np.asarray(design, dtype=float)
+    y = np.asarray(y, dtype=float)
+    number_of_point, number_of_parameter = design.shape[-2:]
+    shape = broadcast_shape(design.shape[:-2], y.shape[:-1])
+    design = np.broadcast_to(design, shape + design.shape[-2:])
+    y = np.broadcast_to(y, shape + y.shape[-1:])
+
+    # Singular value decomposition of all the design matrices at once : the singular values below the
+    # threshold of curve_fit (pseudo-inverse) are dropped
+    u, s, vt = np.linalg.svd(design, full_matrices=False)
+    threshold = np.finfo(float).eps * max(number_of_point, number_of_parameter) * s[..., :1]
+    inverse_s = np.where(s > threshold, 1 / np.where(s > 0, s, 1.), 0.)
+
+    coordinates = np.einsum('...ij,...i->...j', u, y) * inverse_s
+    popt = np.einsum('...ij,...i->...j', vt, coordinates)
+
+    # Covariance : pseudo-inverse of the normal matrix times the residual variance
+    degrees_of_freedom = number_of_point - number_of_parameter
+    if degrees_of_freedom <= 0:
+        return popt, np.full(shape + (number_of_parameter, number_of_parameter), np.inf)
+
+    residual = y - np.einsum('...ij,...j->...i', design, popt)
+    variance = np.einsum('...i,...i->...', residual, residual) / degrees_of_freedom
+    scaled_vt = vt * inverse_s[..., :, np.newaxis]
+    pcov = np.einsum('...ki,...kj->...ij', scaled_vt, scaled_vt) * variance[..., np.newaxis, np.newaxis]
+    return popt, pcov
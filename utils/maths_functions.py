@@ -5,9 +5,8 @@ Define mathematical functions
 
 
 import numpy as np
-from numpy.polynomial import Polynomial
 
-from utils import list_manipulation
+from utils import models
 
 
 def gauss(x, *p):
@@ -27,9 +26,11 @@ def gauss(x, *p):
 def polynomial(x, *p):
     """
     Polynomial function: y = p[0] + p[1]*x + p[2]*x^2 + p[3]*x^3 + ...
+    (Horner scheme : the coefficients can be arrays broadcasting with x)
     """
-    poly = Polynomial(p)
-    y = poly(x)
+    y = np.zeros(np.shape(x))
+    for coefficient in reversed(p):
+        y = y * x + coefficient
     return y
 
 
@@ -46,63 +47,71 @@ def gauss_backg(x, *p):
     return y
 
 
-def trapeze_method(listy, step):
+# jacobian of the real peak function
+def gauss_backg_jac(x, *p):
     """
-    Calcul the integral of the function corresponding at the liste using the trapeze method
+    Derivatives of gauss_backg with respect to its 5 parameters (x0, IM, H, A, B),
+    returned along the last axis
     """
+    x0, IM, H, A, B = p
+    # 2.77258872224 = 4*ln(2)
+    exponential = np.exp(-2.77258872224 * (x - x0) ** 2 / H ** 2)
+    d_x0 = IM * exponential * 2 * 2.77258872224 * (x - x0) / H ** 2
+    d_IM = exponential
+    d_H = IM * exponential * 2 * 2.77258872224 * (x - x0) ** 2 / H ** 3
+    d_A = np.ones(np.shape(d_x0))
+    d_B = x * d_A
+    return np.stack([d_x0, d_IM, d_H, d_A, d_B], axis=-1)
 
-    add = 0
-
-    for ii in range(len(listy) - 1):
-        add += 0.5 * step * (listy[ii + 1] + listy[ii])
 
-    return add
+models.register('gauss_backg', gauss_backg, gauss_backg_jac, ('x0', 'IM', 'H', 'A', 'B'))
 
 
-def initial_guess(cts, xmin, xmax, size_window_background_left, size_window_background_right):
+def trapeze_method(listy, step):
     """
-    Calcul x0, IM, H, A and B median using for initial guess for the peak fit
+    Calcul the integral of the function corresponding at the liste using the trapeze method
+    (along the last axis : an array of images gives the integral of each image)
     """
+    listy = np.asarray(listy, dtype=float)
+    return 0.5 * step * np.sum(listy[..., 1:] + listy[..., :-1], axis=-1)
 
-    # Automatic finding peak parameters
-    number_of_image = len(cts)  # nbre of images in the scan
 
-    add_x0 = 0
-    add_IM = 0
-    add_H = 0
-    add_A = 0
-    add_B = 0
-
-    for ii in range(number_of_image):
-        number_of_pixel = len(cts[ii])
-        x = np.arange(0, number_of_pixel, 1)
-        step = x[1] - x[0]
-
-        # Obtaining and add x0, IM and H
-        add_x0 += (xmin + list_manipulation.index(cts[ii][xmin:xmax], max(cts[ii][xmin:xmax])))
-        add_IM += max(cts[ii][xmin:xmax])
-        add_H += (trapeze_method(cts[ii][xmin:xmax], step) / max(cts[ii][xmin:xmax]))
+def peak_statistics(cts, xmin, xmax, size_window_background_left, size_window_background_right):
+    """
+    Calcul x0, IM, H, A and B of the peak of each image in the window [xmin, xmax], in one pass over the images:
+        x0 : position of the maximum (first occurence)
+        IM : maximum intensity
+        H : FWHM ~= Area/IM (trapeze method)
+        A, B : background line through the mean of the left and right background windows
+    Returns:
+        per_image : array (number of image, 5) of [x0, IM, H, A, B]
+        mean : array (5) of the mean over the images
+    """
+    window = np.atleast_2d(np.asarray(cts, dtype=float))[:, xmin:xmax]
+    step = 1
 
-        # Obtaining A and B
-        background_left = cts[ii][xmin:xmin + size_window_background_left]
-        background_right = cts[ii][xmax - size_window_background_right:xmax]
+    # Obtaining x0, IM and H
+    x0 = xmin + np.argmax(window, axis=1)
+    IM = np.max(window, axis=1)
+    H = trapeze_method(window, step) / IM
 
-        left_point_value = np.mean(background_left)
-        right_point_value = np.mean(background_right)
+    # Obtaining A and B
+    left_point_value = np.mean(window[:, :size_window_background_left], axis=1)
+    right_point_value = np.mean(window[:, window.shape[1] - size_window_background_right:], axis=1)
 
-        left_point_absc = xmin + size_window_background_left / 2
-        right_point_absc = xmax - size_window_background_right / 2
+    left_point_absc = xmin + size_window_background_left / 2
+    right_point_absc = xmax - size_window_background_right / 2
 
-        B_temp = (left_point_value - right_point_value) / (left_point_absc - right_point_absc)
-        A_temp = left_point_value - B_temp * left_point_absc
+    B = (left_point_value - right_point_value) / (left_point_absc - right_point_absc)
+    A = left_point_value - B * left_point_absc
 
-        add_A += A_temp
-        add_B += B_temp
+    per_image = np.stack([x0, IM, H, A, B], axis=-1)
+    return per_image, np.mean(per_image, axis=0)
 
-    x0 = add_x0 / number_of_image
-    IM = add_IM / number_of_image
-    H = add_H / number_of_image
-    A = add_A / number_of_image
-    B = add_B / number_of_image
 
-    return x0, IM, H, A, B
\ No newline at end of file
+def initial_guess(cts, xmin, xmax, size_window_background_left, size_window_background_right):
+    """
+    Calcul x0, IM, H, A and B median using for initial guess for the peak fit
+    """
+    x0, IM, H, A, B = peak_statistics(cts, xmin, xmax, size_window_background_left, size_window_background_right)[1]
+    return x0, IM, H, A, B
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Define the registry of the fitted models : each model provides its function and its analytic jacobian, and the
+models which are linear in their parameters their design matrix (closed-form least squares, without iteration).
+scipy.optimize is only imported by the first nonlinear fit
+"""
+
+
+import numpy as np
+
+from utils import linear_fit
+
+
+# Registered models : {name : Model}
+MODELS = {}
+
+
+class Model:
+    """
+    Model y = function(x, *param) with its jacobian
+        name : name of the model in the registry
+        function : function(x, *param) returning the model values
+        jac : function(x, *param) returning the derivatives of the model with respect to each parameter,
+              array (number of point, number of parameter)
+        parameter_names : names of the parameters, in the order of param
+        design : function(x) returning the design matrix (number of point, number of parameter) of a model
+                 which is linear in its parameters (None : nonlinear model)
+    """
+
+    __slots__ = ('name', 'function', 'jac', 'parameter_names', 'design')
+
+    def __init__(self, name, function, jac, parameter_names, design=None):
+        self.name = name
+        self.function = function
+        self.jac = jac
+        self.parameter_names = tuple(parameter_names)
+        self.design = design
+
+    def __call__(self, x, *param):
+        return self.function(x, *param)
+
+    @property
+    def number_of_parameter(self):
+        return len(self.parameter_names)
+
+
+def register(name, function, jac, parameter_names, design=None):
+    """
+    Add a model to the registry and return it
+    """
+    MODELS[name] = Model(name, function, jac, parameter_names, design)
+    return MODELS[name]
+
+
+def get(name):
+    """
+    Return a registered model
+    """
+    return MODELS[name]
+
+
+def fit(name, x, y, p0, **kwargs):
+    """
+    Fit of a registered model : closed-form least squares for the linear models (the series stacked in x and y
+    are fitted at once, p0 is not used), curve_fit using the analytic jacobian for the others or when
+    other options than bounds are given, or when the bounds are active
+    return optimal parameters and covariance matrix
+    """
+    model = MODELS[name]
+    if model.design is not None and set(kwargs) <= {'bounds'}:
+        popt, pcov = linear_fit.least_squares(model.design(x), y)
+        if 'bounds' not in kwargs:
+            return popt, pcov
+        lower, upper = kwargs['bounds']
+        if np.all((popt >= lower) & (popt <= upper)):
+            return popt, pcov
+
+    from scipy.optimize import curve_fit
+
+    return curve_fit(model.function, x, y, p0=p0, jac=model.jac, **kwargs)
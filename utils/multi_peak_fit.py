@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Define the fit of several Bragg peaks (several hkl) sharing one polynomial background:
+    y = sum of the gaussian peaks (x0, IM, H) + background polynomial of degree D
+Each peak only changes the pixels near its centre (CUTOFF FWHM on each side), so the jacobian is sparse :
+a block of 3 columns per peak over its pixels, plus the D + 1 dense columns of the background.
+The Levenberg-Marquardt steps of all the images are solved at once on the sparse normal equations
+(one block per image), the work grows with the number of peak and not with its square.
+"""
+
+
+import numpy as np
+
+from utils import batch_fit
+
+
+# 4 * ln(2) : gaussian of FWHM H is exp(-FOUR_LN2 * (x - x0)² / H²)
+FOUR_LN2 = 2.77258872224
+# Half width of the pixels used by a peak [FWHM] : exp(-FOUR_LN2 * 9) < 1e-10
+CUTOFF = 3.
+# Degree of the background polynomial
+BACKGROUND_DEGREE = 2
+
+
+def multi_gauss_backg(x, peaks, background):
+    """
+    Several gaussian peaks on a polynomial background
+        peaks : array (number of peak, 3) of (x0, IM, H), background : coefficients [c0, c1, ...] of c0 + c1 x + ...
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.polynomial.polynomial.polyval(x, np.asarray(background, dtype=float))
+    for x0, IM, H in np.asarray(peaks, dtype=float):
+        y = y + IM * np.exp(-FOUR_LN2 * (x - x0) ** 2 / H ** 2)
+    return y
+
+
+def multi_peak_guess(x, cts, positions, fwhm, degree=BACKGROUND_DEGREE):
+    """
+    Initial guess of the peaks at the given positions [pix] and of a flat background
+        cts : array (number of image, number of pixel), fwhm : FWHM of the peaks (one value or one per peak)
+    return peaks (number of image, number of peak, 3) and background (number of image, degree + 1)
+    """
+    x = np.asarray(x, dtype=float)
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+    positions = np.asarray(positions, dtype=float)
+    number_of_image = cts.shape[0]
+
+    # Flat background at the lowest intensities, intensity of each peak above it
+    background = np.zeros((number_of_image, degree + 1))
+    background[:, 0] = np.percentile(cts, 10, axis=1)
+    pixel = np.clip(np.searchsorted(x, positions), 0, len(x) - 1)
+
+    peaks = np.zeros((number_of_image, len(positions), 3))
+    peaks[:, :, 0] = positions
+    peaks[:, :, 1] = np.maximum(cts[:, pixel] - background[:, :1], 1.)
+    peaks[:, :, 2] = np.broadcast_to(np.asarray(fwhm, dtype=float), positions.shape)
+    return peaks, background
+
+
+def fit_multi_gauss_backg(x, cts, peaks, background, max_iteration=batch_fit.MAX_ITERATION):
+    """
+    Fit several gaussian peaks on a polynomial background on every image at once
+        x : array (number of pixel) of increasing abscissa, common to all the images
+        cts : array (number of image, number of pixel) of intensity
+        peaks, background : initial guess (multi_peak_guess), common to all the images or one per image
+    Returns:
+        peaks : array (number of image, number of peak, 3) of optimal (x0, IM, H)
+        background : array (number of image, degree + 1) of optimal coefficients of the background
+        pcov : array (number of image, number of parameter, number of parameter) of covariance matrices,
+               parameters ordered x0, IM, H of each peak then the background coefficients
+        converged : array (number of image) of boolean, False for the images which reached max_iteration or whose
+                    damping blew up (same stopping criteria and damping as batch_fit)
+    """
+    x = np.asarray(x, dtype=float)
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+    number_of_image, number_of_pixel = cts.shape
+    peaks = np.asarray(peaks, dtype=float)
+    background = np.asarray(background, dtype=float)
+    number_of_peak = peaks.shape[-2]
+    degree = background.shape[-1] - 1
+
+    # Background fitted on the centred and scaled abscissa u (better conditioned than the powers of x)
+    center = (x[0] + x[-1]) / 2
+    scale = max((x[-1] - x[0]) / 2, 1.)
+    to_u = _change_of_variable(-center / scale, 1 / scale, degree)
+    vandermonde = np.polynomial.polynomial.polyvander((x - center) / scale, degree)
+
+    p = np.zeros((number_of_image, 3 * number_of_peak + degree + 1))
+    p[:, :3 * number_of_peak] = np.broadcast_to(peaks, (number_of_image, number_of_peak, 3)).reshape(
+        number_of_image, -1)
+    p[:, 3 * number_of_peak:] = np.linalg.solve(to_u, np.broadcast_to(background, (number_of_image, degree + 1)).T).T
+
+    damping = np.full(number_of_image, batch_fit.INITIAL_DAMPING)
+    converged = np.zeros(number_of_image, dtype=bool)
+    finished = np.zeros(number_of_image, dtype=bool)
+    cost = _cost(x, vandermonde, cts, p, number_of_peak)
+
+    for iteration in range(max_iteration):
+        # Only the images not finished yet (converged or failed) are iterated
+        active = np.flatnonzero(~finished)
+        if len(active) == 0:
+            break
+
+        model, jacobian = _evaluate(x, vandermonde, p[active], number_of_peak, jacobian=True)
+        residual = cts[active] - model
+        normal_matrix = (jacobian.T @ jacobian).tocsc()
+        normal_vector = jacobian.T @ residual.ravel()
+
+        # Damped normal equations : (JtJ + damping * diag(JtJ)) step = Jt r, all the images at once
+        # (a parameter without effect, e.g. a peak out of the pixels, keeps a small damping : regular system)
+        diagonal = normal_matrix.diagonal().reshape(len(active), -1)
+        diagonal = np.maximum(diagonal, 1e-12 * np.max(diagonal, axis=1, keepdims=True) + 1e-300)
+        step = _solve(normal_matrix, (damping[active, None] * diagonal).ravel(),
+                      normal_vector).reshape(len(active), -1)
+        regular = np.all(np.isfinite(step), axis=1)
+        step = np.where(regular[:, None], step, 0.)
+
+        trial = p[active] + step
+        trial_cost = _cost(x, vandermonde, cts[active], trial, number_of_peak)
+
+        accepted, damping[active], converged[active], failed = batch_fit.update_damping(
+            cost[active], trial_cost, p[active], step, regular, damping[active])
+        p[active[accepted]] = trial[accepted]
+        cost[active[accepted]] = trial_cost[accepted]
+        finished[active] = converged[active] | failed
+
+    # Covariance in the parameters of u, then of x for the background coefficients
+    pcov = _covariance(x, vandermonde, p, cost, number_of_peak)
+    transform = np.eye(p.shape[1])
+    transform[3 * number_of_peak:, 3 * number_of_peak:] = to_u
+    pcov = transform @ pcov @ transform.T
+
+    peaks = p[:, :3 * number_of_peak].reshape(number_of_image, number_of_peak, 3)
+    background = p[:, 3 * number_of_peak:] @ to_u.T
+    return peaks, background, pcov, converged
+
+
+def _change_of_variable(offset, slope, degree):
+    """
+    Matrix giving the coefficients in x of a polynomial from its coefficients in u = offset + slope * x
+    """
+    matrix = np.zeros((degree + 1, degree + 1))
+    for j in range(degree + 1):
+        column = np.polynomial.polynomial.polypow([offset, slope], j)
+        matrix[:len(column), j] = column
+    return matrix
+
+
+def _supports(x, p, number_of_peak):
+    """
+    Pixels used by each peak of each image : flat arrays (image, peak, pixel) of the non-zero entries
+    """
+    number_of_image = p.shape[0]
+    x0 = p[:, 0:3 * number_of_peak:3]
+    H = np.abs(p[:, 2:3 * number_of_peak:3])
+    low = np.searchsorted(x, (x0 - CUTOFF * H).ravel())
+    high = np.searchsorted(x, (x0 + CUTOFF * H).ravel(), side='right')
+    length = np.maximum(high - low, 0)
+
+    # Ragged ranges [low, high[ of all the peaks in one array
+    start = np.cumsum(length) - length
+    entry = np.arange(np.sum(length)) - np.repeat(start, length)
+    peak = np.repeat(np.arange(number_of_image * number_of_peak), length)
+    pixel = np.repeat(low, length) + entry
+    return peak // number_of_peak, peak % number_of_peak, pixel
+
+
+def _evaluate(x, vandermonde, p, number_of_peak, jacobian=False):
+    """
+    Model of each line of parameters p (number of image, number of parameter), and its sparse jacobian
+    (rows : image * number of pixel + pixel, columns : image * number of parameter + parameter)
+    """
+    number_of_image, number_of_parameter = p.shape
+    number_of_pixel = len(x)
+    image, peak, pixel = _supports(x, p, number_of_peak)
+
+    x0 = p[image, 3 * peak]
+    IM = p[image, 3 * peak + 1]
+    H = p[image, 3 * peak + 2]
+    distance = x[pixel] - x0
+    exponential = np.exp(-FOUR_LN2 * distance ** 2 / H ** 2)
+
+    row = image * number_of_pixel + pixel
+    model = p[:, 3 * number_of_peak:] @ vandermonde.T
+    model += np.bincount(row, weights=IM * exponential,
+                         minlength=number_of_image * number_of_pixel).reshape(number_of_image, number_of_pixel)
+    if not jacobian:
+        return model
+
+    from scipy import sparse
+
+    # Peak columns : 3 entries per pixel of each peak
+    column = image * number_of_parameter + 3 * peak
+    d_x0 = IM * exponential * 2 * FOUR_LN2 * distance / H ** 2
+    d_H = IM * exponential * 2 * FOUR_LN2 * distance ** 2 / H ** 3
+
+    # Background columns : dense over the pixels of each image
+    background_image, background_pixel, background_degree = np.indices(
+        (number_of_image, number_of_pixel, vandermonde.shape[1])).reshape(3, -1)
+
+    rows = np.concatenate([row, row, row, background_image * number_of_pixel + background_pixel])
+    columns = np.concatenate([column, column + 1, column + 2,
+                              background_image * number_of_parameter + 3 * number_of_peak + background_degree])
+    values = np.concatenate([d_x0, exponential, d_H, vandermonde[background_pixel, background_degree]])
+    shape = (number_of_image * number_of_pixel, number_of_image * number_of_parameter)
+    return model, sparse.csr_matrix((values, (rows, columns)), shape=shape)
+
+
+def _cost(x, vandermonde, cts, p, number_of_peak):
+    """
+    Sum of the squared residuals of each image
+    """
+    residual = cts - _evaluate(x, vandermonde, p, number_of_peak)
+    return np.einsum('nm,nm->n', residual, residual)
+
+
+def _solve(matrix, damping, vector):
+    """
+    Solve the sparse damped normal equations (not finite for the images with a singular system)
+    """
+    import warnings
+    from scipy import sparse
+    from scipy.sparse import linalg
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return linalg.spsolve(matrix + sparse.diags(damping, format='csc'), vector)
+
+
+def _covariance(x, vandermonde, p, cost, number_of_peak):
+    """
+    Covariance of the optimal parameters : pinv(JtJ) * residual variance, inf if there are not enough points
+    """
+    number_of_image, number_of_parameter = p.shape
+    degrees_of_freedom = len(x) - number_of_parameter
+    if degrees_of_freedom <= 0:
+        return np.full((number_of_image, number_of_parameter, number_of_parameter), np.inf)
+
+    jacobian = _evaluate(x, vandermonde, p, number_of_peak, jacobian=True)[1]
+    normal_matrix = (jacobian.T @ jacobian).tocsr()
+    blocks = np.array([normal_matrix[ii * number_of_parameter:(ii + 1) * number_of_parameter,
+                                     ii * number_of_parameter:(ii + 1) * number_of_parameter].toarray()
+                       for ii in range(number_of_image)])
+    return np.linalg.pinv(blocks) * (cost / degrees_of_freedom)[:, None, None]
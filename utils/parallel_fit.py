@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Define the parallel fit of the peaks of a scan : the counts are placed once in shared memory
+and the images are shared between the processes of a pool
+"""
+
+
+import numpy as np
+
+from utils import batch_fit
+
+
+def fit_gauss_backg(x, cts, guess, number_of_worker=1):
+    """
+    Fit the gauss_backg function on every image, the images are split between number_of_worker processes
+    (same arguments and results as batch_fit.fit_gauss_backg, the results are in the order of the images)
+    """
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+    number_of_image = cts.shape[0]
+    guess = np.array(np.broadcast_to(np.asarray(guess, dtype=float),
+                                     (number_of_image, batch_fit.NUMBER_OF_PARAMETER)))
+
+    number_of_worker = min(number_of_worker, number_of_image)
+    if number_of_worker <= 1:
+        return batch_fit.fit_gauss_backg(x, cts, guess)
+
+    # Process pool and shared memory only imported for a parallel fit
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    # Counts placed once in shared memory, each process reads its own images
+    memory = shared_memory.SharedMemory(create=True, size=cts.nbytes)
+    try:
+        shared_cts = np.ndarray(cts.shape, dtype=float, buffer=memory.buf)
+        shared_cts[...] = cts
+
+        bounds = np.linspace(0, number_of_image, number_of_worker + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=number_of_worker) as pool:
+            futures = [pool.submit(_fit_images, memory.name, cts.shape, start, stop, x, guess[start:stop])
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+            results = [future.result() for future in futures]
+        del shared_cts
+
+    finally:
+        memory.close()
+        memory.unlink()
+
+    popt = np.concatenate([result[0] for result in results])
+    pcov = np.concatenate([result[1] for result in results])
+    converged = np.concatenate([result[2] for result in results])
+    return popt, pcov, converged
+
+
+def _fit_images(name, shape, start, stop, x, guess):
+    """
+    Fit the images [start, stop[ of the counts held in the shared memory block name
+    """
+    from multiprocessing import shared_memory
+
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        cts = np.ndarray(shape, dtype=float, buffer=memory.buf)
+        result = batch_fit.fit_gauss_backg(x, cts[start:stop], guess)
+        del cts
+    finally:
+        memory.close()
+    return result
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Define the automatic search of the Bragg peaks of all the images of a scan at once:
+    the images are filtered by the opposite of the second derivative of gaussians of several widths (smoothing
+    and second derivative in one convolution, a linear background gives 0), a peak is a local maximum of the
+    filtered images which is THRESHOLD times above its Poisson standard deviation at its best scale.
+    The zero crossings of the filtered image on each side of a peak give its width, from which the window of
+    the peak fit and the size of the background windows are proposed.
+"""
+
+
+import numpy as np
+
+
+# Standard deviations of the gaussian smoothing [pix] : each peak is found at the scale closest to its width
+WIDTHS = (1.5, 3., 6., 12., 24.)
+# Minimum significance of a peak [standard deviation]
+THRESHOLD = 5.
+# Half width of the peak in the window, and size of each background window [FWHM]
+PEAK_WIDTH = 2.
+BACKGROUND_WIDTH = 1.
+# Minimum size of a background window [pix]
+MIN_BACKGROUND = 5
+# Minimum FWHM of a peak [pix] : narrower peaks are spikes of single pixels
+MIN_FWHM = 2.
+
+# FWHM of a gaussian of standard deviation 1
+SIGMA_TO_FWHM = 2.35482004503
+
+
+def sliding_windows(values, size):
+    """
+    Read-only view (..., number of window, size) of the windows of size consecutive values of the last axis
+    (numpy.lib.stride_tricks.sliding_window_view, which needs numpy 1.20)
+    """
+    values = np.asarray(values)
+    shape = values.shape[:-1] + (values.shape[-1] - size + 1, size)
+    strides = values.strides + values.strides[-1:]
+    return np.lib.stride_tricks.as_strided(values, shape, strides, writeable=False)
+
+
+def filter_images(cts, width):
+    """
+    Opposite of the smoothed second derivative of every image, its standard deviation (Poisson statistics)
+    and the smoothed images
+        cts : array (number of image, number of pixel), width : standard deviation of the smoothing [pix]
+    return three arrays (number of image, number of pixel)
+    """
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+
+    # Kernel : - second derivative of a gaussian, with a null sum (a constant or a line is filtered out)
+    half = int(np.ceil(4 * width))
+    t = np.arange(-half, half + 1, 1)
+    gaussian = np.exp(-t ** 2 / (2 * width ** 2))
+    kernel = (1 - t ** 2 / width ** 2) * gaussian
+    kernel -= np.mean(kernel)
+
+    # Convolution of all the images at once (the edge pixels are repeated beyond the detector)
+    padded = np.pad(cts, ((0, 0), (half, half)), mode='edge')
+    windows = sliding_windows(padded, len(kernel))
+    filtered = windows @ kernel
+    deviation = np.sqrt(np.maximum(windows, 1.) @ kernel ** 2)
+    smoothed = windows @ (gaussian / np.sum(gaussian))
+    return filtered, deviation, smoothed
+
+
+def find_peaks(cts, widths=WIDTHS, threshold=THRESHOLD):
+    """
+    Peaks of every image : flat arrays of the image, position [pix], FWHM [pix], intensity and significance
+    of each peak found (pixels beginning at 0)
+    """
+    filtered, deviation, smoothed = (np.array(array) for array in zip(*[filter_images(cts, width)
+                                                                          for width in widths]))
+    number_of_scale, number_of_image, number_of_pixel = filtered.shape
+
+    # Significance of each pixel at its best scale
+    significance = filtered / deviation
+    scale = np.argmax(significance, axis=0)
+    best = np.max(significance, axis=0)
+
+    # Local maxima of the significance above the threshold (not on the first and last pixels)
+    center = best[:, 1:-1]
+    maximum = (center > best[:, :-2]) & (center >= best[:, 2:]) & (center > threshold)
+    image, pixel = np.nonzero(maximum)
+    pixel += 1
+    scale = scale[image, pixel]
+    width = np.asarray(widths, dtype=float)[scale]
+
+    # Sub-pixel position : vertex of the parabola through the 3 pixels around the maximum
+    left, top, right = (filtered[scale, image, pixel + shift] for shift in (-1, 0, 1))
+    curvature = left - 2 * top + right
+    position = pixel + np.where(curvature < 0, 0.5 * (left - right) / np.where(curvature < 0, curvature, -1), 0.)
+
+    # Zero crossings around each pixel : last non positive pixel on the left and first one on the right
+    index = np.broadcast_to(np.arange(number_of_pixel), filtered.shape)
+    positive = filtered > 0
+    start = np.maximum.accumulate(np.where(positive, -1, index), axis=2)[scale, image, pixel]
+    stop = np.minimum.accumulate(np.where(positive, number_of_pixel, index)[..., ::-1], axis=2)[..., ::-1]
+    stop = stop[scale, image, pixel]
+
+    # Interpolated zero crossings, at +- the standard deviation of the smoothed peak
+    low = np.clip(start, 0, number_of_pixel - 2)
+    high = np.clip(stop, 1, number_of_pixel - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing_low = low - filtered[scale, image, low] / (filtered[scale, image, low + 1]
+                                                             - filtered[scale, image, low])
+        crossing_high = high - 1 + filtered[scale, image, high - 1] / (filtered[scale, image, high - 1]
+                                                                       - filtered[scale, image, high])
+    crossing_low = np.where(start >= 0, crossing_low, 0.)
+    crossing_high = np.where(stop < number_of_pixel, crossing_high, number_of_pixel - 1.)
+
+    # A peak is above the smoothed intensity of both its sides (not a step, e.g. the dead pixels of the detector)
+    top_smoothed = smoothed[scale, image, pixel]
+    peak = (top_smoothed > smoothed[scale, image, low]) & (top_smoothed > smoothed[scale, image, high])
+
+    # FWHM of the peak without the smoothing
+    sigma = (crossing_high - crossing_low) / 2
+    fwhm = SIGMA_TO_FWHM * np.sqrt(np.maximum(sigma ** 2 - width ** 2, 0.25))
+    peak &= fwhm >= MIN_FWHM
+
+    # Intensity above the background : the top of a filtered gaussian is sqrt(2 pi) IM sigma_peak width^3 / sigma^3
+    sigma_peak = fwhm / SIGMA_TO_FWHM
+    intensity = top * sigma ** 3 / (np.sqrt(2 * np.pi) * sigma_peak * width ** 3)
+
+    return (image[peak], position[peak], fwhm[peak], intensity[peak],
+            best[image, pixel][peak])
+
+
+def main_peaks(cts, widths=WIDTHS, threshold=THRESHOLD):
+    """
+    Most intense peak of every image
+    return arrays (number of image) of position and FWHM [pix] (nan for the images without a peak)
+    """
+    number_of_image = np.atleast_2d(cts).shape[0]
+    image, position, fwhm, intensity, significance = find_peaks(cts, widths, threshold)
+
+    # For each image, the last peak of the images sorted by intensity
+    order = np.lexsort((intensity, image))
+    best = order[np.flatnonzero(np.diff(np.append(image[order], number_of_image)))]
+
+    main_position = np.full(number_of_image, np.nan)
+    main_fwhm = np.full(number_of_image, np.nan)
+    main_position[image[best]] = position[best]
+    main_fwhm[image[best]] = fwhm[best]
+    return main_position, main_fwhm
+
+
+def scan_peaks(cts, widths=WIDTHS, threshold=THRESHOLD):
+    """
+    Peak followed along the scan : the peak whose neighbours (peaks of all the images closer than its FWHM)
+    have the largest total intensity, then in each image the peak closest to it
+    return arrays (number of image) of position and FWHM [pix] (nan for the images without this peak)
+    """
+    number_of_image = np.atleast_2d(cts).shape[0]
+    image, position, fwhm, intensity, significance = find_peaks(cts, widths, threshold)
+
+    scan_position = np.full(number_of_image, np.nan)
+    scan_fwhm = np.full(number_of_image, np.nan)
+    if len(image) == 0:
+        return scan_position, scan_fwhm
+
+    # Vote of the peaks of all the images for each peak
+    distance = np.abs(position[:, np.newaxis] - position[np.newaxis, :])
+    neighbour = distance < fwhm[:, np.newaxis]
+    reference = np.argmax(neighbour @ intensity)
+
+    # Closest peak of each image, if closer than the FWHM of the reference peak
+    close = neighbour[reference]
+    order = np.lexsort((-distance[reference][close], image[close]))
+    last = np.flatnonzero(np.diff(np.append(image[close][order], number_of_image)))
+    best = np.flatnonzero(close)[order[last]]
+
+    scan_position[image[best]] = position[best]
+    scan_fwhm[image[best]] = fwhm[best]
+    return scan_position, scan_fwhm
+
+
+def peak_windows(cts, position, fwhm):
+    """
+    Window of a peak of every image and size of its background windows (PEAK_WIDTH and BACKGROUND_WIDTH)
+        position, fwhm : arrays (number of image) of the peak (main_peaks or scan_peaks)
+    return an array (number of image, 4) of
+    [xmin, xmax, size_window_background_left, size_window_background_right]
+    (pixels beginning at 0, -1 for the images without a peak)
+    """
+    number_of_pixel = np.shape(cts)[-1]
+    found = np.isfinite(position)
+
+    background = np.maximum(np.ceil(BACKGROUND_WIDTH * fwhm[found]), MIN_BACKGROUND)
+    xmin = np.clip(np.floor(position[found] - PEAK_WIDTH * fwhm[found] - background), 0, number_of_pixel)
+    xmax = np.clip(np.ceil(position[found] + PEAK_WIDTH * fwhm[found] + background) + 1, 0, number_of_pixel)
+
+    windows = np.full((len(position), 4), -1, dtype=int)
+    windows[found] = np.stack([xmin, xmax, background, background], axis=-1)
+    return windows
+
+
+def scan_window(cts, xmin=None, xmax=None, size_window_background_left=None, size_window_background_right=None):
+    """
+    Window common to all the images of the scan : the given values are kept, the None are replaced by the window
+    covering the peak followed along the scan (scan_peaks) in every image, with its median FWHM (the width of
+    the weak images is less accurate)
+    return xmin, xmax, size_window_background_left, size_window_background_right (None if no peak is found)
+    """
+    position, fwhm = scan_peaks(cts)
+    found = np.isfinite(position)
+    if not np.any(found):
+        print('Recherche des pics : aucun pic trouvé')
+        return None
+
+    windows = peak_windows(cts, position[found], np.full(np.sum(found), np.median(fwhm[found])))
+    background = int(windows[0, 2])
+    if xmin is None:
+        xmin = int(np.min(windows[:, 0]))
+    if xmax is None:
+        xmax = int(np.max(windows[:, 1]))
+
+    # The background windows fill at most a third of the window each
+    background = max(min(background, (xmax - xmin) // 3), 1)
+    if size_window_background_left is None:
+        size_window_background_left = background
+    if size_window_background_right is None:
+        size_window_background_right = background
+    return xmin, xmax, size_window_background_left, size_window_background_right
+
+
+def edge_background(cts):
+    """
+    Size of the background windows at the edges of the images (images with one peak fitted on all the pixels) :
+    median over the images of the background size, reduced to stay out of the window of the peak
+    """
+    number_of_pixel = np.shape(cts)[-1]
+    windows = peak_windows(cts, *main_peaks(cts))
+    windows = windows[windows[:, 0] >= 0]
+    if len(windows) == 0:
+        return MIN_BACKGROUND
+
+    free = np.minimum(windows[:, 0], number_of_pixel - windows[:, 1])
+    return int(max(np.median(np.minimum(windows[:, 2], free)), 1))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Define an incremental pipeline for the analyses, working like a small build system:
+    an analysis is a sequence of stages, each stage declares its inputs (parameters of the dictionnary,
+    signature of the scan file) and the upstream stages it uses. The key of a stage is a hash of its inputs
+    and of the keys of its upstream stages, and its result is stored in a file named after this key.
+    On a rerun, a stage whose key did not change is loaded instead of computed : changing the window of
+    the peaks only recomputes the guess, the peak fit and the model fit.
+"""
+
+
+import hashlib
+import os
+import pickle
+
+
+# Extension of the stored results
+STAGE_EXTENSION = '.STAGE'
+# Changed when the stages of the analyses change, the previous results are then ignored
+VERSION = b'pipeline 4'
+
+
+class Pipeline:
+    """
+    Stages of one analysis, the results are stored in directory (None : computed without being stored)
+        keys : key of each stage already run
+        results : result of each stage already run
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.keys = dict()
+        self.results = dict()
+        self.reused = []
+        self.computed = []
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, name, function, upstream=(), inputs=(), files=()):
+        """
+        Hash of the inputs of a stage, of the signature of the files it reads and of the keys of its upstream stages
+        """
+        sha1 = hashlib.sha1(VERSION)
+        sha1.update(name.encode())
+        sha1.update(f'{function.__module__}.{function.__qualname__}'.encode())
+        sha1.update(pickle.dumps(tuple(inputs), protocol=4))
+        sha1.update(repr([file_signature(file) for file in files]).encode())
+        for stage in upstream:
+            sha1.update(self.keys[stage].encode())
+        return sha1.hexdigest()
+
+    def run(self, name, function, upstream=(), inputs=(), files=(), options=None, stored=True):
+        """
+        Run a stage : function(*results of the upstream stages, *inputs, **options)
+            files : files read by the stage, their size and modification time are part of the key
+            options : arguments which do not change the result (number of worker, fit cache), not in the key
+            stored : False for a stage always computed (e.g. the reading of a scan, already cached elsewhere),
+                     its key is still used by the next stages
+        the result is loaded if the stage was already computed with the same inputs
+        """
+        key = self.key(name, function, upstream, inputs, files)
+        self.keys[name] = key
+
+        result = self.load(key) if stored else None
+        if result is not None:
+            self.reused.append(name)
+            self.results[name] = result[0]
+            return result[0]
+
+        options = dict() if options is None else options
+        value = function(*[self.results[stage] for stage in upstream], *inputs, **options)
+        self.computed.append(name)
+        self.results[name] = value
+        if stored:
+            self.save(key, value)
+        return value
+
+    def name(self, key):
+        return os.path.join(self.directory, key + STAGE_EXTENSION)
+
+    def load(self, key):
+        """
+        Return (result,) of a stored stage, None if the stage is not stored
+        """
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self.name(key), 'rb') as file:
+                return (pickle.load(file),)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def save(self, key, value):
+        """
+        Store the result of a stage
+        """
+        if self.directory is None:
+            return
+
+        temporary = self.name(key) + '.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                pickle.dump(value, file, protocol=4)
+            os.replace(temporary, self.name(key))
+        except OSError:
+            pass
+
+    def report(self):
+        if self.directory is not None:
+            print(f'Pipeline : reused {self.reused}, computed {self.computed}')
+
+
+def file_signature(name):
+    """
+    Size and modification time of a file (None if the file does not exist), input of the stage reading it
+    """
+    try:
+        stat = os.stat(name)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Define the figures of the analyses:
+    each figure is first described by a Plot (title, labels and curves), then shown (interactive mode)
+    or rendered to a .png file by a pool of background processes (headless mode).
+    matplotlib is only imported when a figure is drawn : pyplot for the interactive display,
+    the Agg canvas for the headless rendering.
+"""
+
+
+import numpy as np
+
+
+# Number of processes rendering the figures in headless mode
+RENDER_WORKER = 2
+# Resolution of the rendered figures
+DPI = 100
+PLOT_EXTENSION = '.png'
+
+
+class Plot:
+    """
+    Data of one figure
+        name : name of the figure (file name of the rendered figure)
+        title, xlabel, ylabel : texts of the figure
+        figsize : size of the figure [inch]
+        xlim : limits of the x axis (None : automatic)
+        legend : True for displaying the legend
+        curves : list of (x, y, format, keyword arguments of plot)
+    """
+
+    __slots__ = ('name', 'title', 'xlabel', 'ylabel', 'figsize', 'xlim', 'legend', 'curves')
+
+    def __init__(self, name, title='', xlabel='', ylabel='', figsize=(12, 12), xlim=None, legend=True):
+        self.name = name
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.figsize = figsize
+        self.xlim = xlim
+        self.legend = legend
+        self.curves = []
+
+    def plot(self, x, y, fmt='-', **kwargs):
+        """
+        Add a curve, same arguments as matplotlib plot
+        """
+        self.curves.append((np.asarray(x), np.asarray(y), fmt, kwargs))
+
+
+class Plotter:
+    """
+    Destination of the figures of an analysis
+        interactive mode (headless False) : each figure is shown as soon as it is added
+        headless mode : the figures are kept, and rendered in the background if a directory is given
+        (file name : prefix + name of the figure)
+    """
+
+    def __init__(self, headless=False, directory=None, number_of_worker=RENDER_WORKER, prefix=''):
+        self.headless = headless
+        self.directory = directory
+        self.prefix = prefix
+        self.number_of_worker = number_of_worker
+        self.plots = []
+        self._pool = None
+        self._futures = []
+
+    def add(self, plot):
+        """
+        Add a figure : shown in interactive mode, rendered in the background in headless mode
+        """
+        self.plots.append(plot)
+
+        if not self.headless:
+            show(plot)
+
+        elif self.directory is not None:
+            if self._pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.number_of_worker)
+            name = self.directory + '\\' + self.prefix + plot.name + PLOT_EXTENSION
+            self._futures.append(self._pool.submit(render, plot, name))
+
+    def close(self):
+        """
+        Wait for the rendering of the figures, return the list of Plot of the analysis
+        """
+        if self._pool is not None:
+            for future in self._futures:
+                future.result()
+            self._pool.shutdown()
+            self._pool = None
+            self._futures = []
+        return self.plots
+
+
+def draw(plot, ax):
+    """
+    Draw a Plot on matplotlib axes
+    """
+    ax.set_title(plot.title)
+    ax.set_xlabel(plot.xlabel)
+    ax.set_ylabel(plot.ylabel)
+    if plot.xlim is not None:
+        ax.set_xlim(plot.xlim)
+    for x, y, fmt, kwargs in plot.curves:
+        ax.plot(x, y, fmt, **kwargs)
+    if plot.legend:
+        ax.legend()
+
+
+def show(plot):
+    """
+    Display a Plot in an interactive window (blocking)
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=plot.figsize)
+    draw(plot, ax)
+    plt.show()
+
+
+def render(plot, name):
+    """
+    Render a Plot in a file without any interactive backend
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=plot.figsize)
+    FigureCanvasAgg(fig)
+    draw(plot, fig.add_subplot(1, 1, 1))
+    fig.savefig(name, dpi=DPI)
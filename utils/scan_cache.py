@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Define a binary sidecar cache for parsed scan files:
+    the first read of a scan writes next to it a .SCAN file (header, angles, raw counts block),
+    the next reads memory-map this file instead of parsing the text again.
+"""
+
+
+import hashlib
+import os
+
+import numpy as np
+
+from utils import scan_data
+
+
+# Extension added to the name of the source file
+SIDECAR_EXTENSION = '.SCAN'
+MAGIC = b'XRDSMSCN'
+VERSION = 1
+
+# Header of the sidecar file : the counts block begins at a multiple of 8 bytes
+HEADER = np.dtype([('magic', 'S8'),
+                   ('version', '<u4'),
+                   ('number_of_image', '<u4'),
+                   ('number_of_pixel', '<u4'),
+                   ('reserved', '<u4'),
+                   ('source_size', '<u8'),
+                   ('source_mtime', '<u8'),
+                   ('source_hash', 'S20'),
+                   ('padding', 'V4')])
+
+# Scans already opened in this session : {source name : (size, mtime, scan)}
+_opened = {}
+
+
+def sidecar_name(name):
+    """
+    Name of the sidecar file of a source file
+    """
+    return name + SIDECAR_EXTENSION
+
+
+def file_hash(name):
+    """
+    SHA1 digest of a file
+    """
+    sha1 = hashlib.sha1()
+    with open(name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.digest()
+
+
+def load(name):
+    """
+    Return the cached scan of the source file, or None if the cache is missing or out of date
+    """
+    try:
+        stat = os.stat(name)
+    except OSError:
+        return None
+
+    # Already opened in this session : share the same arrays
+    opened = _opened.get(name)
+    if opened is not None and opened[0] == stat.st_size and opened[1] == stat.st_mtime_ns:
+        return opened[2]
+
+    try:
+        header = np.fromfile(sidecar_name(name), dtype=HEADER, count=1)
+    except OSError:
+        return None
+
+    if len(header) == 0 or header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+        return None
+    if header['source_size'][0] != stat.st_size:
+        return None
+
+    # Same size but new modification time : the content decides
+    if header['source_mtime'][0] != stat.st_mtime_ns:
+        if header['source_hash'][0] != file_hash(name):
+            return None
+        header['source_mtime'] = stat.st_mtime_ns
+        try:
+            with open(sidecar_name(name), 'r+b') as file:
+                file.write(header.tobytes())
+        except OSError:
+            pass
+
+    scan = _map(sidecar_name(name), int(header['number_of_image'][0]), int(header['number_of_pixel'][0]))
+    _opened[name] = (stat.st_size, stat.st_mtime_ns, scan)
+    return scan
+
+
+def save(name, scan):
+    """
+    Write the sidecar file of the source file and return the memory-mapped scan (None if it can not be written,
+    no temporary file is left)
+    """
+    try:
+        stat = os.stat(name)
+        source_hash = file_hash(name)
+    except OSError:
+        return None
+
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['number_of_image'] = scan.number_of_image
+    header['number_of_pixel'] = scan.number_of_pixel
+    header['source_size'] = stat.st_size
+    header['source_mtime'] = stat.st_mtime_ns
+    header['source_hash'] = source_hash
+
+    # The previous sidecar is no longer shared. Its arrays stay mapped while they are used : on the systems
+    # where a mapped file can not be replaced (Windows), the sidecar is then written again in a next session
+    _opened.pop(name, None)
+
+    temporary = sidecar_name(name) + '.tmp'
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(header.tobytes())
+            for array in (scan.tth, scan.omega, scan.chi, scan.phi, scan.acq_time, scan.angle, scan.cts):
+                file.write(np.ascontiguousarray(array, dtype='<f8').tobytes())
+        os.replace(temporary, sidecar_name(name))
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return None
+
+    scan = _map(sidecar_name(name), scan.number_of_image, scan.number_of_pixel)
+    _opened[name] = (stat.st_size, stat.st_mtime_ns, scan)
+    return scan
+
+
+def _map(name, number_of_image, number_of_pixel):
+    """
+    Memory-map the angles and the counts block of a sidecar file
+    """
+    block = np.memmap(name, dtype='<f8', mode='r', offset=HEADER.itemsize,
+                      shape=(5 * number_of_image + number_of_pixel + number_of_image * number_of_pixel,))
+    angles = block[:5 * number_of_image].reshape(5, number_of_image)
+    angle = block[5 * number_of_image:5 * number_of_image + number_of_pixel]
+    cts = block[5 * number_of_image + number_of_pixel:].reshape(number_of_image, number_of_pixel)
+    return scan_data.Scan(angles[0], angles[1], angles[2], angles[3], cts, angles[4], angle)
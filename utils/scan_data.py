@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Define the scan container shared by all the readers
+"""
+
+
+import numpy as np
+
+
+class Scan:
+    """
+    Scan made of several acquisitions of the 1D detector
+        tth : array of 2theta angle, one value per acquisition
+        omega : array of omega angle, one value per acquisition
+        chi : array of chi angle, one value per acquisition
+        phi : array of phi angle, one value per acquisition
+        acq_time : array of acquisition time, one value per acquisition
+        angle : array of the detector angle of each pixel
+        cts : array (number of image, number of pixel) of intensity (float, or raw integer counts)
+    """
+
+    __slots__ = ('tth', 'omega', 'chi', 'phi', 'acq_time', 'angle', 'cts')
+
+    def __init__(self, tth, omega, chi, phi, cts, acq_time=None, angle=None):
+        self.tth = np.asarray(tth, dtype=float)
+        self.omega = np.asarray(omega, dtype=float)
+        self.chi = np.asarray(chi, dtype=float)
+        self.phi = np.asarray(phi, dtype=float)
+        self.cts = np.asarray(cts)
+        if self.cts.dtype.kind not in 'iuf':
+            self.cts = self.cts.astype(float)
+
+        if acq_time is None:
+            acq_time = np.zeros(len(self.tth))
+        self.acq_time = np.asarray(acq_time, dtype=float)
+
+        if angle is None:
+            angle = np.arange(0, self.cts.shape[1], 1)
+        self.angle = np.asarray(angle, dtype=float)
+
+    def __len__(self):
+        return len(self.tth)
+
+    def __getitem__(self, index):
+        """
+        Return a new scan with the selected acquisitions (slice, index array or boolean mask)
+        """
+        return Scan(self.tth[index], self.omega[index], self.chi[index], self.phi[index], self.cts[index],
+                    self.acq_time[index], self.angle)
+
+    @property
+    def number_of_image(self):
+        return self.cts.shape[0]
+
+    @property
+    def number_of_pixel(self):
+        return self.cts.shape[1]
+
+    def image_mask(self, image_to_remove):
+        """
+        Boolean mask of the acquisitions to keep (image numbers in image_to_remove begin at 1)
+        """
+        number = np.arange(1, len(self) + 1, 1)
+        return ~np.isin(number, np.asarray(image_to_remove, dtype=int))
+
+    def remove_images(self, image_to_remove, keep=None):
+        """
+        Return a new scan without the acquisitions listed in image_to_remove (numbers beginning at 1)
+        nor the ones rejected by the boolean mask keep (None : no mask), the data are not copied when
+        the acquisitions kept follow each other
+        """
+        if len(image_to_remove) == 0 and keep is None:
+            return self
+
+        mask = self.image_mask(image_to_remove)
+        if keep is not None:
+            mask &= keep
+        index = np.flatnonzero(mask)
+        if len(index) == len(self):
+            return self
+        if len(index) > 0 and index[-1] - index[0] + 1 == len(index):
+            return self[index[0]:index[-1] + 1]
+        return self[mask]
+
+
+class Acquisition:
+    """
+    One acquisition of the 1D detector, as yielded by the streaming readers
+        number : number of the acquisition in the scan (beginning at 1)
+        tth, omega, chi, phi : angles of the acquisition
+        acq_time : acquisition time
+        cts : array of intensity of each pixel
+    """
+
+    __slots__ = ('number', 'tth', 'omega', 'chi', 'phi', 'acq_time', 'cts')
+
+    def __init__(self, number, tth, omega, chi, phi, acq_time, cts):
+        self.number = number
+        self.tth = tth
+        self.omega = omega
+        self.chi = chi
+        self.phi = phi
+        self.acq_time = acq_time
+        self.cts = cts
+
+
+def remove_acquisitions(acquisitions, image_to_remove):
+    """
+    Yield the acquisitions which are not listed in image_to_remove (numbers beginning at 1)
+    """
+    image_to_remove = set(image_to_remove)
+    for acquisition in acquisitions:
+        if acquisition.number not in image_to_remove:
+            yield acquisition
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Define functions for read a scan whatever the format of the file (.TTX or .FDT)
+"""
+
+
+from utils import inel_data_FDT
+from utils import scan_data
+from utils import seifert_data_TTX
+
+
+def read_scan(directory, filename, extension='.TTX'):
+    """
+    Read a scan file, the reader is chosen with the extension : .FDT (Inel binary file) or .TTX (Seifert text file)
+    Returns a Scan (None if the file can not be read), its pixels are the channels of the detector for a .FDT and
+    the pixels of the export for a .TTX (see inel_data_FDT)
+    """
+    if extension.upper().endswith('FDT'):
+        scan = inel_data_FDT.read_inel_data_FDT(directory, filename, extension)
+    else:
+        scan = seifert_data_TTX.read_seifert_data_TTX(directory, filename, extension)
+
+    if scan is None:
+        print(f'Lecture fichier {filename}{extension} impossible')
+    return scan
+
+
+def iter_scan(directory, filename, extension='.TTX'):
+    """
+    Yield the acquisitions of a scan file one at a time (chunked reading of .TTX, mapped blocks of .FDT)
+    """
+    if extension.upper().endswith('FDT'):
+        scan = inel_data_FDT.read_inel_data_FDT(directory, filename, extension)
+        if scan is None:
+            print(f'Lecture fichier {filename}{extension} impossible')
+            return
+        for ii in range(scan.number_of_image):
+            yield scan_data.Acquisition(ii + 1, scan.tth[ii], scan.omega[ii], scan.chi[ii], scan.phi[ii],
+                                        scan.acq_time[ii], scan.cts[ii])
+        return
+
+    for acquisition in seifert_data_TTX.iter_seifert_data_TTX(directory, filename, extension):
+        yield acquisition
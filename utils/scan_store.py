@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Define an append-only store of the scans of a campaign in a single binary file:
+    each scan added writes at the end of the file its data block (detector angle of each pixel, then the counts
+    of all its images) followed by its index segment (source file, then one row per image : number, tth, omega,
+    chi, phi, acquisition time). Each segment points to the previous one and the header of the file to the last
+    one, which is only updated once the scan is written : an interrupted addition is ignored.
+The queries only read the index segments (kept in memory, only the new segments are read when the file grows),
+the counts of the selected images are memory-mapped. A source file changed since its addition is added again,
+its previous version is hidden.
+"""
+
+
+import os
+
+import numpy as np
+
+from utils import file_loader
+from utils import scan_cache
+from utils import scan_data
+
+
+# Identification of the store files and of their index segments
+MAGIC = b'XRDSMSTO'
+SEGMENT_MAGIC = b'XRDSMIDX'
+VERSION = 1
+
+# Extensions of the scan files added from a directory, by order of preference when a scan exists in both formats
+SCAN_EXTENSIONS = ('.TTX', '.FDT')
+
+# Header of the store : offset of the last index segment and end of the written data (multiples of 8 bytes)
+HEADER = np.dtype([('magic', 'S8'),
+                   ('version', '<u4'),
+                   ('reserved', '<u4'),
+                   ('last_segment', '<u8'),
+                   ('end', '<u8')])
+
+# Header of an index segment, followed by its rows
+SEGMENT = np.dtype([('magic', 'S8'),
+                    ('number_of_image', '<u4'),
+                    ('number_of_pixel', '<u4'),
+                    ('previous', '<u8'),
+                    ('data', '<u8'),
+                    ('source_size', '<u8'),
+                    ('source_mtime', '<u8'),
+                    ('source_hash', 'S20'),
+                    ('padding', 'V4'),
+                    ('source', 'S488')])
+ROW = np.dtype([('image', '<u4'),
+                ('reserved', '<u4'),
+                ('tth', '<f8'),
+                ('omega', '<f8'),
+                ('chi', '<f8'),
+                ('phi', '<f8'),
+                ('acq_time', '<f8')])
+
+# Index in memory : one row per image, file is the number of its source in the list of the sources
+INDEX = np.dtype([('file', '<u4'),
+                  ('image', '<u4'),
+                  ('tth', '<f8'),
+                  ('omega', '<f8'),
+                  ('chi', '<f8'),
+                  ('phi', '<f8'),
+                  ('acq_time', '<f8'),
+                  ('number_of_pixel', '<u4'),
+                  ('angle_offset', '<u8'),
+                  ('counts_offset', '<u8')])
+
+# Index segments already read in this session : {store : (last segment, segments)}
+_segments = {}
+
+
+def add_scan(store, name, scan):
+    """
+    Append a scan read from the source file name (directory + '\\' + filename + extension)
+    return True if the scan is added, False if the same source is already stored or if the store can not be written
+    """
+    try:
+        stat = os.stat(name)
+        source_hash = scan_cache.file_hash(name)
+    except OSError:
+        return False
+
+    if len(name.encode('utf-8')) > SEGMENT['source'].itemsize:
+        print('Ecriture scan store : Nom de fichier trop long')
+        return False
+    if _stored(store, name, stat, source_hash):
+        return False
+
+    try:
+        file = open(store, 'r+b') if os.path.exists(store) else open(store, 'w+b')
+    except OSError:
+        print('Ecriture scan store : Dossier introuvable')
+        return False
+
+    with file:
+        # A store without a complete header (new, or its creation was interrupted) is started again
+        header = file.read(HEADER.itemsize)
+        header = np.frombuffer(header, dtype=HEADER).copy() if len(header) == HEADER.itemsize else []
+        if len(header) == 0:
+            header = np.zeros(1, dtype=HEADER)
+            header['magic'] = MAGIC
+            header['version'] = VERSION
+            header['end'] = HEADER.itemsize
+        elif header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+            print('Ecriture scan store : Format de fichier non supporté')
+            return False
+
+        # Data block and index segment, written after the end of the last complete scan
+        data = int(header['end'][0])
+        angle = np.ascontiguousarray(scan.angle, dtype='<f8')
+        cts = np.ascontiguousarray(scan.cts, dtype='<f8')
+        segment = np.zeros(1, dtype=SEGMENT)
+        segment['magic'] = SEGMENT_MAGIC
+        segment['number_of_image'] = scan.number_of_image
+        segment['number_of_pixel'] = scan.number_of_pixel
+        segment['previous'] = header['last_segment']
+        segment['data'] = data
+        segment['source_size'] = stat.st_size
+        segment['source_mtime'] = stat.st_mtime_ns
+        segment['source_hash'] = source_hash
+        segment['source'] = name.encode('utf-8')
+        rows = np.zeros(scan.number_of_image, dtype=ROW)
+        rows['image'] = np.arange(1, scan.number_of_image + 1, 1)
+        for field in ('tth', 'omega', 'chi', 'phi', 'acq_time'):
+            rows[field] = getattr(scan, field)
+
+        file.seek(data)
+        file.truncate()
+        for block in (angle, cts, segment, rows):
+            file.write(block.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+
+        # The scan is part of the store once the header points to its segment
+        header['last_segment'] = data + angle.nbytes + cts.nbytes
+        header['end'] = file.tell()
+        file.seek(0)
+        file.write(header.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    return True
+
+
+def add_directory(store, root, extensions=SCAN_EXTENSIONS):
+    """
+    Append every scan file found under root which is not already stored (one format per scan, the first of
+    extensions), the files are read concurrently
+    return the number of scans added
+    """
+    index, sources, signatures = read_index(store)
+    stored = dict(zip(sources, signatures))
+    requests = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+
+        # Extensions found for each scan name
+        scans = dict()
+        for name in sorted(files):
+            filename, extension = os.path.splitext(name)
+            if extension.upper() in extensions:
+                scans.setdefault(filename, []).append(extension)
+
+        for filename, scan_extensions in scans.items():
+            extension = min(scan_extensions, key=lambda ext: extensions.index(ext.upper()))
+            name = directory + '\\' + filename + extension
+            if not _unchanged(name, stored):
+                requests.append(file_loader.scan_request(directory, filename, extension))
+
+    # Files read by batches : the scans waiting to be written stay few
+    number_of_scan = 0
+    batch = file_loader.NUMBER_OF_THREAD
+    for start in range(0, len(requests), batch):
+        for ii, scan in file_loader.iter_files(requests[start:start + batch], ordered=False):
+            kind, directory, filename, extension = requests[start + ii]
+            if scan is not None and add_scan(store, directory + '\\' + filename + extension, scan):
+                number_of_scan += 1
+    return number_of_scan
+
+
+def read_index(store):
+    """
+    Index of the images of the store (the previous versions of the changed sources are not included)
+    return the index (array of INDEX), the list of the source names and the list of their
+    (size, modification time, hash)
+    """
+    segments = _read_segments(store)
+
+    # Last version of each source
+    latest = dict()
+    for number, segment in enumerate(segments):
+        latest[segment[0]['source']] = number
+    segments = [segments[number] for number in sorted(latest.values())]
+
+    sources = [segment[0]['source'].decode('utf-8') for segment in segments]
+    signatures = [(int(segment[0]['source_size']), int(segment[0]['source_mtime']), segment[0]['source_hash'])
+                  for segment in segments]
+
+    index = np.zeros(sum(len(segment[1]) for segment in segments), dtype=INDEX)
+    start = 0
+    for file, (segment, rows) in enumerate(segments):
+        number_of_image, number_of_pixel = len(rows), int(segment['number_of_pixel'])
+        stop = start + number_of_image
+        index['file'][start:stop] = file
+        for field in ('image', 'tth', 'omega', 'chi', 'phi', 'acq_time'):
+            index[field][start:stop] = rows[field]
+        index['number_of_pixel'][start:stop] = number_of_pixel
+        index['angle_offset'][start:stop] = segment['data']
+        index['counts_offset'][start:stop] = (int(segment['data']) + 8 * number_of_pixel
+                                              + 8 * number_of_pixel * np.arange(number_of_image))
+        start = stop
+    return index, sources, signatures
+
+
+def query(store, **ranges):
+    """
+    Images of the store whose angles are in the given ranges, e.g. query(store, tth=(155.5, 156.5), chi=(20, 40))
+    (fields : tth, omega, chi, phi, acq_time, image, file ; bounds included)
+    return the rows of the index of the selected images and the list of the source names
+    """
+    index, sources, signatures = read_index(store)
+    selected = np.ones(len(index), dtype=bool)
+    for field, (low, high) in ranges.items():
+        selected &= (index[field] >= low) & (index[field] <= high)
+    return index[selected], sources
+
+
+def load_counts(store, rows):
+    """
+    Counts of the images of rows (rows of the index, with the same number of pixel) : only the counts of the
+    images between the first and the last selected image of each scan are mapped
+    return an array (number of image, number of pixel), memory-mapped if the rows are consecutive images of one
+    scan (else a copy of the selected images), None if the images have different numbers of pixel
+    """
+    number_of_pixel = np.unique(rows['number_of_pixel'])
+    if len(number_of_pixel) > 1:
+        print('Lecture scan store : Nombres de pixels différents')
+        return None
+    if len(rows) == 0:
+        return np.zeros((0, 0))
+    number_of_pixel = int(number_of_pixel[0])
+
+    # Position of each image in the counts of its scan (the counts follow the detector angle)
+    image_size = 8 * number_of_pixel
+    counts_start = rows['angle_offset'].astype(np.int64) + image_size
+    position = (rows['counts_offset'].astype(np.int64) - counts_start) // image_size
+
+    segments = np.unique(counts_start)
+    if len(segments) == 1 and np.all(np.diff(position) == 1):
+        return np.memmap(store, dtype='<f8', mode='r', offset=int(counts_start[0] + position[0] * image_size),
+                         shape=(len(rows), number_of_pixel))
+
+    cts = np.zeros((len(rows), number_of_pixel))
+    for start in segments:
+        selected = counts_start == start
+        first, last = np.min(position[selected]), np.max(position[selected])
+        block = np.memmap(store, dtype='<f8', mode='r', offset=int(start + first * image_size),
+                          shape=(int(last - first + 1), number_of_pixel))
+        cts[selected] = block[position[selected] - first]
+    return cts
+
+
+def load_scan(store, rows):
+    """
+    Scan of the images of rows (rows of the index, with the same number of pixel), the detector angle is the one
+    of the source of the first image
+    """
+    cts = load_counts(store, rows)
+    if cts is None:
+        return None
+
+    angle = None
+    if len(rows):
+        angle = np.array(np.memmap(store, dtype='<f8', mode='r', offset=int(rows['angle_offset'][0]),
+                                   shape=(int(rows['number_of_pixel'][0]),)))
+    return scan_data.Scan(rows['tth'], rows['omega'], rows['chi'], rows['phi'], cts, rows['acq_time'], angle)
+
+
+def _read_segments(store):
+    """
+    Index segments of the store in the order of addition : list of (segment header, rows), only the segments
+    added since the last reading in this session are read
+    """
+    try:
+        with open(store, 'rb') as file:
+            header = file.read(HEADER.itemsize)
+            if len(header) < HEADER.itemsize:
+                return []
+            header = np.frombuffer(header, dtype=HEADER)
+            if header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+                return []
+
+            last_segment = int(header['last_segment'][0])
+            known_segment, known = _segments.get(store, (0, []))
+            new = []
+            offset = last_segment
+            while offset != 0 and offset != known_segment:
+                file.seek(offset)
+                segment = np.frombuffer(file.read(SEGMENT.itemsize), dtype=SEGMENT)[0]
+                if segment['magic'] != SEGMENT_MAGIC:
+                    print('Lecture scan store : Index corrompu')
+                    return []
+                rows = np.frombuffer(file.read(ROW.itemsize * int(segment['number_of_image'])), dtype=ROW)
+                new.append((segment, rows))
+                offset = int(segment['previous'])
+    except OSError:
+        return []
+
+    # The store was rewritten (the known last segment is not in the chain) : everything is read again
+    if offset != known_segment:
+        known = []
+    segments = known + new[::-1]
+    _segments[store] = (last_segment, segments)
+    return segments
+
+
+def _stored(store, name, stat, source_hash):
+    """
+    True if the source file is stored with the same content (last version of the source)
+    """
+    encoded = name.encode('utf-8')
+    for segment, rows in reversed(_read_segments(store)):
+        if segment['source'] == encoded:
+            return int(segment['source_size']) == stat.st_size and segment['source_hash'] == source_hash
+    return False
+
+
+def _unchanged(name, stored):
+    """
+    True if the source file is stored (stored : {source : signature}) and did not change since
+    (same size and modification time, or same content)
+    """
+    if name not in stored:
+        return False
+    try:
+        stat = os.stat(name)
+    except OSError:
+        return True
+
+    size, mtime, stored_hash = stored[name]
+    if size != stat.st_size:
+        return False
+    return mtime == stat.st_mtime_ns or stored_hash == scan_cache.file_hash(name)
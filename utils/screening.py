@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Define the automatic screening of the acquisitions of a scan, on all the images at once:
+    before the fit : empty images (beam off), saturated images, images whose peak is not entirely on the detector
+    after the fit : fits not converged, peaks out of the fitted pixels, widths and residuals far from the ones
+    of the neighbouring images (they change slowly along a scan)
+The outliers are found with robust statistics (median and median absolute deviation, MAD, of all the images or
+of the neighbouring images), which are not pulled by the outliers themselves. Each test gives a boolean array
+(True : image rejected), the images kept are a boolean mask.
+"""
+
+
+import numpy as np
+
+from utils import maths_functions
+from utils import peak_search
+
+
+# Threshold of the outliers [robust standard deviation : 1.4826 MAD]
+THRESHOLD = 5.
+# Fraction of the median total intensity of the images below which an image is empty
+EMPTY_FRACTION = 0.05
+# Number of consecutive pixels at the maximum of an image which are a saturation plateau
+SATURATED_PIXELS = 3
+# Minimum distance between a peak and the edge of the detector [FWHM]
+EDGE_WIDTH = 1.5
+# Number of images on each side of an image to which its width and residual are compared
+NEIGHBOURS = 3
+
+# Standard deviation of a normal distribution over its MAD
+MAD_TO_SIGMA = 1.4826
+
+
+def robust_deviation(values):
+    """
+    Distance of each value to the median, in robust standard deviations (0 if the values are all the same)
+    """
+    values = np.asarray(values, dtype=float)
+    median = np.median(values)
+    sigma = MAD_TO_SIGMA * np.median(np.abs(values - median))
+    if sigma == 0:
+        return np.zeros(values.shape)
+    return (values - median) / sigma
+
+
+def local_deviation(values, neighbours=NEIGHBOURS):
+    """
+    Distance of each value to the median of its neighbours (Hampel filter), in robust standard deviations of
+    the neighbours (at least the robust standard deviation of all the distances : the neighbours may be equal)
+    """
+    padded = np.pad(np.asarray(values, dtype=float), neighbours, mode='edge')
+    windows = peak_search.sliding_windows(padded, 2 * neighbours + 1)
+    median = np.median(windows, axis=1)
+    local_sigma = MAD_TO_SIGMA * np.median(np.abs(windows - median[:, np.newaxis]), axis=1)
+
+    distance = values - median
+    sigma = np.maximum(local_sigma, MAD_TO_SIGMA * np.median(np.abs(distance - np.median(distance))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(sigma > 0, distance / sigma, 0.)
+
+
+def screen_images(cts, saturation=None, peak=True):
+    """
+    Tests of the images before the fit
+        cts : array (number of image, number of pixel)
+        saturation : count at which the detector saturates (None : plateau of SATURATED_PIXELS pixels at the maximum)
+        peak : True if the images have one peak which has to be entirely on the detector
+    return a dictionnary {test : boolean array (number of image)}, True for the rejected images
+    """
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+    number_of_pixel = cts.shape[1]
+    flags = dict()
+
+    # Empty images : the total intensity is a small fraction of the median one
+    total = np.sum(cts, axis=1)
+    flags["empty"] = total <= EMPTY_FRACTION * np.median(total)
+
+    # Saturated images : a pixel at the saturation, or a plateau at the maximum of the image
+    maximum = np.max(cts, axis=1, keepdims=True)
+    if saturation is None:
+        top = (cts == maximum) & (maximum > 0)
+        plateau = top[:, :number_of_pixel - SATURATED_PIXELS + 1].copy()
+        for shift in range(1, SATURATED_PIXELS):
+            plateau &= top[:, shift:number_of_pixel - SATURATED_PIXELS + 1 + shift]
+        flags["saturated"] = np.any(plateau, axis=1)
+    else:
+        flags["saturated"] = maximum[:, 0] >= saturation
+
+    # Peak out of the detector : no peak, or a peak too close to an edge
+    if peak:
+        position, fwhm = peak_search.main_peaks(cts)
+        with np.errstate(invalid='ignore'):
+            flags["outside"] = ~((position - EDGE_WIDTH * fwhm >= 0)
+                                 & (position + EDGE_WIDTH * fwhm <= number_of_pixel - 1))
+    return flags
+
+
+def screen_fits(x, cts, popt, converged, threshold=THRESHOLD):
+    """
+    Tests of the fits of a gaussian_background function on the images
+        x : array (number of pixel) of the fitted pixels, cts : array (number of image, number of pixel) fitted
+        popt : array (number of image, 5) of optimal [x0, IM, H, A, B], converged : array (number of image)
+    return a dictionnary {test : boolean array (number of image)}, True for the rejected images
+    """
+    x = np.asarray(x, dtype=float)
+    cts = np.atleast_2d(np.asarray(cts, dtype=float))
+    x0, H = popt[:, 0], np.abs(popt[:, 2])
+    flags = dict()
+
+    flags["not converged"] = ~np.asarray(converged, dtype=bool)
+    flags["outside"] = ~((x0 >= x[0]) & (x0 <= x[-1]))
+
+    # Reduced chi² of each image (Poisson variance), evaluated for all the images at once
+    model = maths_functions.gauss_backg(x[np.newaxis, :], *[p[:, np.newaxis] for p in popt.T])
+    chi2 = np.mean((cts - model) ** 2 / np.maximum(model, 1.), axis=1)
+
+    # Widths and residuals far from the ones of the neighbouring images (robust statistics over the sound fits)
+    sound = ~(flags["not converged"] | flags["outside"]) & (H > 0) & (chi2 > 0)
+    flags["width"] = np.zeros(len(x0), dtype=bool)
+    flags["residual"] = np.zeros(len(x0), dtype=bool)
+    if np.any(sound):
+        width = np.log(H[sound])
+        residual = np.log(chi2[sound])
+        flags["width"][sound] = np.abs(local_deviation(width)) > threshold
+        flags["residual"][sound] = local_deviation(residual) > threshold
+    return flags
+
+
+def screen_scan(scan, saturation=None, peak=True):
+    """
+    Tests of the images of a Scan before the fit (stage of the analyses)
+    """
+    return screen_images(scan.cts, saturation, peak)
+
+
+def clean_scan(scan, flags, image_to_remove):
+    """
+    Scan without the images rejected by the screening nor the ones listed in image_to_remove (stage of the analyses)
+    """
+    return scan.remove_images(image_to_remove, kept_images(flags))
+
+
+def kept_images(flags):
+    """
+    Boolean mask of the images which pass all the tests
+    """
+    flags = list(flags.values())
+    keep = np.ones(len(flags[0]), dtype=bool)
+    for flag in flags:
+        keep &= ~flag
+    return keep
+
+
+def report(flags, numbers):
+    """
+    Print the rejected images (numbers : number of each image in the scan) and the tests they failed
+    """
+    rejected = ~kept_images(flags)
+    for ii in np.flatnonzero(rejected):
+        reasons = ', '.join(test for test, flag in flags.items() if flag[ii])
+        print(f'Image rejetée n°{numbers[ii]} : {reasons}')
+    print(f'{np.sum(rejected)} image(s) rejected out of {len(rejected)}')
@@ -4,75 +4,223 @@ Define function for read and write Seifert datafile .TTX
 """
 
 
-def read_seifert_data_TTX(directory, filename, extension='TTX'):
-    """
-    Read .ttx files.
-    Returns:
-        tth : list of 2theta angle
-        omega : list of omega angle
-        chi : list of chi angle
-        phi : list of phi angle
-        intensity: list of (list of intensity for each pixel) for each acquisition
-    """
-    # Declaration
-    tth = []
-    omega = []
-    chi = []
-    phi = []
-    intensity = []
+import time
 
+import numpy as np
+
+from utils import scan_cache
+from utils import scan_data
+
+
+# Line separating two acquisitions
+SEPARATOR = '********************************\n'
+# Characters between the detector angle and the intensity of a pixel
+PIXEL_SEPARATORS = str.maketrans(",'", '  ')
+# Size of the chunks read by the streaming reader [characters]
+CHUNK_SIZE = 1 << 16
+
+
+def read_seifert_data_TTX(directory, filename, extension='TTX', cache=True):
+    """
+    Read .ttx files (with cache=True, the parsed scan is kept in a .SCAN sidecar file and memory-mapped).
+    Returns a Scan with:
+        tth : array of 2theta angle
+        omega : array of omega angle
+        chi : array of chi angle
+        phi : array of phi angle
+        acq_time : array of acquisition time
+        angle : array of the detector angle of each pixel
+        cts : array (number of image, number of pixel) of intensity
+    """
     # Obtaining file name
     name = directory + '\\' + filename + extension
 
+    # Reading of the sidecar file if it is up to date
+    if cache:
+        scan = scan_cache.load(name)
+        if scan is not None:
+            return scan
+
     # Reading of the file
 
     try:
         with open(name, 'r') as file:
-            data = file.readlines()
+            data = file.read()
 
     except FileNotFoundError:
         print('Lecture seifert data TTX : Fichier introuvable')
 
     else:
-        # Obtaining list of line
-        line = [ln.split() for ln in data]
+        scan = parse_seifert_data_TTX(data)
 
-        # Obtaining number of pixel for one acquisition
-        number_of_point = int(line[1][4])
+        # Writing of the sidecar file for the next reads
+        if cache:
+            cached_scan = scan_cache.save(name, scan)
+            if cached_scan is not None:
+                scan = cached_scan
 
-        # Temporary variables
-        acquisition = []
-        temp = []
+        return scan
 
-        # Separation of each acquisition
-        for elem in line:
-            if elem[0] == '********************************':
-                acquisition.append(temp)
-                temp = []
-            else:
-                temp.append(elem)
 
-        # Append of the last "temp" acquisition
-        acquisition.append(temp)
+def parse_seifert_data_TTX(data):
+    """
+    Parse the text of a .TTX file, without building one list per line
+    """
+    # Separation of each acquisition, deletion of the first element : date, name of the file...
+    acquisition = data.split(SEPARATOR)[1:]
+
+    # Obtaining number of pixel for one acquisition
+    number_of_point = int(data.split('\n', 2)[1].split(':')[1])
+    number_of_image = len(acquisition)
+
+    # Each acquisition : scan number, angles, acquisition time, then one line per pixel
+    angles_lines = []
+    acq_time_lines = []
+    pixel_blocks = []
+    for acqui in acquisition:
+        scan_number_line, angles_line, acq_time_line, pixel_block = acqui.split('\n', 3)
+        angles_lines.append(angles_line)
+        acq_time_lines.append(acq_time_line.split(':')[1])
+        pixel_blocks.append(pixel_block)
 
-        # Deletion of the first element : date, name of the file...
-        acquisition.pop(0)
+    # Angles : 2theta, theta, chi, X, Y, Z, phi
+    angles = np.fromstring(' '.join(angles_lines), sep=' ').reshape(number_of_image, 7)
+    acq_time = np.fromstring(' '.join(acq_time_lines), sep=' ')
 
-        # Obtaining each angles and intensity for each acquisition
-        for acqui in acquisition:
+    # Pixels : detector angle and intensity, parsed in one pass (the angle may be followed by , or ')
+    pixels = np.fromstring(' '.join(pixel_blocks).translate(PIXEL_SEPARATORS), sep=' ')
+    pixels = pixels.reshape(number_of_image, number_of_point, 2)
 
-            intensity_one_acquisition = []
+    return scan_data.Scan(angles[:, 0], angles[:, 1], angles[:, 2], angles[:, 6],
+                          np.ascontiguousarray(pixels[:, :, 1]), acq_time, pixels[0, :, 0])
+
+
+def iter_seifert_data_TTX(directory, filename, extension='.TTX', chunk_size=CHUNK_SIZE):
+    """
+    Read .ttx files by chunks and yield one Acquisition at a time : the memory used does not depend
+    on the number of acquisition in the file
+    """
+    # Obtaining file name
+    name = directory + '\\' + filename + extension
+
+    try:
+        file = open(name, 'r')
+
+    except FileNotFoundError:
+        print('Lecture seifert data TTX : Fichier introuvable')
+
+    else:
+        with file:
+            for acquisition in iter_acquisitions(file, chunk_size):
+                yield acquisition
+
+
+def iter_acquisitions(file, chunk_size=CHUNK_SIZE):
+    """
+    Yield the acquisitions of an opened .ttx file, reading it by chunks
+    """
+    number = 0
+    heading = True
+    buffer = ''
+
+    for chunk in iter(lambda: file.read(chunk_size), ''):
+        # Only the text after the last separator can be an incomplete acquisition
+        blocks = (buffer + chunk).split(SEPARATOR)
+        buffer = blocks.pop()
+
+        for block in blocks:
+            # First element : date, name of the file...
+            if heading:
+                heading = False
+                continue
+            number += 1
+            yield parse_acquisition(block, number)
+
+    # Last acquisition of the file
+    if not heading and buffer.strip():
+        yield parse_acquisition(buffer, number + 1)
+
+
+def follow_seifert_data_TTX(directory, filename, extension='.TTX', timeout=60., poll_interval=1.):
+    """
+    Follow a .ttx file while the diffractometer writes it : yield each acquisition as soon as all its pixels
+    are written. Only the text appended since the last reading is parsed.
+    Stop when the file has not grown during timeout seconds.
+    """
+    # Obtaining file name
+    name = directory + '\\' + filename + extension
+
+    try:
+        file = open(name, 'r')
+
+    except FileNotFoundError:
+        print('Lecture seifert data TTX : Fichier introuvable')
+        return
+
+    with file:
+        number = 0
+        number_of_point = None
+        buffer = ''
+        last_growth = time.time()
+
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+
+            # Nothing new : wait for the next acquisition
+            if not chunk:
+                if time.time() - last_growth > timeout:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            last_growth = time.time()
+            blocks = (buffer + chunk).split(SEPARATOR)
+            buffer = blocks.pop()
+
+            for block in blocks:
+                # First element : date, name of the file...
+                if number_of_point is None:
+                    number_of_point = int(block.split('\n', 2)[1].split(':')[1])
+                    continue
+                # Acquisition already yielded before its separator was written
+                if not block.strip():
+                    continue
+                number += 1
+                yield parse_acquisition(block, number)
+
+            # Last acquisition : complete when its heading (3 lines) and all its pixels are written
+            if number_of_point is not None and buffer.count('\n') >= 3 + number_of_point:
+                end = _end_of_line(buffer, 3 + number_of_point)
+                number += 1
+                yield parse_acquisition(buffer[:end], number)
+                buffer = buffer[end:]
+
+
+def _end_of_line(text, number_of_line):
+    """
+    Position just after the end of the first number_of_line lines of text
+    """
+    position = -1
+    for ii in range(number_of_line):
+        position = text.find('\n', position + 1)
+    return position + 1
+
+
+def parse_acquisition(block, number):
+    """
+    Parse the text of one acquisition : scan number, angles, acquisition time, then one line per pixel
+    """
+    scan_number_line, angles_line, acq_time_line, pixel_block = block.split('\n', 3)
 
-            for pixel in range(3, 2 + (number_of_point + 1)):
-                intensity_one_acquisition.append(float(acqui[pixel][1]))
+    # Angles : 2theta, theta, chi, X, Y, Z, phi
+    angles = np.fromstring(angles_line, sep=' ')
+    acq_time = float(acq_time_line.split(':')[1])
 
-            tth.append(float(acqui[1][0]))
-            omega.append(float(acqui[1][1]))
-            chi.append(float(acqui[1][2]))
-            phi.append(float(acqui[1][6]))
-            intensity.append(intensity_one_acquisition)
+    # Pixels : detector angle and intensity
+    pixels = np.fromstring(pixel_block.translate(PIXEL_SEPARATORS), sep=' ').reshape(-1, 2)
 
-        return tth, omega, chi, phi, intensity
+    return scan_data.Acquisition(number, angles[0], angles[1], angles[2], angles[6], acq_time,
+                                 np.ascontiguousarray(pixels[:, 1]))
 
 
 def write_seifert_data_TTX(tth, omega, chi, phi, cts, directory, filename, extension='.TTX'):
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Define the stitching of all the acquisitions of a scan in one diffractogram:
+    the corrected 2theta and intensity of every pixel of every acquisition are accumulated on a common
+    2theta grid (np.bincount), the overlapping acquisitions are averaged with their exposure (1 per pixel,
+    or the acquisition time) and the Poisson errors are propagated. The memory used by the accumulation
+    only depends on the number of bin of the grid.
+"""
+
+
+import numpy as np
+
+
+# Weighting of the overlapping acquisitions
+WEIGHTS = ('counts', 'time')
+
+
+def grid_edges(tth_min, tth_max, step):
+    """
+    Edges of the bins of the 2theta grid [tth_min, tth_max] with a step of step
+    """
+    number_of_bin = max(int(np.ceil((tth_max - tth_min) / step - 1e-9)), 1)
+    return tth_min + step * np.arange(0, number_of_bin + 1, 1)
+
+
+def stitch(tth_real, cts_real, step, tth_min=None, tth_max=None, weight='counts', acq_time=None, variance=None):
+    """
+    Stitch the acquisitions on the 2theta grid [tth_min, tth_max] (None : range of the data) with a step of step
+        tth_real, cts_real : corrected 2theta and intensity, arrays (number of image, number of point)
+        weight : 'counts' every pixel has the same exposure (mean of the intensities),
+                 'time' the exposure of a pixel is the acquisition time of its image (acq_time) : count rate
+        variance : variance of cts_real (None : Poisson, the variance is the intensity)
+    return the centers of the bins, the intensity, its standard deviation and the number of pixel of each bin
+    (intensity and standard deviation are nan in the empty bins)
+    """
+    if weight not in WEIGHTS:
+        print(f'Assemblage diffractogramme : pondération inconnue (choisir parmi {WEIGHTS})')
+        return None
+
+    tth_real = np.asarray(tth_real, dtype=float)
+    cts_real = np.asarray(cts_real, dtype=float)
+    if variance is None:
+        variance = cts_real
+
+    if tth_min is None:
+        tth_min = np.min(tth_real)
+    if tth_max is None:
+        tth_max = np.max(tth_real)
+    edges = grid_edges(tth_min, tth_max, step)
+    number_of_bin = len(edges) - 1
+
+    # Bin of each pixel, the pixels out of the grid are not used (the last edge belongs to the last bin)
+    index = np.floor((tth_real - edges[0]) / step).astype(int)
+    index[tth_real == edges[-1]] = number_of_bin - 1
+    inside = (index >= 0) & (index < number_of_bin)
+    index = index[inside]
+
+    # Accumulation on the grid
+    total = np.bincount(index, weights=cts_real[inside], minlength=number_of_bin)
+    total_variance = np.bincount(index, weights=np.broadcast_to(variance, cts_real.shape)[inside],
+                                 minlength=number_of_bin)
+    number_of_pixel = np.bincount(index, minlength=number_of_bin)
+
+    # Exposure of each bin : number of pixel, or sum of the acquisition time of the pixels
+    if weight == 'time':
+        exposure = np.broadcast_to(np.asarray(acq_time, dtype=float)[:, np.newaxis], cts_real.shape)
+        total_exposure = np.bincount(index, weights=exposure[inside], minlength=number_of_bin)
+    else:
+        total_exposure = number_of_pixel.astype(float)
+
+    # Mean intensity and propagated error : sum of the intensities and of the variances over the exposure
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intensity = np.where(number_of_pixel > 0, total / total_exposure, np.nan)
+        error = np.where(number_of_pixel > 0, np.sqrt(total_variance) / total_exposure, np.nan)
+
+    centers = (edges[:-1] + edges[1:]) / 2
+    return centers, intensity, error, number_of_pixel
+
+
+def write_diffractogram(tth, intensity, error, directory, filename, extension='.XY'):
+    """
+    Write a diffractogram in a text file : 2theta, intensity and standard deviation columns
+    (the empty bins are not written)
+    """
+    name = directory + '\\' + filename + extension
+    keep = np.isfinite(intensity)
+
+    try:
+        np.savetxt(name, np.stack([tth[keep], intensity[keep], error[keep]], axis=-1), fmt='%.5f',
+                   header='2theta [deg]  intensity  error')
+
+    except FileNotFoundError:
+        print('Ecriture diffractogramme : Dossier introuvable')
+
+    else:
+        print('Diffractogram saved')